@@ -0,0 +1,27 @@
+import pytest
+
+from nanorc.tools.conf_server_bench import BenchmarkServer, run_load, summarise, app_queries
+
+'''
+These tests start nanorc's internal configuration server in its own process, and make many clients fetch their
+init and conf data from it at the same time, like the apps do.
+'''
+
+n_clients = 1000
+
+@pytest.fixture
+def server(request):
+    server = BenchmarkServer(18547, request.param, n_apps=n_clients, payload_kb=10).start()
+    yield server
+    server.stop()
+
+
+@pytest.mark.parametrize("server", ['pool'], indirect=True)
+def test_concurrent_fetches(server):
+    queries = app_queries([f'app{i:04d}' for i in range(n_clients)])
+    latencies, n_errors, wall_time = run_load(server.port, queries, n_clients)
+    s = summarise(latencies, n_errors, wall_time)
+    print(f'\n{s["requests"]} requests, {n_errors} errors, p50 {s["p50"]*1000:.1f}ms, p99 {s["p99"]*1000:.1f}ms, {s["throughput"]:.0f} req/s')
+
+    assert n_errors == 0
+    assert s['requests'] == 2*n_clients
@@ -0,0 +1,144 @@
+import json
+import os
+import pytest
+import requests
+import time
+
+kubernetes = pytest.importorskip("kubernetes")
+
+from rich.console import Console
+from nanorc.pmdesc import pm_desc
+from nanorc.k8spm import K8SProcessManager
+from nanorc.tools.fake_k8s import FakeK8sServer
+
+n_pods_list = [10, 100, 1000]
+results = {}
+
+'''
+These tests run K8SProcessManager against a local fake Kubernetes API server (nanorc.tools.fake_k8s),
+so they don't need a cluster. They measure the boot, status and terminate times, and count the API
+calls made in each step, for an increasing number of pods.
+Set NANORC_K8S_BENCHMARK_OUTPUT to a file name to get the results as JSON.
+'''
+
+def make_boot_info(n_pods, partition):
+    apps = {
+        f'app{i:04d}': {
+            'exec': 'daq_application',
+            'port': 3333,
+        } for i in range(n_pods)
+    }
+    return {
+        'apps': apps,
+        'order': list(apps.keys()),
+        'env': {
+            'DUNEDAQ_PARTITION': partition,
+        },
+        'rte_script': '/fake/daq_app_rte.sh',
+        'exec': {
+            'daq_application': {
+                'image': 'fake/daq-image:latest',
+                'cmd': 'daq_application',
+                'args': ['--name', '{APP_NAME}', '-c', 'rest://localhost:{APP_PORT}'],
+                'env': {},
+            }
+        },
+        'response_listener': {
+            'port': 56789,
+        },
+    }
+
+
+@pytest.fixture
+def fake_cluster(tmp_path, monkeypatch, request):
+    server = FakeK8sServer(**getattr(request, 'param', {})).start()
+    monkeypatch.setenv('KUBECONFIG', server.write_kubeconfig(str(tmp_path/'kubeconfig')))
+    # no dev area mounts
+    monkeypatch.delenv('DBT_WORKAREA_ENV_SCRIPT_SOURCED', raising=False)
+    monkeypatch.chdir(tmp_path)
+    yield server
+    server.stop()
+
+
+def api_calls(server):
+    calls = requests.get(f'{server.url}/fake/calls').json()
+    requests.delete(f'{server.url}/fake/calls')
+    return calls
+
+
+def make_pm():
+    return K8SProcessManager(
+        console = Console(quiet=True),
+        cluster_config = pm_desc('k8s://127.0.0.1:31000'),
+        connections = {},
+    )
+
+
+@pytest.mark.parametrize("n_pods", n_pods_list)
+def test_boot_status_terminate(fake_cluster, n_pods):
+    pm = make_pm()
+    partition = f'benchmark-{n_pods}'
+
+    start = time.time()
+    pm.boot(make_boot_info(n_pods, partition), timeout=120, conf_loc='http://localhost:8547')
+    boot_time = time.time() - start
+    boot_calls = api_calls(fake_cluster)
+    assert all(desc.ready for desc in pm.apps.values())
+
+    start = time.time()
+    for desc in pm.apps.values():
+        assert desc.proc.is_alive()
+        assert desc.proc.status() == 'Running'
+    status_time = time.time() - start
+    status_calls = api_calls(fake_cluster)
+
+    start = time.time()
+    pm.terminate()
+    terminate_time = time.time() - start
+    terminate_calls = api_calls(fake_cluster)
+
+    results[n_pods] = {
+        'boot_time': boot_time,
+        'status_time': status_time,
+        'terminate_time': terminate_time,
+        'boot_calls': boot_calls,
+        'status_calls': status_calls,
+        'terminate_calls': terminate_calls,
+    }
+    print(f'\n{n_pods} pods: boot {boot_time:.2f}s ({sum(boot_calls.values())} calls), '
+          f'status {status_time:.2f}s ({sum(status_calls.values())} calls), '
+          f'terminate {terminate_time:.2f}s ({sum(terminate_calls.values())} calls)')
+    print(json.dumps(boot_calls, indent=2))
+
+    # boot creates one pod and one service per app (and one for the response listener) and watches the pods, it shouldn't poll them
+    assert boot_calls.get('POST /api/v1/namespaces/{ns}/pods') == n_pods
+    assert boot_calls.get('POST /api/v1/namespaces/{ns}/services') == n_pods+1
+    assert boot_calls.get('GET /api/v1/namespaces/{ns}/pods', 0) == 0
+    assert sum(boot_calls.values()) <= 2*n_pods + 10
+    # status is 2 reads per app
+    assert sum(status_calls.values()) == 2*n_pods
+
+    output = os.getenv('NANORC_K8S_BENCHMARK_OUTPUT')
+    if output:
+        with open(output, 'w') as f:
+            json.dump(results, f, indent=2)
+
+
+@pytest.mark.parametrize("fake_cluster", [{'pod_failure_rate': 0.2, 'pod_start_latency': 0.2}], indirect=True)
+def test_boot_with_failures(fake_cluster):
+    n_pods = 50
+    pm = make_pm()
+
+    start = time.time()
+    pm.boot(make_boot_info(n_pods, 'benchmark-failures'), timeout=60, conf_loc='http://localhost:8547')
+    boot_time = time.time() - start
+
+    # the failed pods are reported from the watch, we don't wait for the timeout
+    assert boot_time < 30
+    ready = [n for n, desc in pm.apps.items() if desc.ready]
+    failed = [n for n, desc in pm.apps.items() if not desc.ready]
+    print(f'\n{len(ready)} pods ready, {len(failed)} failed in {boot_time:.2f}s')
+    for name in failed:
+        assert pm.apps[name].proc.status().startswith('Terminated')
+
+    pm.terminate()
@@ -46,6 +46,15 @@ from nanorc.nano_context import NanoContext
 @click.option('--cfg-dumpdir', type=click.Path(), default="./", help='Path where the config gets copied on start')
 @click.option('--dotnanorc', type=click.Path(), default="~/.nanorc.json", help='A JSON file which has auth/socket for the DB services')
 @click.option('--kerberos/--no-kerberos', default=False, help='Whether you want to use kerberos for communicating between processes')
+@click.option('--config-cache/--no-config-cache', default=True, help='Whether to cache the configurations from the configuration service (db://), and the encoding of the configuration directories, in ~/.cache/nanorc')
+@click.option('--offline-config', is_flag=True, default=False, help='Use the latest cached version of db:// configurations without asking the configuration service')
+@click.option('--perf-history/--no-perf-history', default=True, help='Whether to record the timings of every transition in ~/.cache/nanorc/perf/history.sqlite (see nano-perf-history)')
+@click.option('--adaptive-timeouts/--no-adaptive-timeouts', default=False, help='Fail the apps which take much longer than usual to reply to a transition before the timeout, from the history of their reply times (needs --perf-history)')
+@click.option('--adaptive-timeout-factor', type=float, default=3., help='With --adaptive-timeouts, an app is failed after this many times the p99 of its reply times')
+@click.option('--adaptive-timeout-floor', type=float, default=10., help='With --adaptive-timeouts, an app is never failed before this many seconds')
+@click.option('--conf-server-mode', type=click.Choice(['threaded', 'pool']), default='threaded', help='How the internal configuration server serves the apps: a thread per connection, or a fixed pool of threads (for many apps)')
+@click.option('--prefetch-run-number', is_flag=True, default=False, help='Reserve the next run number when a run starts, so that the next start doesn\'t wait for the run number DB (an unused reservation is voided when nanorc exits)')
+@click.option('--background-jobs/--no-background-jobs', default=True, help='Whether to make the logbook entries and run registry uploads in the background (journaled in ~/.cache/nanorc/journal and retried), rather than before sending start and drain_dataflow')
 @click.option('--pm', type=str, default="ssh://", help='Process manager, can be: ssh://, kind://, or k8s://np04-srv-015:31000, for example', callback=argval.validate_pm)
 @click.option('--web/--no-web', is_flag=True, default=False, help='whether to spawn webui')
 @click.option('--tui/--no-tui', is_flag=True, default=False, help='whether to use TUI')
@@ -55,7 +64,7 @@ from nanorc.nano_context import NanoContext
 @click.argument('partition-label', type=str, callback=argval.validate_partition)
 @click.pass_obj
 @click.pass_context
-def np04cli(ctx, obj, traceback, loglevel, elisa_conf, log_path, cfg_dumpdir, dotnanorc, kerberos, timeout, partition_number, partition_label, web, tui, pm, cfg_dir, user):
+def np04cli(ctx, obj, traceback, loglevel, elisa_conf, log_path, cfg_dumpdir, dotnanorc, kerberos, timeout, partition_number, partition_label, web, tui, pm, cfg_dir, user, config_cache, offline_config, conf_server_mode, perf_history, adaptive_timeouts, adaptive_timeout_factor, adaptive_timeout_floor, background_jobs, prefetch_run_number):
 
 
     if not elisa_conf:
@@ -120,7 +129,7 @@ def np04cli(ctx, obj, traceback, loglevel, elisa_conf, log_path, cfg_dumpdir, do
             console = obj.console,
             top_cfg = cfg_dir,
             partition_label = partition_label,
-            run_num_mgr = DBRunNumberManager(rundb_socket),
+            run_num_mgr = DBRunNumberManager(rundb_socket, prefetch=prefetch_run_number),
             run_registry = DBConfigSaver(runreg_socket),
             logbook_type = elisa_conf,
             timeout = timeout,
@@ -128,6 +137,14 @@ def np04cli(ctx, obj, traceback, loglevel, elisa_conf, log_path, cfg_dumpdir, do
             port_offset = port_offset,
             pm = pm,
             session_handler = cern_auth,
+            config_cache = config_cache,
+            offline_config = offline_config,
+            conf_server_mode = conf_server_mode,
+            perf_history = perf_history,
+            adaptive_timeouts = adaptive_timeouts,
+            adaptive_timeout_factor = adaptive_timeout_factor,
+            adaptive_timeout_floor = adaptive_timeout_floor,
+            background_jobs = background_jobs,
         )
 
         ctx.command.shell.prompt = f"{cern_auth.nanorc_user.username}@np04rc> "
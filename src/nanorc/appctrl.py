@@ -228,6 +228,7 @@ class AppCommander:
         self.listener_host = response_host
         self.proxy = proxy
         self.response_queue = Queue()
+        self.response_time = None # when the last response was received
         self.sent_cmd = None
         self.connection_timeout = connection_timeout
 
@@ -235,7 +236,8 @@ class AppCommander:
         pass
 
     def notify(self, response):
-        self.response_queue.put(response)
+        # stamped now, the node only polls the responses every so often
+        self.response_queue.put((time.time(), response))
 
     def ping(self):
 
@@ -306,7 +308,7 @@ class AppCommander:
         """
         try:
             # self.log.info(f"Checking for answers from {self.app} {self.sent_cmd}")
-            r = self.response_queue.get(block=(timeout>0), timeout=timeout)
+            self.response_time, r = self.response_queue.get(block=(timeout>0), timeout=timeout)
             self.log.debug(f"Received reply from {self.app} to {self.sent_cmd}")
             self.sent_cmd = None
 
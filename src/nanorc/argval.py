@@ -89,6 +89,13 @@ def validate_conf(ctx, param, top_cfg):
             path=top_cfg,
             netloc='', params='', query='', fragment='')
         return confurl
+    from .lazyconf import is_bundle
+    if is_bundle(confurl.path):
+        confurl=ParseResult(
+            scheme='bundle',
+            path=top_cfg,
+            netloc='', params='', query='', fragment='')
+        return confurl
     if path.exists(confurl.path) and confurl.path[-5:]=='.json':
         confurl=ParseResult(
             scheme='topjson',
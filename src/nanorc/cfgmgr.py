@@ -1,5 +1,6 @@
 import os.path
 import os
+import logging
 import tempfile
 import json
 import copy as cp
@@ -8,6 +9,8 @@ import requests
 import importlib.resources as resources
 from . import confdata
 from urllib.parse import urlparse
+from collections.abc import Mapping
+from .lazyconf import LazyConfigData, bundle_suffix
 
 class SessionNamespaceIncompatible(Exception):
     def __init__(self, namespace, session, conf):
@@ -19,19 +22,106 @@ class WrongConfigurationType(Exception):
         super().__init__(f'The configuration "{conf.geturl()}" is incompatible with the "{pm}" process manager')
 
 
+def transform_init_connections(init_data:dict, port_offset:int, hosts:dict, external_connections:list) -> dict:
+    """
+    Returns the init data with the ports of the connections offset and their hosts resolved.
+    Only the connections that change are copied.
+    """
+    from nanorc.utils import parse_string
+
+    if not "connections" in init_data:
+        return init_data
+
+    log = logging.getLogger('ConfigManager')
+    debug = log.isEnabledFor(logging.DEBUG)
+
+    connections = []
+    for connection in init_data['connections']:
+        uri = connection['uri']
+        if "queue://" in uri:
+            connections.append(connection)
+            continue
+
+        origuri = uri
+        if not connection['id']['uid'] in external_connections:
+            try:
+                port = urlparse(uri).port
+                uri = uri.replace(f':{port}', f':{port + port_offset}', 1)
+            except Exception as e:
+                if debug:
+                    log.debug(f" - '{connection['id']['uid']}' ('{uri}') port wasn\'t offset, reason: {str(e)}")
+
+        uri = parse_string(uri, hosts)
+        if debug:
+            log.debug(f" - '{connection['id']['uid']}': {uri} ({origuri})")
+
+        connections.append({**connection, 'uri': uri} if uri != origuri else connection)
+
+    return {
+        **init_data,
+        'connections': connections,
+    }
+
+
+class DBConfigCache:
+    """
+    The documents of the configuration service, cached in ~/.cache/nanorc/db-configs/<name>/<version>.pickle
+    A name+version never changes once uploaded, so the only thing to check is which version is the latest.
+    """
+    def __init__(self, conf_name):
+        from .utils import get_config_cache_dir
+        self.log = logging.getLogger('DBConfigCache')
+        self.path = os.path.join(get_config_cache_dir('db-configs'), conf_name)
+
+    def _file(self, version):
+        return os.path.join(self.path, f'{version}.pickle')
+
+    def get(self, version):
+        import pickle
+        try:
+            with open(self._file(version), 'rb') as f:
+                return pickle.load(f)
+        except FileNotFoundError:
+            return None
+        except Exception as e:
+            self.log.debug(f'Couldn\'t read {self._file(version)}: {str(e)}')
+            return None
+
+    def put(self, version, data):
+        from .utils import dump_to_cache
+        try:
+            dump_to_cache(self._file(version), data)
+        except Exception as e:
+            self.log.debug(f'Couldn\'t cache {self._file(version)}: {str(e)}')
+
+    def latest_version(self):
+        if not os.path.isdir(self.path):
+            return None
+        versions = [
+            int(f.replace('.pickle', '')) for f in os.listdir(self.path)
+            if f.endswith('.pickle') and f.replace('.pickle', '').isdigit()
+        ]
+        return str(max(versions)) if versions else None
+
+
 class ConfigManager:
 
-    def __init__(self, log, config_url, process_manager_description, port_offset=0, session=None, upload_to=None):
+    def __init__(self, log, config_url, process_manager_description, port_offset=0, session=None, upload_to=None, use_config_cache=True, offline_config=False):
         super().__init__()
         self.process_manager_description = process_manager_description
         self.log = log
-        self.conf_str = ''
         self.boot = {}
         self.port_offset = port_offset
         self.log.debug(f'{str(config_url)} {port_offset=}')
         self.scheme = None
         self.ignore_for_custom_cmd = ['init', 'conf', 'boot', 'daqconf_multiru_gen', 'dromap', 'config']
         self.conf_server = upload_to
+        self.use_config_cache = use_config_cache
+        self.offline_config = offline_config
+        self.conf_service_timeout = 60
+        self.conf_service_revalidation_timeout = 5
+        self.source_bundle = None # set if the configuration comes from a bundle, so that it can be archived as-is
+        self.source_dir = None # set if the configuration comes from a directory
         self.conf_data, self.config_query_string = self.fetch_configuration(config_url)
         self.log.debug(f'"{config_url.path}" content: {list(self.conf_data.keys())}')
 
@@ -54,24 +144,31 @@ class ConfigManager:
         self._log_diff('NanoRC\'s boot parsing', self.boot, self.conf_data['boot'])
 
         if process_manager_description.use_sshpm():
-            new_data = self._offset_ports(self.conf_data)
-            self._log_diff('NanoRC\'s port offsetting', self.conf_data, new_data)
-            self.conf_data = new_data
-
-            new_data = self._resolve_hostnames(self.conf_data)
-            self._log_diff('NanoRC\'s host resolution', self.conf_data, new_data)
-            self.conf_data = new_data
+            if isinstance(self.conf_data, LazyConfigData):
+                # done when (and if) each app's init data is loaded
+                self.conf_data.set_connections_transform(**self._connections_transform())
+            else:
+                new_data = self._transform_connections(self.conf_data)
+                self._log_diff('NanoRC\'s port offsetting and host resolution', self.conf_data, new_data)
+                self.conf_data = new_data
 
         self.custom_commands = self._get_custom_commands_from_dict(self.conf_data)
         config_url._replace(scheme = '')
         from pathlib import Path
         p = Path(config_url.geturl())
-        config_url = p.name.replace('_', '-').replace('/', '').replace(':', '').replace('.', '').lower()
+        name = p.name.removesuffix(bundle_suffix) if self.source_bundle else p.name
+        config_url = name.replace('_', '-').replace('/', '').replace(':', '').replace('.', '').lower()
 
-        self.conf_server.add_configuration_data(config_url, self.conf_data)
+        if isinstance(self.conf_data, LazyConfigData):
+            self.conf_server.add_configuration_index(config_url, self.conf_data)
+        else:
+            # the server shares the pieces which are identical in several apps or configurations, only its copy is kept
+            self.conf_data = self.conf_server.add_configuration_data(config_url, self.conf_data)
         self.conf_url = f'{self.conf_server.get_conf_address_prefix()}?name={config_url}'
 
     def _log_diff(self, title, dict_new, dict_old):
+        if not self.log.isEnabledFor(logging.DEBUG):
+            return # this is expensive on big configurations
         from deepdiff import DeepDiff
         dd = DeepDiff(dict_new, dict_old)
         dd = dd.to_json()
@@ -134,34 +231,84 @@ class ConfigManager:
 
         version = config_url.query
         conf_name = config_url.netloc
-        r = None
+        cache = DBConfigCache(conf_name) if self.use_config_cache else None
 
         if version:
             self.log.info(f'Using version {version} of \'{conf_name}\'.')
-            conf_query_str = svc_url+'/retrieveVersion?name='+conf_name+'&version='+version
         else:
             self.log.info(f'Using latest version of \'{conf_name}\'.')
+
+            if self.offline_config:
+                version = cache.latest_version() if cache else None
+                if version is None:
+                    raise RuntimeError(f'No cached version of the configuration {conf_name}, cannot run offline')
+                self.log.warning(f'Offline: using the cached version {version} of \'{conf_name}\', it may not be the latest')
+            elif cache:
+                # cheap check of the latest version, instead of retrieving it
+                try:
+                    version = self.get_latest_configuration_version(svc_url, conf_name)
+                except requests.exceptions.RequestException as e:
+                    version = cache.latest_version()
+                    if version is None:
+                        raise RuntimeError(f'Couldn\'t reach the configuration service at {svc_url}, and {conf_name} was never cached') from e
+                    self.log.warning(f'Couldn\'t reach the configuration service at {svc_url} ({str(e)}), using the cached version {version} of \'{conf_name}\', it may not be the latest')
+                except Exception as e:
+                    self.log.debug(f'Couldn\'t list the versions of \'{conf_name}\': {str(e)}')
+
+        if version:
+            conf_query_str = svc_url+'/retrieveVersion?name='+conf_name+'&version='+str(version)
+            if cache:
+                data = cache.get(version)
+                if data is not None:
+                    self.log.info(f'Using the cached version {version} of \'{conf_name}\'')
+                    return (data, conf_query_str)
+        else:
             conf_query_str = svc_url+'/retrieveLast?name='+conf_name
 
+        r = None
         try:
             self.log.debug(f'Configuration request: http://{conf_query_str}')
-            r = requests.get("http://"+conf_query_str)
+            r = requests.get("http://"+conf_query_str, timeout=self.conf_service_timeout)
             if r.status_code == 200:
-                return (r.json(), conf_query_str)
+                data = r.json()
+                if cache and version:
+                    cache.put(version, data)
+                return (data, conf_query_str)
             else:
                 raise RuntimeError(f'Couldn\'t get the configuration {conf_name} from {svc_url}')
 
         except Exception as e:
             if r:
-                self.log.error(f'Couldn\'t get the configuration from the conf service (http://{self.conf_str})\nService response: {json.loads(r.text).get("message",r.text)}\nException: {str(e)}')
+                self.log.error(f'Couldn\'t get the configuration from the conf service (http://{conf_query_str})\nService response: {json.loads(r.text).get("message",r.text)}\nException: {str(e)}')
             else:
-                self.log.error(f'Something went horribly wrong while getting http://{self.conf_str}\nException: {str(e)}')
-            exit(1)
+                self.log.error(f'Something went horribly wrong while getting http://{conf_query_str}\nException: {str(e)}')
+            raise RuntimeError(f'Couldn\'t get the configuration {conf_name} from {svc_url}') from e
+
+
+    def get_latest_configuration_version(self, svc_url, conf_name):
+        r = requests.get(
+            f'http://{svc_url}/listVersions?name={conf_name}',
+            timeout = self.conf_service_revalidation_timeout
+        )
+        if r.status_code != 200:
+            raise RuntimeError(f'The configuration service answered {r.status_code} when listing the versions of {conf_name}')
+
+        versions = r.json()
+        if isinstance(versions, dict):
+            versions = versions.get('versions', [])
+        if not versions:
+            raise RuntimeError(f'No version of {conf_name} in the configuration service')
+        return str(max(int(v) for v in versions))
 
 
     def fetch_from_file_system(self, config_url):
-        from .utils import get_json_recursive
-        return (get_json_recursive(config_url.path), f'file://{config_url.path}')
+        # only boot.json and the custom commands are needed here, the rest is read when the apps ask for it
+        conf_data = LazyConfigData(config_url.path)
+        if conf_data.is_bundle():
+            self.source_bundle = conf_data.path
+            return (conf_data, f'bundle://{config_url.path}')
+        self.source_dir = conf_data.path
+        return (conf_data, f'file://{config_url.path}')
 
 
     def _import_data(self, cfg_path: dict) -> dict:
@@ -180,13 +327,16 @@ class ConfigManager:
         std_cmd = ['init', 'conf']
 
         for app_name, app_data in data.items():
-            if type(app_data) is not dict:
+            if not isinstance(app_data, Mapping):
                 continue
 
-            for command_name, command_data in app_data.items():
+            # don't look at the standard commands at all, they're big and may not be loaded yet
+            for command_name in app_data:
                 if command_name in std_cmd:
                     continue
 
+                command_data = app_data[command_name]
+
                 if type(command_data) is not dict:
                     continue
 
@@ -203,69 +353,32 @@ class ConfigManager:
     def get_custom_commands(self):
         return self.custom_commands
 
-    def _resolve_hostnames(self, conf_data):
-        conf_port_host_resolved = cp.deepcopy(conf_data)
-
-        hosts = self.boot.get('hosts-data',{})
-        from nanorc.utils import parse_string
-
-        for app_name, app_data in conf_port_host_resolved.items():
+    def _transform_connections(self, conf_data):
+        # Offsets the ports and resolves the hosts of the connections in one go.
+        # Only the apps, init data and connections that change are copied, the rest
+        # of the tree is shared with conf_data (which isn't modified)
+        transformed = dict(conf_data)
+        for app_name, app_data in conf_data.items():
             if not type(app_data) == dict:
                 continue
 
-            if not 'init' in app_data:
+            init_data = app_data.get('init')
+            if type(init_data) != dict or not "connections" in init_data:
                 continue
 
-            init_data = app_data['init']
-
-            if not "connections" in init_data:
-                return conf_data
-
-            for connection in init_data['connections']:
-                if "queue://" in connection['uri']:
-                    continue
-
-                origuri = connection['uri']
-                connection['uri'] = parse_string(connection['uri'], hosts)
-                self.log.debug(f" - '{connection['id']['uid']}': {connection['uri']} ({origuri})")
-
-            conf_port_host_resolved[app_name]['init'] = init_data
-
-        return conf_port_host_resolved
-
-
-    def _offset_ports(self, conf_data):
-        conf_port_offset = cp.deepcopy(conf_data)
-        external_connections = self.boot.get('external_connections', [])
-
-        for app_name, app_data in conf_port_offset.items():
-            if not type(app_data) == dict:
-                continue
-
-            if not 'init' in app_data:
-                continue
-
-            init_data = app_data['init']
-            if not "connections" in init_data:
-                continue
-
-            for connection in init_data['connections']:
-                if "queue://" in connection['uri']:
-                    continue
-
-                if not connection['id']['uid'] in external_connections:
-                    try:
-                        port = urlparse(connection['uri']).port
-                        newport = port + self.port_offset
-                        connection['uri'] = connection['uri'].replace(str(port), str(newport))
-                        self.log.debug(f" - '{connection['id']['uid']}': {connection['uri']}")
-                    except Exception as e:
-                        self.log.debug(f" - '{connection['id']['uid']}' ('{connection['uri']}') port wasn\'t offset, reason: {str(e)}")
-
-            conf_port_offset[app_name]['init'] = init_data
+            transformed[app_name] = {
+                **app_data,
+                'init': transform_init_connections(init_data, **self._connections_transform()),
+            }
 
-        return conf_port_offset
+        return transformed
 
+    def _connections_transform(self):
+        return {
+            'port_offset': self.port_offset,
+            'hosts': self.boot.get('hosts-data',{}),
+            'external_connections': self.boot.get('external_connections', []),
+        }
 
 
     def _load_boot(self, config, port_offset, resolve_hostname):
@@ -8,11 +8,11 @@ import json
 import copy
 import requests
 import tempfile
+from contextlib import contextmanager, nullcontext
 from .statefulnode import StatefulNode
 from .node import SubsystemNode
 from .cfgmgr import ConfigManager
 #from .credmgr import credentials,Authentication
-from distutils.dir_util import copy_tree
 
 # Straight from stack overflow
 # https://stackoverflow.com/a/17081026/8475064
@@ -20,48 +20,309 @@ def make_tarfile(output_filename, source_dir):
     with tarfile.open(output_filename, "w:gz") as tar:
         tar.add(source_dir, arcname=os.path.basename(source_dir))
 
-def save_conf_to_dir(topnode, outdir, runtime_data):
-
-    for node in PreOrderIter(topnode):
-
-        if isinstance(node, SubsystemNode):
-
-            this_path = ""
-            for parent in node.path:
-                this_path += "/"+parent.name
-
-            full_path = outdir+this_path
-            os.makedirs(full_path)
-
-            location = node.cfgmgr.get_conf_location(for_apps=False)
-
-            if os.path.isdir(location):
-                copy_tree(location, full_path)
-
+# location -> (ETag, pretty-printed configuration), most runs have the same configuration as the previous one
+_full_configuration_cache = {}
+
+def _subsystem_configuration_files(node) -> list:
+    """
+    The files of the configuration of one subsystem (what doesn't depend on the run), as (file name, content) pairs.
+    The content is either bytes, or the Path of a file to copy as-is.
+    """
+    from pathlib import Path
+    files = []
+    location = node.cfgmgr.get_conf_location(for_apps=False)
+
+    if node.cfgmgr.source_bundle:
+        # the bundle is archived as-is, with what nanorc changed in it on the side
+        files.append((os.path.basename(node.cfgmgr.source_bundle), Path(node.cfgmgr.source_bundle)))
+        transform = node.cfgmgr.conf_data.connections_transform
+        if transform:
+            files.append(('connections_transform.json', json.dumps(transform, indent=4, sort_keys=True).encode()))
+
+    elif os.path.isdir(location):
+        for root, dirs, filenames in os.walk(location):
+            for filename in filenames:
+                full_path = os.path.join(root, filename)
+                files.append((os.path.relpath(full_path, location), Path(full_path)))
+
+    else:
+        etag, full_configuration = _full_configuration_cache.get(location, (None, None))
+        r = requests.get(location, headers={'If-None-Match': etag} if etag else {}, timeout=60)
+        if r.status_code == 304:
+            pass # same as for the previous run
+        elif r.status_code == 200:
+            config = r.json()
+            full_configuration = json.dumps(config, indent=4, sort_keys=True).encode()
+            if r.headers.get('ETag'):
+                _full_configuration_cache[location] = (r.headers['ETag'], full_configuration)
+        else:
+            raise RuntimeError(f'Couldn\'t get the configuration {location}')
+        files.append(('full_configuration.json', full_configuration))
+    return files
+
+
+def _subsystem_run_configuration(node, runtime_data, configuration_files:list=None) -> list:
+    """
+    The files of the run configuration of one subsystem: its configuration files, and the runtime data.
+    """
+    files = list(configuration_files) if configuration_files is not None else _subsystem_configuration_files(node)
+    rd = node.cfgmgr.generate_data_for_module(runtime_data)
+    files.append(('runtime_data.json', json.dumps(rd, indent=4, sort_keys=True).encode()))
+    return files
+
+
+def get_configuration_files(topnode, max_workers=8) -> dict:
+    """
+    The configuration files of all the subsystems (subsystem path -> files), fetched concurrently.
+    They don't depend on the run, so they can be fetched before the run number is known, and passed to get_run_configuration.
+    """
+    from concurrent.futures import ThreadPoolExecutor
+
+    subsystems = [node for node in PreOrderIter(topnode) if isinstance(node, SubsystemNode)]
+    if not subsystems:
+        return {}
+
+    with ThreadPoolExecutor(max_workers=min(len(subsystems), max_workers)) as executor:
+        futures = [
+            (node, executor.submit(_subsystem_configuration_files, node))
+            for node in subsystems
+        ]
+        return {"/".join(parent.name for parent in node.path): future.result() for node, future in futures}
+
+
+def get_run_configuration(topnode, runtime_data, max_workers=8, configuration_files:dict=None) -> list:
+    """
+    The files of the run configuration of all the subsystems, as (path relative to the run configuration directory, content) pairs.
+    The subsystems are fetched concurrently, unless their configuration files are given (from get_configuration_files).
+    """
+    from concurrent.futures import ThreadPoolExecutor
+
+    subsystems = [node for node in PreOrderIter(topnode) if isinstance(node, SubsystemNode)]
+    if not subsystems:
+        return []
+
+    if configuration_files is None:
+        configuration_files = {}
+
+    with ThreadPoolExecutor(max_workers=min(len(subsystems), max_workers)) as executor:
+        futures = [
+            (node, executor.submit(_subsystem_run_configuration, node, runtime_data, configuration_files.get("/".join(parent.name for parent in node.path))))
+            for node in subsystems
+        ]
+        ret = []
+        for node, future in futures:
+            this_path = "/".join(parent.name for parent in node.path)
+            ret.append((this_path, None)) # the subsystem directory itself
+            ret += [(f'{this_path}/{filename}', content) for filename, content in future.result()]
+        return ret
+
+
+def content_digest(content) -> str:
+    import hashlib
+    if isinstance(content, bytes):
+        return hashlib.sha256(content).hexdigest()
+    h = hashlib.sha256()
+    with open(content, 'rb') as f:
+        for chunk in iter(lambda: f.read(1<<20), b''):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+def run_configuration_digest(files) -> str:
+    """Hash of the whole run configuration (the configurations and the runtime data), from the digests of its files"""
+    import hashlib
+    h = hashlib.sha256()
+    for path, digest in sorted(files):
+        h.update(f'{path}\0{digest}\n'.encode())
+    return h.hexdigest()
+
+
+class RunConfStore:
+    """
+    Content-addressed store of the files of the run configurations, next to the RunConf_<run> directories.
+    Each file is stored once (read-only) as objects/<sha256[:2]>/<sha256>, and hard linked in every RunConf_<run>
+    directory which has it, so identical configurations of consecutive runs take no extra space.
+    index/<digest of the run configuration> records the first run which had that run configuration.
+    The store can be shared by several nanorcs: they hold a shared lock on it while they put and link
+    files, and prune() only runs when it can get it exclusively.
+    """
+    def __init__(self, path:str):
+        self.log = logging.getLogger(self.__class__.__name__)
+        self.path = path
+        self.objects = os.path.join(path, 'objects')
+        self.index = os.path.join(path, 'index')
+
+    @contextmanager
+    def locked(self, exclusive:bool=False, blocking:bool=True):
+        import fcntl
+        os.makedirs(self.path, exist_ok=True)
+        with open(os.path.join(self.path, 'lock'), 'a') as f:
+            flags = fcntl.LOCK_EX if exclusive else fcntl.LOCK_SH
+            if not blocking:
+                flags |= fcntl.LOCK_NB
+            fcntl.flock(f, flags) # BlockingIOError if not blocking and it is taken
+            try:
+                yield
+            finally:
+                fcntl.flock(f, fcntl.LOCK_UN)
+
+    def put(self, content, digest:str) -> str:
+        import shutil
+        object_path = os.path.join(self.objects, digest[:2], digest)
+        if os.path.exists(object_path):
+            return object_path
+
+        os.makedirs(os.path.dirname(object_path), exist_ok=True)
+        tmp = f'{object_path}.{os.getpid()}.tmp'
+        if isinstance(content, bytes):
+            with open(tmp, 'wb') as f:
+                f.write(content)
+        else:
+            shutil.copyfile(content, tmp)
+        os.chmod(tmp, 0o444) # shared between runs, nobody should edit it in place
+        os.replace(tmp, object_path)
+        return object_path
+
+    def link(self, object_path:str, dest:str):
+        import shutil
+        try:
+            os.link(object_path, dest)
+        except OSError:
+            # other filesystem, or no hard links there
+            shutil.copyfile(object_path, dest)
+
+    def record_run(self, config_digest:str, run:int) -> int:
+        """Returns the first run which had this run configuration"""
+        os.makedirs(self.index, exist_ok=True)
+        index_file = os.path.join(self.index, config_digest)
+        try:
+            with open(index_file, 'x') as f:
+                f.write(str(run))
+            return run
+        except FileExistsError:
+            with open(index_file) as f:
+                return int(f.read().strip() or run)
+
+    def prune(self) -> int:
+        """
+        Removes the objects which aren't used by any RunConf_<run> directory anymore.
+        Does nothing if another nanorc is saving a run configuration in the store: an object it
+        just put there isn't linked yet.
+        """
+        if not os.path.isdir(self.objects):
+            return 0
+        try:
+            with self.locked(exclusive=True, blocking=False):
+                n_removed = 0
+                for prefix in os.listdir(self.objects):
+                    prefix_dir = os.path.join(self.objects, prefix)
+                    for name in os.listdir(prefix_dir):
+                        object_path = os.path.join(prefix_dir, name)
+                        if os.stat(object_path).st_nlink == 1:
+                            os.remove(object_path)
+                            n_removed += 1
+                return n_removed
+        except BlockingIOError:
+            self.log.debug(f'{self.path} is in use, not pruning it')
+            return 0
+
+
+def save_conf_to_dir(topnode, outdir, runtime_data, store:RunConfStore=None, configuration_files:dict=None) -> str:
+    """
+    Writes the run configuration in outdir, and returns its digest.
+    With a store, the files are hard links to the store's objects.
+    """
+    import shutil
+    digests = []
+    files = get_run_configuration(topnode, runtime_data, configuration_files=configuration_files)
+    with store.locked() if store else nullcontext():
+        for path, content in files:
+            full_path = os.path.join(outdir, path)
+            if content is None:
+                os.makedirs(full_path)
+                continue
+            os.makedirs(os.path.dirname(full_path), exist_ok=True)
+            digest = content_digest(content)
+            digests.append((path, digest))
+
+            if store:
+                store.link(store.put(content, digest), full_path)
+            elif isinstance(content, bytes):
+                with open(full_path, 'wb') as f:
+                    f.write(content)
             else:
-                import requests
-                r = requests.get(location)
-                if r.status_code == 200:
-                    config = r.json()
-                    with open(os.path.join(full_path, 'full_configuration.json'), 'w') as f:
-                        json.dump(config, f, indent=4, sort_keys=True)
-                else:
-                    raise RuntimeError(f'Couldn\'t get the configuration {location}')
-
-
-            rd = node.cfgmgr.generate_data_for_module(runtime_data)
-
-            with open(os.path.join(full_path, "runtime_data.json"), "w") as f:
-                json.dump(rd, f, indent=4, sort_keys=True)
+                shutil.copy2(content, full_path)
+    return run_configuration_digest(digests)
+
+
+def _tar_chunk(name, content, mtime) -> bytes:
+    # a member of a tar archive, without the end of archive blocks
+    info = tarfile.TarInfo(name)
+    info.mtime = mtime
+    if content is None:
+        info.type = tarfile.DIRTYPE
+        info.mode = 0o755
+        return info.tobuf(format=tarfile.GNU_FORMAT)
+
+    if not isinstance(content, bytes):
+        with open(content, 'rb') as f:
+            content = f.read()
+    info.mode = 0o644
+    info.size = len(content)
+    padding = (tarfile.BLOCKSIZE - len(content) % tarfile.BLOCKSIZE) % tarfile.BLOCKSIZE
+    return info.tobuf(format=tarfile.GNU_FORMAT) + content + tarfile.NUL*padding
+
+
+def make_run_configuration_tar(files, arcroot, compresslevel=1, member_cache:dict=None):
+    """
+    The run configuration as an in-memory .tar.gz, with the files under arcroot/.
+    Each tar member is compressed as its own gzip member (a .gz file can be several concatenated gzip members).
+    With a member_cache, the compressed members are kept, keyed by name and content digest,
+    so the files which didn't change since the previous run are not compressed again.
+    Fast compression: this is done at the start of the run.
+    """
+    import io
+    import gzip
+    import time
+
+    now = int(time.time())
+    buf = io.BytesIO()
+    for path, content in [(None, None)]+list(files):
+        name = f'{arcroot}/{path}' if path else arcroot
+        if member_cache is None or content is None:
+            buf.write(gzip.compress(_tar_chunk(name, content, now), compresslevel=compresslevel, mtime=0))
+            continue
+
+        key = (name, content_digest(content))
+        member = member_cache.get(key)
+        if member is None:
+            member = gzip.compress(_tar_chunk(name, content, now), compresslevel=compresslevel, mtime=0)
+            member_cache[key] = member
+        buf.write(member)
+
+    buf.write(gzip.compress(tarfile.NUL*2*tarfile.BLOCKSIZE, compresslevel=compresslevel, mtime=0))
+    buf.seek(0)
+    return buf
 
 
 class FileConfigSaver:
     """docstring for ConfigManager"""
 
-    def __init__(self, cfg_outdir:str):
+    def __init__(self, cfg_outdir:str, use_store:bool=True):
         super(FileConfigSaver, self).__init__()
+        self.log = logging.getLogger(self.__class__.__name__)
         self.cfgmgr = None
         self.outdir = cfg_outdir
+        self.run_outdirs = {}
+        # the files of the RunConf_<run> directories are hard links to the ones in the store
+        self.store = RunConfStore(os.path.join(cfg_outdir, '.runconf-store')) if use_store else None
+        if self.store:
+            try:
+                n_removed = self.store.prune()
+                if n_removed:
+                    self.log.info(f'Removed {n_removed} unused file(s) from {self.store.path}')
+            except Exception as e:
+                self.log.warning(f'Couldn\'t clean up {self.store.path}: {str(e)}')
 
     def _get_new_out_dir_name(self, run:int) -> str:
         """
@@ -100,7 +361,8 @@ class FileConfigSaver:
                       topnode:StatefulNode,
                       run:int,
                       run_type:str,
-                      data:dict) -> str:
+                      data:dict,
+                      configuration_files:dict=None) -> str:
         """
         Save the configuration runtime start parameter set
         :param      apps:  the application tree
@@ -111,6 +373,8 @@ class FileConfigSaver:
         :type       data :  dict
         :param      run_type :  run type
         :type       run_type :  str
+        :param      configuration_files :  the configuration files, if they were already fetched (get_configuration_files)
+        :type       configuration_files :  dict
 
         :returns:   Path of the saved config
         :rtype:     str
@@ -122,17 +386,32 @@ class FileConfigSaver:
         except Exception as e:
             raise RuntimeError(str(e))
 
-        save_conf_to_dir(
+        config_digest = save_conf_to_dir(
             outdir = self.thisrun_outdir,
             topnode = topnode,
             runtime_data = data,
+            store = self.store,
+            configuration_files = configuration_files,
         )
+        if self.store:
+            first_run = self.store.record_run(config_digest, run)
+            if first_run != run:
+                self.log.info(f'Run {run} has the same configuration as run {first_run}')
+        self.run_outdirs[run] = self.thisrun_outdir
         return self.thisrun_outdir
 
 
     def save_on_stop(self, run:int):
         pass
 
+    def save_perf_report(self, run:int, report:dict) -> str:
+        """The timings of the run's transitions, next to its configuration"""
+        from .perfreport import write_report
+        outdir = self.run_outdirs.get(run)
+        if not outdir:
+            raise RuntimeError(f'The configuration of run {run} wasn\'t saved by this nanorc, not saving its performance report')
+        return write_report(report, outdir)
+
 
 
 
@@ -146,6 +425,9 @@ class DBConfigSaver:
         self.timeout = 2
         self.apparatus_id = None
         self.log = logging.getLogger(self.__class__.__name__)
+        # compressed tar members of the previous runs, most of them don't change from one run to the next
+        self.tar_member_cache = {}
+        self.max_tar_member_cache = 1000
 
     def save_on_resume(self, topnode, overwrite_data:dict, cfg_method:str) -> str:
         return "not_saving_to_db_on_resume"
@@ -154,74 +436,86 @@ class DBConfigSaver:
                       topnode,
                       run:int,
                       run_type:str,
-                      data:dict) -> str:
-
-        fname=None
-        dname=None
-
-        with tempfile.TemporaryDirectory() as dir_name:
-            from urllib.parse import ParseResult
-            dname = dir_name
-            json_object = self.cfgmgr.top_cfg
-            nice_top = {}
-            for key, value in json_object.items():
-                if isinstance(value, ParseResult):
-                    nice_top[key] = value.geturl()
-                else:
-                    nice_top[key] = value
-            with open(dname+"/top_config.json", "w") as outfile:
-                json.dump(nice_top, outfile, indent=4)
-
-            save_conf_to_dir(
-                outdir = dir_name,
-                topnode = topnode,
-                runtime_data = data,
-            )
-
-            with tempfile.NamedTemporaryFile(suffix='.tar.gz', delete=False) as f:
-                with tarfile.open(fileobj=f, mode='w:gz') as tar:
-                    tar.add(dname, arcname=os.path.basename(dname))
-                f.flush()
-                f.seek(0)
-                fname = f.name
-
-            with open(fname, "rb") as f:
-                files = {'file': f}
-                version = os.getenv("DUNE_DAQ_BASE_RELEASE")
-                if not version:
-                    raise RuntimeError('RunRegistryDB: dunedaq version not in the variable env DUNE_DAQ_BASE_RELEASE! Exit nanorc and\nexport DUNE_DAQ_BASE_RELEASE=dunedaq-vX.XX.XX\n')
-
-                post_data = {"run_num": run,
-                             "det_id": self.apparatus_id,
-                             "run_type": run_type,
-                             "software_version": version}
-
-
-                try:
-                    r = requests.post(self.API_SOCKET+"/runregistry/insertRun/",
-                                      files=files,
-                                      data=post_data,
-                                      auth=(self.API_USER, self.API_PSWD),
-                                      timeout=self.timeout)
-                    r.raise_for_status()
-
-                except requests.HTTPError as exc:
-                    error = f"{__name__}: RunRegistryDB: HTTP Error: {exc}, {r.text}"
-                    self.log.error(error)
-                    raise RuntimeError(error) from exc
-                except requests.ConnectionError as exc:
-                    error = f"{__name__}: Connection to {self.API_SOCKET} wasn't successful: {exc}"
-                    self.log.error(error)
-                    raise RuntimeError(error) from exc
-                except requests.Timeout as exc:
-                    error = f"{__name__}: Connection to {self.API_SOCKET} timed out: {exc}"
-                    self.log.error(error)
-                    raise RuntimeError(error) from exc
-
-            os.remove(fname)
+                      data:dict,
+                      configuration_files:dict=None) -> str:
+        post_data, tar = self.snapshot_on_start(topnode, run, run_type, data, configuration_files)
+        return self.upload_on_start(post_data, tar)
+
+    def snapshot_on_start(self,
+                          topnode,
+                          run:int,
+                          run_type:str,
+                          data:dict,
+                          configuration_files:dict=None):
+        """
+        The run configuration, captured in memory, and what goes with it to the run registry.
+        upload_on_start sends it, possibly later (from the background jobs).
+        """
+        from urllib.parse import ParseResult
+        json_object = self.cfgmgr.top_cfg
+        nice_top = {}
+        for key, value in json_object.items():
+            if isinstance(value, ParseResult):
+                nice_top[key] = value.geturl()
+            else:
+                nice_top[key] = value
+
+        files = [('top_config.json', json.dumps(nice_top, indent=4).encode())]
+        files += get_run_configuration(
+            topnode = topnode,
+            runtime_data = data,
+            configuration_files = configuration_files,
+        )
+        # all in memory, nothing is written to disk
+        if len(self.tar_member_cache) > self.max_tar_member_cache:
+            self.tar_member_cache.clear()
+        tar = make_run_configuration_tar(files, 'RunConf', member_cache=self.tar_member_cache)
+
+        version = os.getenv("DUNE_DAQ_BASE_RELEASE")
+        if not version:
+            raise RuntimeError('RunRegistryDB: dunedaq version not in the variable env DUNE_DAQ_BASE_RELEASE! Exit nanorc and\nexport DUNE_DAQ_BASE_RELEASE=dunedaq-vX.XX.XX\n')
+
+        post_data = {"run_num": run,
+                     "det_id": self.apparatus_id,
+                     "run_type": run_type,
+                     "software_version": version}
+        return post_data, tar.getvalue()
+
+    def upload_on_start(self, post_data:dict, tar:bytes) -> str:
+        import io
+        files = {'file': (f'RunConf_{post_data["run_num"]}.tar.gz', io.BytesIO(tar), 'application/gzip')}
+
+        try:
+            r = requests.post(self.API_SOCKET+"/runregistry/insertRun/",
+                              files=files,
+                              data=post_data,
+                              auth=(self.API_USER, self.API_PSWD),
+                              timeout=self.timeout)
+            r.raise_for_status()
+
+        except requests.HTTPError as exc:
+            error = f"{__name__}: RunRegistryDB: HTTP Error: {exc}, {r.text}"
+            self.log.error(error)
+            raise RuntimeError(error) from exc
+        except requests.ConnectionError as exc:
+            error = f"{__name__}: Connection to {self.API_SOCKET} wasn't successful: {exc}"
+            self.log.error(error)
+            raise RuntimeError(error) from exc
+        except requests.Timeout as exc:
+            error = f"{__name__}: Connection to {self.API_SOCKET} timed out: {exc}"
+            self.log.error(error)
+            raise RuntimeError(error) from exc
 
         return "run_registry_db"
 
+    def save_perf_report(self, run:int, report:dict) -> str:
+        """
+        The timings of the run's transitions. The run registry doesn't take more files once the run
+        is inserted, so they are kept on this machine, where get-run-conf picks them up.
+        """
+        from .perfreport import write_report, perf_report_dir
+        return write_report(report, perf_report_dir(self.apparatus_id, run))
+
     def save_on_stop(self, run:str) -> None:
         try:
             r = requests.get(self.API_SOCKET+"/runregistry/updateStopTime/"+str(run),
@@ -86,6 +86,13 @@ def updateLogLevel(loglevel):
 @click.option('--cfg-dumpdir', type=click.Path(), default="./", help='Path where the config gets copied on start')
 @click.option('--log-path', type=click.Path(exists=True), default=None, help='Where the logs should go (on localhost of applications)')
 @click.option('--kerberos/--no-kerberos', default=True, help='Whether you want to use kerberos for communicating between processes')
+@click.option('--config-cache/--no-config-cache', default=True, help='Whether to cache the configurations from the configuration service (db://), and the encoding of the configuration directories, in ~/.cache/nanorc')
+@click.option('--offline-config', is_flag=True, default=False, help='Use the latest cached version of db:// configurations without asking the configuration service')
+@click.option('--perf-history/--no-perf-history', default=True, help='Whether to record the timings of every transition in ~/.cache/nanorc/perf/history.sqlite (see nano-perf-history)')
+@click.option('--adaptive-timeouts/--no-adaptive-timeouts', default=False, help='Fail the apps which take much longer than usual to reply to a transition before the timeout, from the history of their reply times (needs --perf-history)')
+@click.option('--adaptive-timeout-factor', type=float, default=3., help='With --adaptive-timeouts, an app is failed after this many times the p99 of its reply times')
+@click.option('--adaptive-timeout-floor', type=float, default=10., help='With --adaptive-timeouts, an app is never failed before this many seconds')
+@click.option('--conf-server-mode', type=click.Choice(['threaded', 'pool']), default='threaded', help='How the internal configuration server serves the apps: a thread per connection, or a fixed pool of threads (for many apps)')
 @click.option('--logbook-prefix', type=str, default="./", help='Prefix for the logbook file')
 @click.option('--pm', type=str, default="ssh://", help='Process manager, can be: ssh://, kind://, or k8s://np04-srv-015:31000, for example', callback=argval.validate_pm)
 @click.option('--web/--no-web', is_flag=True, default=False, help='whether to spawn webui')
@@ -97,7 +104,7 @@ def updateLogLevel(loglevel):
 @click.argument('partition-label', type=str, callback=argval.validate_partition)
 @click.pass_obj
 @click.pass_context
-def cli(ctx, obj, traceback, loglevel, cfg_dumpdir, log_path, logbook_prefix, timeout, kerberos, partition_number, web, top_cfg, partition_label, tui, pm):
+def cli(ctx, obj, traceback, loglevel, cfg_dumpdir, log_path, logbook_prefix, timeout, kerberos, partition_number, web, top_cfg, partition_label, tui, pm, config_cache, offline_config, conf_server_mode, perf_history, adaptive_timeouts, adaptive_timeout_factor, adaptive_timeout_floor):
     obj.print_traceback = traceback
     credentials.user = 'user'
     ctx.command.shell.prompt = f'{credentials.user}@rc> '
@@ -136,7 +143,14 @@ def cli(ctx, obj, traceback, loglevel, cfg_dumpdir, log_path, logbook_prefix, ti
             partition_label = partition_label,
             logbook_prefix = logbook_prefix,
             pm = pm,
-            port_offset = port_offset
+            port_offset = port_offset,
+            config_cache = config_cache,
+            offline_config = offline_config,
+            conf_server_mode = conf_server_mode,
+            perf_history = perf_history,
+            adaptive_timeouts = adaptive_timeouts,
+            adaptive_timeout_factor = adaptive_timeout_factor,
+            adaptive_timeout_floor = adaptive_timeout_floor,
         )
 
         if log_path:
@@ -54,6 +54,12 @@ def status(obj: NanoContext):
     obj.rc.status()
 
 
+@click.command()
+@click.pass_obj
+def upload_status(obj: NanoContext):
+    obj.rc.upload_status()
+
+
 @click.command()
 @click.option('--legend', type=bool, is_flag=True, default=False)
 @click.pass_obj
@@ -69,6 +75,7 @@ def ls(obj, legend):
 def pin_threads(ctx, obj:NanoContext, pin_thread_file, timeout:int):
     data = { "script_name": 'thread_pinning' }
     data["env"] = { "DUNEDAQ_THREAD_PIN_FILE": pin_thread_file }
+    data["files"] = [ "DUNEDAQ_THREAD_PIN_FILE" ] # not necessarily on the machines running the apps
     obj.rc.execute_script(data=data, timeout=timeout)
 
 
@@ -301,6 +308,7 @@ def start_shell(ctx, obj):
 def add_common_cmds(shell, end_of_run_cmds=True):
     shell.add_command(status              , 'status'              )
     shell.add_command(ls                  , 'ls'                  )
+    shell.add_command(upload_status       , 'upload_status'       )
     shell.add_command(pin_threads         , 'pin_threads'         )
     shell.add_command(boot                , 'boot'                )
     shell.add_command(conf                , 'conf'                )
@@ -3,10 +3,236 @@ from rich.console import Console
 from flask_restful import Resource
 from flask import request, abort, make_response, jsonify, abort
 
-def extract_data(request, dico, conf_name):
-    app_name = request.args.get('app_name')
-    cmd_name = request.args.get('cmd_name')
-
+class EncodedEntry:
+    """The JSON encoding of a piece of configuration, as sent to the apps"""
+    def __init__(self, body:bytes, data=None, digest:str=None):
+        import hashlib
+        self.body = body
+        self.data = data
+        self.digest = digest if digest else hashlib.sha256(body).hexdigest()
+        self.etag = self.digest[:32]
+        self.gzipped = None
+
+    def gzip(self, level) -> bytes:
+        # no lock, worst case it is compressed twice
+        if self.gzipped is None:
+            import gzip
+            self.gzipped = gzip.compress(self.body, compresslevel=level)
+        return self.gzipped
+
+
+class BlobStore:
+    """
+    Content-addressed store of the pieces of configuration (the init, conf... data of each app) of a ConfServer.
+    Many apps (in one or several configurations) often have identical pieces, these are only stored and encoded once,
+    and shared by all the configurations which use them. A piece is dropped when no configuration uses it anymore.
+    """
+    def __init__(self):
+        import threading
+        import weakref
+        self.blobs = weakref.WeakValueDictionary() # sha256 of the encoding -> EncodedEntry
+        self.lock = threading.Lock()
+        self.n_pieces = 0
+        self.n_duplicates = 0
+        self.duplicate_bytes = 0
+        self.shared_bytes = 0
+
+    def intern(self, data, shared:bool=False) -> EncodedEntry:
+        """
+        The stored entry of data. shared: the caller keeps the stored data (entry.data) instead of its own,
+        only then is a duplicate counted in the shared bytes (otherwise, only its encoding is shared)
+        """
+        import hashlib
+        body = encode(data)
+        digest = hashlib.sha256(body).hexdigest()
+        with self.lock:
+            self.n_pieces += 1
+            entry = self.blobs.get(digest)
+            if entry is not None:
+                self.n_duplicates += 1
+                self.duplicate_bytes += len(body)
+                if shared:
+                    self.shared_bytes += len(body)
+                return entry
+            entry = EncodedEntry(body, data=data, digest=digest)
+            self.blobs[digest] = entry
+            return entry
+
+    def stats(self) -> dict:
+        with self.lock:
+            return {
+                'pieces': self.n_pieces,
+                'unique': len(self.blobs),
+                'duplicates': self.n_duplicates,
+                'duplicate_bytes': self.duplicate_bytes,
+                'shared_bytes': self.shared_bytes,
+                'stored_bytes': sum(len(e.body) for e in self.blobs.values()),
+            }
+
+
+full_configuration_cache_version = 1
+
+def encode_full_configuration(data, use_cache:bool=True) -> EncodedEntry:
+    """
+    The encoding of a whole indexed configuration, read for this response only (the files stay unloaded).
+    For a directory, it is cached in ~/.cache/nanorc/configs, and only used if no file of the directory was added,
+    removed, resized or touched since, and the connections are transformed the same way: the run configuration
+    fetches the whole configuration at each start, which would otherwise parse every file of it each time.
+    """
+    from .lazyconf import LazyConfigData
+    if not use_cache or not isinstance(data, LazyConfigData) or data.is_bundle() or data.subdir:
+        return EncodedEntry(encode(data, keep_loaded=False))
+
+    import os, pickle, hashlib
+    from .utils import get_config_cache_dir, get_config_manifest, dump_to_cache
+    log = logging.getLogger('encode_full_configuration')
+
+    key = {
+        'version': full_configuration_cache_version,
+        'manifest': get_config_manifest(data.path),
+        'connections_transform': data.connections_transform,
+    }
+    cache_file = os.path.join(
+        get_config_cache_dir('configs'),
+        hashlib.sha256(data.path.encode()).hexdigest()+'.pickle'
+    )
+
+    try:
+        with open(cache_file, 'rb') as f:
+            cached = pickle.load(f)
+        if cached['key'] == key:
+            log.debug(f'Using the cached encoding of \'{data.path}\' ({cache_file})')
+            return EncodedEntry(cached['body'], digest=cached['digest'])
+        log.debug(f'\'{data.path}\' changed since it was cached')
+    except FileNotFoundError:
+        pass
+    except Exception as e:
+        log.debug(f'Couldn\'t read the cached configuration {cache_file}: {str(e)}')
+
+    # if a file changes while this is encoded, the manifest won't match anymore next time
+    entry = EncodedEntry(encode(data, keep_loaded=False))
+    try:
+        dump_to_cache(cache_file, {'key': key, 'body': entry.body, 'digest': entry.digest})
+    except Exception as e:
+        log.debug(f'Couldn\'t cache the configuration {data.path}: {str(e)}')
+    return entry
+
+
+class EncodedConfiguration:
+    """
+    A configuration, and the encoding of each piece of it that was asked for.
+    With hundreds of apps asking for their init and conf data at the same time,
+    each piece is only encoded once, and the responses are sent as bytes.
+
+    The configuration has a version, bumped by each change. The last patches are kept,
+    so that the clients which have an older version can only fetch what changed.
+    """
+    def __init__(self, data, blobs:BlobStore=None, patch_history=100, config_cache=True):
+        import threading
+        from collections import deque
+        self.data = data
+        self.blobs = blobs if blobs else BlobStore()
+        self.config_cache = config_cache # whether the whole of directory configurations is cached on disk
+        self.encoded = {}
+        self.preencoded = False
+        self.version = 0
+        self.patches = deque(maxlen=patch_history) # (version, patch)
+        self.lock = threading.Lock()
+        self.update_lock = threading.Lock()
+
+    def _encode_apps(self, data, app_names=None):
+        """
+        Returns the encoding of the pieces of the apps, and a copy of data in which the identical pieces
+        are the stored one, so that only one copy is kept (data belongs to the caller and isn't modified)
+        """
+        encoded = {}
+        shared = dict(data)
+        for app_name, app_data in data.items():
+            if app_names is not None and app_name not in app_names: continue
+            if not app_data or not isinstance(app_data, dict): continue
+            shared_app_data = dict(app_data)
+            for cmd_name, cmd_data in app_data.items():
+                if not cmd_data: continue # 404, see extract_data
+                entry = self.blobs.intern(cmd_data, shared=True)
+                shared_app_data[cmd_name] = entry.data
+                encoded[(app_name, cmd_name)] = entry
+            shared[app_name] = shared_app_data
+        return encoded, shared
+
+    def preencode(self):
+        # for the configurations which are fully in memory: encode everything the apps can ask for upfront
+        self.encoded, self.data = self._encode_apps(self.data)
+        self.preencoded = True
+
+    def get(self, app_name, cmd_name, conf_name) -> EncodedEntry:
+        key = (app_name, cmd_name)
+        with self.lock:
+            data, encoded, preencoded = self.data, self.encoded, self.preencoded
+        if key == (None, None):
+            # the whole configuration is only asked for by the run configuration: it isn't kept, so that it isn't in memory
+            # twice along with its pieces, and for an indexed configuration, the files stay unloaded until an app asks for them
+            if preencoded:
+                return EncodedEntry(encode(data))
+            return encode_full_configuration(data, self.config_cache)
+        entry = encoded.get(key)
+        if entry is None:
+            entry = self.blobs.intern(extract_data(app_name, cmd_name, data, conf_name))
+            with self.lock:
+                # if the configuration was changed in the meantime, this goes to the old cache
+                entry = encoded.setdefault(key, entry)
+        return entry
+
+    def apply_patch(self, patch) -> int:
+        from .mergepatch import apply_merge_patch
+        with self.update_lock:
+            data = apply_merge_patch(self.data, patch)
+            # only the encoding of what was patched is dropped
+            encoded = {
+                (app_name, cmd_name): entry
+                for (app_name, cmd_name), entry in self.encoded.items()
+                if app_name is not None and app_name not in patch
+            }
+            if self.preencoded:
+                patched, data = self._encode_apps(data, app_names=set(patch))
+                encoded.update(patched)
+
+            with self.lock:
+                self.data, self.encoded = data, encoded
+                self.version += 1
+                self.patches.append((self.version, patch))
+                return self.version
+
+    def replace(self, data, preencode=False) -> int:
+        with self.update_lock:
+            encoded, data = self._encode_apps(data) if preencode else ({}, data)
+            with self.lock:
+                self.data, self.encoded = data, encoded
+                self.preencoded = preencode
+                self.version += 1
+                self.patches.clear() # the clients with an older version have to fetch everything again
+                return self.version
+
+    def patches_since(self, version:int):
+        """The patches to go from version to the current version, None if they aren't all known anymore"""
+        with self.lock:
+            if version > self.version or version < 0:
+                return None
+            if version == self.version:
+                return []
+            patches = [p for v, p in self.patches if v > version]
+            if len(patches) != self.version-version:
+                return None
+            return patches
+
+
+def encode(data, keep_loaded:bool=True) -> bytes:
+    # same as what flask.jsonify sends
+    import json
+    from .lazyconf import to_dict
+    return json.dumps(to_dict(data, keep_loaded), separators=(',', ':'), sort_keys=True).encode()+b'\n'
+
+
+def extract_data(app_name, cmd_name, dico, conf_name):
     if app_name:
         app_data = dico.get(app_name)
         if not app_data:
@@ -25,15 +251,38 @@ def extract_data(request, dico, conf_name):
             abort(404, description=f"{cmd_name} cmd not found in configuration {conf_name} (did you forget to provide the app_name?)")
         dico = cmd_data
 
-    res = make_response(jsonify(dico))
-
-    if res.data == b'{}\n':
-        res.status_code = 204
+    return dico
+
+
+def make_encoded_response(request, entry:EncodedEntry, version:int, gzip_level:int, gzip_min_size:int):
+    from flask import Response
+    if entry.body == b'{}\n':
+        return Response(status=204)
+
+    if entry.etag in request.if_none_match:
+        res = Response(status=304)
+        res.set_etag(entry.etag)
+        res.headers['X-Config-Version'] = str(version)
+        return res
+
+    res = Response(mimetype='application/json')
+    res.set_etag(entry.etag)
+    res.headers['X-Config-Version'] = str(version)
+    res.vary.add('Accept-Encoding')
+    if gzip_level and len(entry.body) >= gzip_min_size and 'gzip' in request.accept_encodings:
+        res.set_data(entry.gzip(gzip_level))
+        res.headers['Content-Encoding'] = 'gzip'
+    else:
+        res.set_data(entry.body)
     return res
 
+
 class ConfigurationEndpoint(Resource):
-    def __init__(self, config_data, *args, **kwargs):
+    def __init__(self, config_data, blobs, gzip_level, gzip_min_size, *args, **kwargs):
         self.conf_data = config_data
+        self.blobs = blobs
+        self.gzip_level = gzip_level
+        self.gzip_min_size = gzip_min_size
         super().__init__(*args, **kwargs)
         self.log = logging.getLogger('ConfigurationEndpoint')
 
@@ -43,7 +292,20 @@ class ConfigurationEndpoint(Resource):
         try:
             name = request.args['name']
             conf_json = request.json
-            self.conf_data[name] = conf_json
+            index = request.args.get('index')
+            if index:
+                # the files are only indexed, and read when the apps ask for them
+                from .lazyconf import LazyConfigData
+                conf_json = LazyConfigData(**conf_json)
+
+            if name in self.conf_data:
+                res['version'] = self.conf_data[name].replace(conf_json, preencode=not index)
+            else:
+                encoded = EncodedConfiguration(conf_json, blobs=self.blobs)
+                if not index:
+                    encoded.preencode()
+                self.conf_data[name] = encoded
+                res['version'] = encoded.version
             res['success'] = True
         except Exception as e:
             res['error'] = str(e)
@@ -58,10 +320,47 @@ class ConfigurationEndpoint(Resource):
             return make_response(jsonify(list(self.conf_data.keys())))
 
         self.log.debug(f"Looking for config {name}")
-        if name not in self.conf_data:
+        conf = self.conf_data.get(name)
+        if conf is None:
+            abort(404, description=f'{name} not in configurations store, available configs are: {list(self.conf_data.keys())}')
+
+        since = request.args.get('since')
+        if since is not None:
+            return self._get_patches(conf, name, since)
+
+        version = conf.version
+        entry = conf.get(request.args.get('app_name'), request.args.get('cmd_name'), name)
+        return make_encoded_response(request, entry, version, self.gzip_level, self.gzip_min_size)
+
+    def _get_patches(self, conf, name, since):
+        if request.args.get('app_name') or request.args.get('cmd_name'):
+            abort(400, description='The changes (since) can only be fetched for the whole configuration')
+        try:
+            since = int(since)
+        except ValueError:
+            abort(400, description=f'Invalid version {since}')
+
+        version = conf.version
+        patches = conf.patches_since(since)
+        if patches is None:
+            abort(410, description=f'The changes of {name} since version {since} are not available anymore (current version: {version}), fetch the whole configuration')
+        return make_response(jsonify({'version': since+len(patches), 'patches': patches}))
+
+    def patch(self):
+        self.log.debug(f'PATCH "ConfigurationEndpoint" request with args: {request.args}')
+        name = request.args.get('name')
+        conf = self.conf_data.get(name)
+        if conf is None:
             abort(404, description=f'{name} not in configurations store, available configs are: {list(self.conf_data.keys())}')
 
-        return extract_data(request, self.conf_data[name], name)
+        res = {}
+        try:
+            res['version'] = conf.apply_patch(request.json)
+            res['success'] = True
+        except Exception as e:
+            res['error'] = str(e)
+            res['success'] = False
+        return make_response(jsonify(res))
 
 class ConfigUploadFailed(Exception):
     """Couldn't upload the configuration """
@@ -82,12 +381,68 @@ class ConfigurationAlreadyPresent(Exception):
         self.name = name
         super().__init__(f"Couldn't add the configuration {self.name} to nanorc's internal configuration server, the configuration is already present in the internal store")
 
+def send_configuration_patch(address, name, old_data, new_data, timeout=10):
+    """
+    Update a configuration of a (remote) configuration server with only what changed between old_data and new_data.
+    address is what ConfServer.get_conf_address_prefix returns. Returns the new version of the configuration.
+    Raises mergepatch.UnrepresentableChange if the change can't be sent as a patch, in which case the
+    whole configuration has to be posted again.
+    """
+    from .mergepatch import make_merge_patch
+    from requests import patch as http_patch
+    patch = make_merge_patch(old_data, new_data)
+    if not patch:
+        return None
+
+    try:
+        r = http_patch(
+            f'http://{address}?name={name}',
+            headers = {'Content-Type': 'application/merge-patch+json'},
+            json = patch,
+            timeout = timeout,
+        )
+        res = r.json()
+    except Exception as e:
+        raise ConfigUploadFailed(name) from e
+
+    if not res.get('success'):
+        raise ConfigUploadFailed(name)
+    return res['version']
+
+
+def fetch_configuration_patches(address, name, since:int, timeout=10):
+    """
+    The patches to apply (in order, with mergepatch.apply_merge_patch) to version since of a configuration,
+    to get its current version. Returns (version, patches), or None if the whole configuration has to be fetched again.
+    """
+    from requests import get
+    r = get(f'http://{address}?name={name}&since={since}', timeout=timeout)
+    if r.status_code == 410:
+        return None
+    r.raise_for_status()
+    res = r.json()
+    return res['version'], res['patches']
+
+
+conf_server_modes = ['threaded', 'pool']
+
 class ConfServer:
-    def __init__(self, port):
+    def __init__(self, port, gzip_level=6, gzip_min_size=1024, mode='threaded', pool_workers=64, config_cache=True):
         self.log = logging.getLogger('nano-conf-service')
-        self.config_data = {}
+        self.config_data = {} # name -> EncodedConfiguration, shared with the server threads
+        self.blobs = BlobStore() # the pieces of all the configurations, deduplicated
         self.uploaded_name = set()
+        import threading
+        self.uploaded_name_lock = threading.Lock() # the configurations can be added concurrently
         self.port = port
+        self.gzip_level = gzip_level # 0 to never compress the responses
+        self.gzip_min_size = gzip_min_size
+        self.config_cache = config_cache
+        if mode not in conf_server_modes:
+            raise RuntimeError(f'Unknown configuration server mode \'{mode}\', available are {conf_server_modes}')
+        # threaded: a thread per connection, pool: a fixed number of threads, for many apps fetching at the same time
+        self.mode = mode
+        self.pool_workers = pool_workers
         self._start_conf_service()
 
     def get_conf_address_prefix(self):
@@ -102,74 +457,104 @@ class ConfServer:
         self.api = Api(self.app)
         self.api.add_resource(
             ConfigurationEndpoint, "/configuration",
-            methods = ['GET', 'POST'],
-            resource_class_kwargs = {"config_data":self.config_data}
+            methods = ['GET', 'POST', 'PATCH'],
+            resource_class_kwargs = {
+                "config_data": self.config_data,
+                "blobs": self.blobs,
+                "gzip_level": self.gzip_level,
+                "gzip_min_size": self.gzip_min_size,
+            }
         )
 
         from .utils import FlaskManager
         self.manager = FlaskManager(
             port = self.port,
             app = self.app,
-            name = "nano-conf-svc"
+            name = "nano-conf-svc",
+            in_process = True,
+            pool_workers = self.pool_workers if self.mode == 'pool' else None,
         )
 
         self.manager.start()
         while not self.manager.is_ready():
+            if not self.manager.is_alive():
+                raise RuntimeError(f'Couldn\'t start nanorc\'s internal configuration server on port {self.port}')
             from time import sleep
             sleep(0.1)
 
-    def _upload_data(self, name,data):
-        from requests import post
-        header = {
-            'Accept' : 'application/json',
-            'Content-Type':'application/json'
-        }
-        import json
+    def _store(self, name, data, index=False):
+        # the server runs in this process, so the configuration is stored for it directly
+        encoded = EncodedConfiguration(data, blobs=self.blobs, config_cache=self.config_cache)
+        if not index:
+            encoded.preencode()
+        self.config_data[name] = encoded
+        return encoded.data
+
+    def add_configuration_index(self, name, lazy_data):
+        self.add_configuration_data(name, lazy_data, index=True)
+
+    def add_configuration_data(self, name, data, index=False):
+        """
+        Returns the configuration as the server keeps it: for a configuration which isn't indexed, its identical pieces
+        are shared with the other configurations, so the caller should keep this one rather than its own
+        """
+        from nanorc.argval import validate_conf_name
+        validate_conf_name({}, {}, name)
+
+        with self.uploaded_name_lock:
+            if name in self.uploaded_name:
+                raise ConfigurationAlreadyPresent(name)
+            self.uploaded_name.add(name)
 
         try:
-            r = post(
-                f'http://0.0.0.0:{self.port}/configuration?name={name}',
-                headers=header,
-                data=json.dumps(data)
-            )
+            return self._store(name, data, index)
         except Exception as e:
+            with self.uploaded_name_lock:
+                self.uploaded_name.discard(name)
             raise ConfigUploadFailed(name) from e
 
-        if not r.json()['success']:
-            raise ConfigUploadFailed(name)
-
-
-    def add_configuration_data(self, name, data):
+    def update_configuration_data(self, name, data, index=False) -> int:
         from nanorc.argval import validate_conf_name
         validate_conf_name({}, {}, name)
 
-        if name in self.uploaded_name:
-            raise ConfigurationAlreadyPresent(name)
+        if not name in self.uploaded_name:
+            raise ConfigurationNotPresent(name)
 
-        self._upload_data(name, data)
-        self.uploaded_name.add(name)
+        conf = self.config_data[name]
+        if index or not conf.preencoded:
+            # indexed configurations are cheap to replace, the files are only read when they are asked for
+            return conf.replace(data)
 
-    def update_configuration_data(self, name, data):
-        from nanorc.argval import validate_conf_name
-        validate_conf_name({}, {}, name)
+        from .mergepatch import make_merge_patch, UnrepresentableChange
+        try:
+            patch = make_merge_patch(conf.data, data)
+        except UnrepresentableChange as e:
+            self.log.debug(f'Replacing the whole of {name}: {str(e)}')
+            return conf.replace(data, preencode=True)
+        if not patch:
+            return conf.version
+        return conf.apply_patch(patch)
+
+    def patch_configuration(self, name, patch) -> int:
+        if not name in self.uploaded_name:
+            raise ConfigurationNotPresent(name)
+        return self.config_data[name].apply_patch(patch)
 
+    def get_configuration_version(self, name) -> int:
         if not name in self.uploaded_name:
             raise ConfigurationNotPresent(name)
+        return self.config_data[name].version
 
-        self._upload_data(name, data)
+    def get_store_stats(self) -> dict:
+        return self.blobs.stats()
 
     def update_configuration_directory(self, name, path):
-        from pathlib import Path
-        from nanorc.utils import get_json_recursive
-        data = get_json_recursive(Path(path))
-        self.update_configuration_data(name,data)
+        from .lazyconf import LazyConfigData
+        return self.update_configuration_data(name, LazyConfigData(path), index=True)
 
     def add_configuration_directory(self, name, path):
-        from pathlib import Path
-        from nanorc.utils import get_json_recursive
-        data = get_json_recursive(Path(path))
-        self.add_configuration_data(name,data)
+        from .lazyconf import LazyConfigData
+        self.add_configuration_index(name, LazyConfigData(path))
 
-        return
     def terminate(self):
         self.manager.stop()
@@ -8,12 +8,13 @@ import copy as cp
 from rich.console import Console
 from rich.style import Style
 from rich.pretty import Pretty
-from .statefulnode import StatefulNode, CanExecuteReturnVal
+from .statefulnode import StatefulNode, CanExecuteReturnVal, ErrorCode
 from .treebuilder import TreeBuilder
 from .cfgsvr import FileConfigSaver, DBConfigSaver
 from .credmgr import credentials
 from .node_render import print_node, print_status
 from .logbook import ElisaLogbook, FileLogbook
+from .perfreport import PerfRecorder
 import importlib
 from . import confdata
 from rich.traceback import Traceback
@@ -55,7 +56,15 @@ class NanoRC:
             fsm_cfg="partition",
             port_offset=0,
             pm=None,
-            session_handler=None
+            session_handler=None,
+            config_cache=True,
+            offline_config=False,
+            conf_server_mode='threaded',
+            background_jobs=False,
+            perf_history=False,
+            adaptive_timeouts=False,
+            adaptive_timeout_factor=3.,
+            adaptive_timeout_floor=10.,
             ):
         super(NanoRC, self).__init__()
 
@@ -77,6 +86,9 @@ class NanoRC:
             process_manager_description = pm,
             port_offset=self.port_offset,
             session = partition_label,
+            config_cache = config_cache,
+            offline_config = offline_config,
+            conf_server_mode = conf_server_mode,
         )
         self.partition = partition_label
 
@@ -87,6 +99,9 @@ class NanoRC:
 
         self.runs = []
         self.run_num_mgr = run_num_mgr
+        # timings of the transitions, saved with the run configuration at the end of each run
+        self.perf = PerfRecorder()
+        self.perf_reported_runs = set()
 
         self.cfgsvr = run_registry
         if self.cfgsvr:
@@ -117,10 +132,111 @@ class NanoRC:
             self.log.info("Using filelogbook")
             self.logbook = FileLogbook(logbook_prefix, self.console)
 
+        # logbook entries and run registry uploads, off the critical path of start and drain_dataflow
+        self.jobs = None
+        if background_jobs:
+            self._start_background_jobs()
+
         self.topnode = self.cfg.get_tree_structure()
         self.console.print(f"Running on the apparatus [bold red]{self.cfg.apparatus_id}[/bold red]:")
 
+        # every transition's timings, kept across sessions
+        self.perf_history = None
+        if perf_history:
+            self._start_perf_history()
+
+        # per app deadlines learned from the history, under the timeout
+        self.deadlines = None
+        if adaptive_timeouts:
+            if self.perf_history:
+                from .perfhistory import DeadlinePredictor, get_software_version
+                self.deadlines = DeadlinePredictor(
+                    self.perf_history,
+                    apparatus = self.apparatus_id,
+                    config_hashes = self.config_hashes,
+                    software_version = get_software_version(),
+                    factor = adaptive_timeout_factor,
+                    floor = adaptive_timeout_floor,
+                )
+            else:
+                self.log.warning('The adaptive timeouts are learned from the history of the transition timings, which isn\'t recorded, using the timeout for all the apps')
+
+    def _start_perf_history(self):
+        from .perfhistory import PerfHistory, configuration_hashes, get_software_version
+        try:
+            self.perf_history = PerfHistory()
+            config_hashes = configuration_hashes(self.topnode)
+        except Exception as e:
+            self.log.warning(f'Couldn\'t open the history of the transition timings, not recording them: {str(e)}')
+            self.perf_history = None
+            return
+
+        self.config_hashes = config_hashes
+        software_version = get_software_version()
+        def add_to_history(record):
+            self.perf_history.add(
+                record.to_dict(),
+                apparatus = self.apparatus_id,
+                config_hash = config_hashes.get(record.node, config_hashes[self.topnode.name]),
+                software_version = software_version,
+                run = self.runs[-1].run_number if self.runs and self.runs[-1].is_running() else None,
+            )
+        self.perf.add_listener(add_to_history)
+
+    def _start_background_jobs(self):
+        from .jobqueue import BackgroundJobQueue
+        from .utils import get_config_cache_dir
+        self.jobs = BackgroundJobQueue(
+            journal_dir = os.path.join(get_config_cache_dir('journal'), self.partition),
+        )
+        # the jobs left by a previous session are only run if they go to the same place
+        if self.logbook:
+            context = {'apparatus': self.apparatus_id, 'logbook': self.logbook.website}
+            self.jobs.register('logbook_start', lambda args, blob: self.logbook.message_on_start(**args), context)
+            self.jobs.register('logbook_stop',  lambda args, blob: self.logbook.message_on_stop(**args), context)
+            self.jobs.register('logbook_message', lambda args, blob: self.logbook.add_message(**args), context)
+        if self.cfgsvr and hasattr(self.cfgsvr, 'upload_on_start'):
+            context = {'apparatus': self.apparatus_id, 'run_registry': self.cfgsvr.API_SOCKET}
+            self.jobs.register('run_registry_start', lambda args, blob: self.cfgsvr.upload_on_start(args['post_data'], blob), context)
+            self.jobs.register('run_registry_stop',  lambda args, blob: self.cfgsvr.save_on_stop(**args), context)
+        self.jobs.start()
+
+    def upload_status(self) -> NoReturn:
+        if not self.jobs:
+            self.console.print('The logbook entries and run registry uploads are done synchronously')
+            return
+
+        jobs = self.jobs.status()
+        if not jobs:
+            self.console.print('No pending logbook entry or run registry upload')
+            return
+
+        t = Table(title='Pending logbook entries and run registry uploads')
+        t.add_column('Job')
+        t.add_column('Submitted')
+        t.add_column('State')
+        t.add_column('Attempts', justify='right')
+        t.add_column('Last error')
+        for job in jobs:
+            state = job['state']
+            if state == 'retrying':
+                state += f' in {max(0, job["next_attempt"]-time.time()):.0f}s'
+            t.add_row(
+                job['description'],
+                datetime.fromtimestamp(job['created']).strftime('%Y-%m-%d %H:%M:%S'),
+                f'[red]{state}[/red]' if job['state'] == 'failed' else state,
+                str(job['attempts']),
+                job['last_error'] or '',
+            )
+        self.console.print(t)
+
     def quit(self):
+        if self.run_num_mgr and hasattr(self.run_num_mgr, 'terminate'):
+            self.run_num_mgr.terminate()
+        if self.jobs:
+            self.jobs.stop()
+        if self.perf_history:
+            self.perf_history.close()
         self.cfg.terminate()
 
     def get_command_sequence(self, command:str):
@@ -214,21 +330,23 @@ class NanoRC:
         ret = node.parent.send_expert_command(node, data, timeout=timeout)
         self.log.info(f'Reply: {ret}')
 
-    def execute_command(self, command, node_path=None, **kwargs):
+    def execute_command(self, command, node_path=None, check_can_execute=True, **kwargs):
         force = kwargs.get('force')
         check_children = True
         if not node_path:
             node_path=self.topnode
             check_children = False
 
-        canexec = node_path.can_execute(
-            command        = command,
-            quiet          = True,
-            check_dead     = not force,
-            check_inerror  = not force,
-            check_children = check_children and not force,
-            only_included  = True,
-        )
+        canexec = CanExecuteReturnVal.CanExecute
+        if check_can_execute:
+            canexec = node_path.can_execute(
+                command        = command,
+                quiet          = True,
+                check_dead     = not force,
+                check_inerror  = not force,
+                check_children = check_children and not force,
+                only_included  = True,
+            )
         if canexec == CanExecuteReturnVal.InvalidTransition:
             self.return_code = node_path.return_code.value
             error_str = f"I cannot execute {command}, from state {node_path.state}"
@@ -249,7 +367,14 @@ class NanoRC:
         self.log.debug(f'Executing the cmd {command} on the node {node_path.name}, using timeout = {kwargs["timeout"]}')
         transition = getattr(node_path, command)
         kwargs['pm'] = self.pm
-        transition(**kwargs)
+        kwargs['recorder'] = self.perf
+        if self.deadlines:
+            kwargs['deadlines'] = self.deadlines
+        record = self.perf.begin(node_path.name, command)
+        try:
+            transition(**kwargs)
+        finally:
+            record.finish('ok' if node_path.return_code == ErrorCode.Success else 'failed')
         self.return_code = node_path.return_code.value
 
 
@@ -291,7 +416,10 @@ class NanoRC:
         """
         Terminates applications (but keep all the subsystems structure)
         """
-        self.execute_command("terminate", timeout=timeout, force=force)
+        try:
+            self.execute_command("terminate", timeout=timeout, force=force)
+        finally:
+            self._save_perf_report()
 
     def ls_thread(self) -> NoReturn:
         import threading
@@ -306,7 +434,10 @@ class NanoRC:
         """
         Abort applications
         """
-        self.execute_command("abort", timeout=timeout, force=True)
+        try:
+            self.execute_command("abort", timeout=timeout, force=True)
+        finally:
+            self._save_perf_report()
 
 
     def conf(self, node_path, timeout:int, **kwargs) -> NoReturn:
@@ -326,90 +457,138 @@ class NanoRC:
         """
         Sends start command to the applications
 
+        The run number and the configuration files are fetched concurrently, the configuration is saved as soon
+        as the run number is known, and the start transition is sent right after. The logbook entry goes alongside.
+
         Args:
             disable_data_storage (bool): whether to store or not the data
             run_type (str): PROD or TEST
             message (str): some free text to describe the run
         """
+        from concurrent.futures import ThreadPoolExecutor
+        from .cfgsvr import get_configuration_files
 
-        canexec = self.topnode.can_execute("start")
+        steps = []
+        t0 = time.time()
+        def timed(step, function, *args, **kwargs):
+            start = time.time()
+            try:
+                return function(*args, **kwargs)
+            finally:
+                steps.append((step, start-t0, time.time()-start))
+
+        canexec = timed('can_execute', self.topnode.can_execute, "start")
         if canexec != CanExecuteReturnVal.CanExecute:
             self.log.error(f'Cannot execute start, reason: {str(canexec)}')
             self.return_code = self.topnode.return_code
             return
 
-        run = 0
-        if self.run_num_mgr:
-            run = self.run_num_mgr.get_run_number()
-        else:
-            run = 1
-
-        stparam = {
-            "run":run,
-            "disable_data_storage":disable_data_storage,
-            "production_vs_test":run_type
-        }
-
-        if not trigger_rate is None:
-            stparam['trigger_rate'] = trigger_rate
-
-        runtime_start_data = rccmd.StartParams(**stparam).pod() # EnFoRcE tHiS sChEmA aNd DiTcH iT
-
-        messages = []
-        if message != "":
-            self.log.info(f"Adding the message:\n--------\n{message}\n--------\nto the logbook")
-            messages += [message]
-
-        config_pretty = f'Configuration: {self.cfg.initial_top_cfg.path}\n<ul>'
-
-        for k, v in self.cfg.top_cfg.items():
-            if k == "apparatus_id": continue
-
-            config_pretty += f'<li>{k}: {v.path}</li>'
-
-        config_pretty += '</ul>'
-
-        messages += [config_pretty]
-
-        if message != '' and run_type.lower() != 'prod':
-            self.log.warning('Your message will NOT be stored, as this is not a PROD run')
-
-        if self.logbook and run_type.lower() == 'prod':
-            try:
-                self.logbook.message_on_start(
-                    messages = messages,
-                    session = self.partition,
-                    run_num = run,
-                    run_type = run_type,
-                )
-            except Exception as e:
-                self.log.error(f"Couldn't make an entry to the logbook, do it yourself manually at {self.logbook.website}\nError text:\n{str(e)}")
-
-        cfg_save_dir = None
-        if self.cfgsvr:
-            try:
-                cfg_save_dir = self.cfgsvr.save_on_start(
-                    self.topnode,
-                    run=run,
-                    run_type=run_type,
-                    data=runtime_start_data,
-                )
-            except Exception as e:
-                self.log.error(f'Couldn\'t save the configuration so not starting a run!\n{str(e)}')
-                self.return_code = 1
-                if not ignore_run_registry_insertion_error:
-                    raise e
+        with ThreadPoolExecutor(max_workers=3, thread_name_prefix='start') as executor:
+            run_future = executor.submit(timed, 'run number', lambda: self.run_num_mgr.get_run_number() if self.run_num_mgr else 1)
+            conf_future = executor.submit(timed, 'configuration fetch', get_configuration_files, self.topnode) if self.cfgsvr else None
+            run = run_future.result()
+
+            stparam = {
+                "run":run,
+                "disable_data_storage":disable_data_storage,
+                "production_vs_test":run_type
+            }
+
+            if not trigger_rate is None:
+                stparam['trigger_rate'] = trigger_rate
+
+            runtime_start_data = rccmd.StartParams(**stparam).pod() # EnFoRcE tHiS sChEmA aNd DiTcH iT
+
+            messages = []
+            if message != "":
+                self.log.info(f"Adding the message:\n--------\n{message}\n--------\nto the logbook")
+                messages += [message]
+
+            config_pretty = f'Configuration: {self.cfg.initial_top_cfg.path}\n<ul>'
+
+            for k, v in self.cfg.top_cfg.items():
+                if k == "apparatus_id": continue
+
+                config_pretty += f'<li>{k}: {v.path}</li>'
+
+            config_pretty += '</ul>'
+
+            messages += [config_pretty]
+
+            if message != '' and run_type.lower() != 'prod':
+                self.log.warning('Your message will NOT be stored, as this is not a PROD run')
+
+            logbook_future = None
+            if self.logbook and run_type.lower() == 'prod':
+                logbook_args = {
+                    'messages': messages,
+                    'session': self.partition,
+                    'run_num': run,
+                    'run_type': run_type,
+                }
+                try:
+                    if self.jobs:
+                        timed('logbook', self.jobs.submit, 'logbook_start', logbook_args, f'Logbook entry for the start of run {run}')
+                    else:
+                        # the transition doesn't wait for it
+                        logbook_future = executor.submit(timed, 'logbook', self.logbook.message_on_start, **logbook_args)
+                except Exception as e:
+                    self.log.error(f"Couldn't make an entry to the logbook, do it yourself manually at {self.logbook.website}\nError text:\n{str(e)}")
+
+            cfg_save_dir = None
+            if self.cfgsvr:
+                try:
+                    configuration_files = conf_future.result()
+                    if self.jobs and hasattr(self.cfgsvr, 'snapshot_on_start'):
+                        # the configuration is captured now, and uploaded in the background
+                        post_data, tar = timed(
+                            'configuration snapshot',
+                            self.cfgsvr.snapshot_on_start,
+                            self.topnode,
+                            run=run,
+                            run_type=run_type,
+                            data=runtime_start_data,
+                            configuration_files=configuration_files,
+                        )
+                        self.jobs.submit('run_registry_start', {'post_data': post_data}, f'Run registry: configuration of run {run}', blob=tar)
+                        cfg_save_dir = 'the run registry (in the background, see upload_status)'
+                    else:
+                        cfg_save_dir = timed(
+                            'configuration save',
+                            self.cfgsvr.save_on_start,
+                            self.topnode,
+                            run=run,
+                            run_type=run_type,
+                            data=runtime_start_data,
+                            configuration_files=configuration_files,
+                        )
+                except Exception as e:
+                    self.log.error(f'Couldn\'t save the configuration so not starting a run!\n{str(e)}')
+                    self.return_code = 1
+                    if not ignore_run_registry_insertion_error:
+                        raise e
+
+            timed(
+                'start transition',
+                self.execute_command,
+                "start",
+                node_path = None,
+                check_can_execute = False, # just done
+                raise_on_fail = True,
+                overwrite_data = runtime_start_data,
+                timeout = timeout
+            )
 
-        self.execute_command(
-            "start",
-            node_path = None,
-            raise_on_fail = True,
-            overwrite_data = runtime_start_data,
-            timeout = timeout
-        )
+            if logbook_future:
+                try:
+                    logbook_future.result()
+                except Exception as e:
+                    self.log.error(f"Couldn't make an entry to the logbook, do it yourself manually at {self.logbook.website}\nError text:\n{str(e)}")
 
         self.return_code = self.topnode.return_code.value
         if self.return_code == 0:
+            if self.run_num_mgr and hasattr(self.run_num_mgr, 'prefetch_next'):
+                self.run_num_mgr.prefetch_next()
             self.runs.append(
                 start_run(
                     run_number = run,
@@ -433,6 +612,23 @@ class NanoRC:
         else:
             self.log.error(f"There was an error when starting the run #{run}:")
             self.log.error(f'Response: {self.topnode.response}')
+            self._save_perf_report(run)
+
+        self._print_step_timings(f'Start of run #{run}', steps, time.time()-t0)
+
+    def _print_step_timings(self, title:str, steps:list, total:float) -> NoReturn:
+        t = Table(title=f'{title}: {total:.2f}s')
+        t.add_column('Step')
+        t.add_column('Started at', justify='right')
+        t.add_column('Took', justify='right')
+        t.add_column('')
+        width = 30
+        for step, start, duration in sorted(steps, key=lambda s: s[1]):
+            # where the step sits in the whole start, to see what overlapped
+            begin = int(width*start/total) if total else 0
+            length = max(1, int(width*duration/total)) if total else 1
+            t.add_row(step, f'{start:.2f}s', f'{duration:.2f}s', ' '*begin+'█'*min(length, width-begin))
+        self.console.print(t)
 
     def message(self, message:str) -> NoReturn:
         """
@@ -440,11 +636,16 @@ class NanoRC:
         """
         if message != "":
             self.log.info(f"Adding the message:\n--------\n{message}\n--------\nto the logbook")
+            logbook_args = {
+                'messages': [message],
+                'session': self.partition,
+            }
             try:
-                self.logbook.add_message(
-                    messages = [message],
-                    session = self.partition,
-                )
+                if self.jobs:
+                    # queued behind the start of run entry, so it is posted as a reply to it
+                    self.jobs.submit('logbook_message', logbook_args, 'Logbook message')
+                else:
+                    self.logbook.add_message(**logbook_args)
 
             except Exception as e:
                 self.log.error(f"Couldn't make an entry to the logbook, do it yourself manually at {self.logbook.website}\nError text:\n{str(e)}")
@@ -453,7 +654,28 @@ class NanoRC:
         """
         Sends stop command
         """
-        self.execute_command("stop", node_path=None, raise_on_fail=True, timeout=timeout, force=force)
+        try:
+            self.execute_command("stop", node_path=None, raise_on_fail=True, timeout=timeout, force=force)
+        finally:
+            self._save_perf_report()
+
+    def _save_perf_report(self, run:int=None) -> NoReturn:
+        # once per run, whichever way it ended (stop, abort, terminate, failed start)
+        if run is None:
+            if not self.runs:
+                return
+            run = self.runs[-1].run_number
+        if run is None or run in self.perf_reported_runs:
+            return
+        report = self.perf.report(self.apparatus_id, run)
+        self.perf_reported_runs.add(run)
+        if not self.cfgsvr or not hasattr(self.cfgsvr, 'save_perf_report'):
+            return
+        try:
+            path = self.cfgsvr.save_perf_report(run, report)
+            self.log.info(f'Timings of the transitions of run {run} saved in {path}')
+        except Exception as e:
+            self.log.error(f'Couldn\'t save the timings of the transitions of run {run}: {str(e)}')
 
     def stop_trigger_sources(self, force:bool, timeout:int, **kwargs) -> NoReturn:
         """
@@ -516,17 +738,25 @@ class NanoRC:
             self.log.warning('Your message will NOT be stored, as this is not a PROD run')
 
         if self.logbook and run_type.lower() == 'prod':
+            logbook_args = {
+                'messages': messages,
+                'session': self.partition,
+            }
             try:
-                self.logbook.message_on_stop(
-                    messages = messages,
-                    session = self.partition,
-                )
+                if self.jobs:
+                    self.jobs.submit('logbook_stop', logbook_args, f'Logbook entry for the end of run {self.runs[-1].run_number if self.runs else ""}')
+                else:
+                    self.logbook.message_on_stop(**logbook_args)
             except Exception as e:
                 self.log.error(f"Couldn't make an entry to the logbook, do it yourself manually at {self.logbook.website}\nError text:\n{str(e)}")
 
         if self.cfgsvr and self.runs:
             try:
-                self.cfgsvr.save_on_stop(self.runs[-1].run_number)
+                if self.jobs and self.jobs.handlers.get('run_registry_stop'):
+                    run_number = self.runs[-1].run_number
+                    self.jobs.submit('run_registry_stop', {'run': run_number}, f'Run registry: end of run {run_number}')
+                else:
+                    self.cfgsvr.save_on_stop(self.runs[-1].run_number)
             except Exception as e:
                 if not ignore_run_registry_insertion_error:
                     raise e
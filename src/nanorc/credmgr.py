@@ -37,6 +37,7 @@ def new_kerberos_ticket(user:str, realm:str, password:str=None, ticket_dir:str="
 
         stdout_data = p.communicate(password.encode())
         print(stdout_data[-1].decode())
+        invalidate_kerberos_ticket(ticket_dir)
 
         if not password_provided:
             password = None
@@ -50,33 +51,113 @@ def new_kerberos_ticket(user:str, realm:str, password:str=None, ticket_dir:str="
 
 
 
-def get_kerberos_user(silent=False, ticket_dir:str="~/"):
-    import logging
-    log = logging.getLogger('get_kerberos_user')
+class KerberosTicket:
+    """What klist says about a ticket cache, parsed once"""
+    def __init__(self, principal:str, expiry:float, klist_output:str, checked:float, klist_errors:str=''):
+        self.principal = principal
+        self.expiry = expiry # of the TGT, None if klist's date format wasn't understood
+        self.klist_output = klist_output
+        self.klist_errors = klist_errors # e.g. "No credentials cache found"
+        self.checked = checked
+        self.valid = None # from klist -s, when the expiry isn't known
 
-    env = env_for_kerberos(ticket_dir)
-    args=['klist'] # on my mac, I can specify --json and that gives everything nicely in json format... but...
-    import subprocess
+    @property
+    def user(self):
+        return self.principal.split('@')[0] if self.principal else None
 
-    proc = subprocess.run(args, capture_output=True, text=True, env=env)
-    raw_kerb_info = proc.stdout.split('\n')
 
+# ticket directory -> (modification time of the cache, KerberosTicket)
+kerberos_tickets = {}
+kerberos_expiry_margin = 300 # klist is run again when the ticket expires in less than that
+kerberos_unknown_expiry_ttl = 60 # how long the ticket validity is trusted when its expiry isn't known
 
-    if not silent:
-        log.info(proc.stdout)
 
-    kerb_user = None
-    for line in raw_kerb_info:
-        split_line = line.split(' ')
-        split_line =  [x for x in split_line if x!='']
+def _kerberos_cache_mtime(ticket_dir:str):
+    # kinit (in nanorc or outside of it) adds a file to the cache directory, so this changes when the ticket does
+    import os
+    try:
+        mtimes = [os.stat(ticket_dir).st_mtime_ns]
+        primary = os.path.join(ticket_dir, 'primary')
+        if os.path.exists(primary):
+            mtimes.append(os.stat(primary).st_mtime_ns)
+        return tuple(mtimes)
+    except OSError:
+        return None
+
+
+def _parse_klist_time(text:str):
+    from datetime import datetime
+    for fmt in ['%m/%d/%y %H:%M:%S', '%m/%d/%Y %H:%M:%S', '%Y-%m-%d %H:%M:%S', '%d/%m/%y %H:%M:%S', '%d.%m.%Y %H:%M:%S']:
+        try:
+            return datetime.strptime(text, fmt).timestamp()
+        except ValueError:
+            continue
+    return None
+
+
+def parse_klist(output:str):
+    # returns the default principal and the expiry of its TGT
+    import re
+    principal = None
+    expiry = None
+    for line in output.split('\n'):
         find_princ = line.find('Default principal')
         if find_princ!=-1:
-            kerb_user = split_line[2]
-            kerb_user = kerb_user.split('@')[0]
+            split_line = [x for x in line.split(' ') if x!='']
+            principal = split_line[2]
+            continue
+        if principal and 'krbtgt/' in line:
+            # Valid starting, Expires, Service principal
+            times = re.findall(r'\S+ \d{1,2}:\d{2}:\d{2}', line)
+            if len(times) >= 2:
+                expiry = _parse_klist_time(times[1])
+    return principal, expiry
+
+
+def invalidate_kerberos_ticket(ticket_dir:str=None):
+    import os
+    if ticket_dir is None:
+        kerberos_tickets.clear()
+    else:
+        kerberos_tickets.pop(os.path.expanduser(str(ticket_dir)), None)
+
+
+def get_kerberos_ticket(ticket_dir:str="~/", refresh:bool=False) -> KerberosTicket:
+    """
+    klist is only run when the ticket cache changed, when the ticket is about to expire, or when refresh is True.
+    """
+    import os, time
+    ticket_dir = os.path.expanduser(str(ticket_dir))
+    mtime = _kerberos_cache_mtime(ticket_dir)
+    now = time.time()
+
+    cached = kerberos_tickets.get(ticket_dir)
+    if cached and not refresh and cached[0] == mtime:
+        ticket = cached[1]
+        if ticket.expiry is not None and now < ticket.expiry - kerberos_expiry_margin:
+            return ticket
+        if ticket.expiry is None and now < ticket.checked + kerberos_unknown_expiry_ttl:
+            return ticket
+
+    env = env_for_kerberos(ticket_dir)
+    import subprocess
+    proc = subprocess.run(['klist'], capture_output=True, text=True, env=env)
+    principal, expiry = parse_klist(proc.stdout)
+    ticket = KerberosTicket(principal, expiry, proc.stdout, now, klist_errors=proc.stderr)
+    kerberos_tickets[ticket_dir] = (mtime, ticket)
+    return ticket
 
-        if kerb_user:
-            return kerb_user
-    return None
+
+def get_kerberos_user(silent=False, ticket_dir:str="~/"):
+    import logging
+    log = logging.getLogger('get_kerberos_user')
+
+    ticket = get_kerberos_ticket(ticket_dir)
+
+    if not silent:
+        log.info(ticket.klist_output)
+
+    return ticket.user
 
 
 
@@ -84,14 +165,11 @@ def check_kerberos_credentials(against_user:str, silent=False, ticket_dir:str="~
     import logging
     log = logging.getLogger('check_kerberos_credentials')
 
-    env = env_for_kerberos(ticket_dir)
-
-    kerb_user = get_kerberos_user(
-        silent=silent,
-        ticket_dir=ticket_dir
-    )
+    ticket = get_kerberos_ticket(ticket_dir)
+    kerb_user = ticket.user
 
     if not silent:
+        log.info(ticket.klist_output)
         if kerb_user:
             log.info(f'Detected kerberos ticket for user: \'{kerb_user}\'')
         else:
@@ -104,8 +182,14 @@ def check_kerberos_credentials(against_user:str, silent=False, ticket_dir:str="~
         if not silent: log.info('Another user is logged in')
         return False
     else:
-        import subprocess
-        ticket_is_valid = subprocess.call(['klist', '-s'], env=env) == 0
+        import time
+        if ticket.expiry is not None:
+            ticket_is_valid = time.time() < ticket.expiry
+        else:
+            if ticket.valid is None:
+                import subprocess
+                ticket.valid = subprocess.call(['klist', '-s'], env=env_for_kerberos(ticket_dir)) == 0
+            ticket_is_valid = ticket.valid
         if not silent and not ticket_is_valid:
             log.info('Kerberos ticket is expired')
         return ticket_is_valid
@@ -292,35 +376,22 @@ class CERNSessionHandler:
         )
 
     def klist(self):
-        # HACK
-        from subprocess import Popen
-        from subprocess import STDOUT, PIPE
-        from nanorc.credmgr import env_for_kerberos, CERNSessionHandler
-
-        env = env_for_kerberos(
-            CERNSessionHandler.__get_session_kerberos_cache_path(
-                self.session_name, self.session_number
-            )
+        session_kerb_cache = CERNSessionHandler.__get_session_kerberos_cache_path(
+            self.session_name, self.session_number
         )
+        env = env_for_kerberos(session_kerb_cache)
 
-        cmd = ['klist']
         printout = ''
         for k,v in env.items():
             printout += f'{k}=\"{v}\" '
 
-        printout += ' '.join(cmd)
+        printout += 'klist'
         print(printout+"\n")
 
-        with Popen(
-            cmd,
-            stderr=STDOUT,
-            stdout=PIPE,
-            bufsize=1,
-            text=True,
-            env=env
-        ) as sp:
-            for line in sp.stdout:
-                print(line.replace("\n", ""))
+        # what the user asks for is run for real, this also refreshes the cached state of the ticket
+        ticket = get_kerberos_ticket(session_kerb_cache, refresh=True)
+        for line in (ticket.klist_output+ticket.klist_errors).split('\n'):
+            print(line)
 
 
 
@@ -463,6 +534,10 @@ class CERNSessionHandler:
         if user == self.nanorc_user.username:
             return True
 
+        invalidate_kerberos_ticket(
+            CERNSessionHandler.__get_session_kerberos_cache_path(self.session_name, self.session_number)
+        )
+
         previous_user = self.nanorc_user
         self.nanorc_user = UserAccountWithKerberos(
             service = previous_user.service,
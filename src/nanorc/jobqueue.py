@@ -0,0 +1,239 @@
+import json
+import logging
+import os
+import threading
+import time
+
+
+class Job:
+    def __init__(self, job_id:int, kind:str, args:dict, description:str, blob:bytes=None, attempts:int=0, created:float=None, last_error:str=None, failed:bool=False, context:dict=None):
+        self.id = job_id
+        self.kind = kind
+        self.args = args
+        self.description = description
+        self.blob = blob
+        self.context = context
+        self.attempts = attempts
+        self.created = created if created else time.time()
+        self.last_error = last_error
+        self.failed = failed
+        self.next_attempt = 0
+
+    def metadata(self) -> dict:
+        return {
+            'id': self.id,
+            'kind': self.kind,
+            'args': self.args,
+            'description': self.description,
+            'attempts': self.attempts,
+            'created': self.created,
+            'last_error': self.last_error,
+            'failed': self.failed,
+            'context': self.context,
+        }
+
+
+class BackgroundJobQueue:
+    """
+    Runs the side effects of the run control (logbook entries, run registry uploads...) in a background thread,
+    one after the other, in the order they were submitted. Each job is written to a journal directory before it
+    is queued and removed once it succeeded, so the jobs which didn't go through are retried when nanorc restarts.
+    Failed jobs are retried with an exponential backoff, and given up after max_attempts (they stay in the journal).
+
+    The jobs are executed by the handler registered for their kind: handler(args:dict, blob:bytes).
+    The context of a handler (where it posts: apparatus, logbook...) is journaled with each job, the jobs of a previous
+    session are only run if the handler of this one has the same context, otherwise they are flagged as failed.
+    """
+    def __init__(self, journal_dir:str=None, max_attempts:int=8, min_backoff:float=2., max_backoff:float=300.):
+        self.log = logging.getLogger(self.__class__.__name__)
+        self.handlers = {}
+        self.contexts = {} # kind -> context of its handler
+        self.jobs = [] # pending and failed ones, in submission order
+        self.lock = threading.Condition()
+        self.max_attempts = max_attempts
+        self.min_backoff = min_backoff
+        self.max_backoff = max_backoff
+        self.next_id = 0
+        self.stopping = False
+        self.thread = None
+        self.journal_dir = None
+        self.lock_file = None
+
+        if journal_dir:
+            self._open_journal(journal_dir)
+
+    def _open_journal(self, journal_dir:str):
+        import fcntl
+        os.makedirs(journal_dir, exist_ok=True)
+        self.lock_file = open(os.path.join(journal_dir, 'lock'), 'w')
+        try:
+            fcntl.flock(self.lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            self.log.warning(f'{journal_dir} is used by another nanorc, the background jobs of this one won\'t be journaled')
+            self.lock_file.close()
+            self.lock_file = None
+            return
+        self.journal_dir = journal_dir
+
+        for filename in sorted(os.listdir(journal_dir), key=lambda f: (len(f), f)):
+            if not filename.endswith('.json'): continue
+            try:
+                with open(os.path.join(journal_dir, filename)) as f:
+                    metadata = json.load(f)
+                blob_file = os.path.join(journal_dir, f'{metadata["id"]}.blob')
+                blob = None
+                if os.path.exists(blob_file):
+                    with open(blob_file, 'rb') as f:
+                        blob = f.read()
+                # the jobs which had been given up are tried again, once
+                job = Job(job_id=metadata['id'], kind=metadata['kind'], args=metadata['args'], description=metadata['description'],
+                          blob=blob, created=metadata['created'], last_error=metadata.get('last_error'), context=metadata.get('context'))
+                self.jobs.append(job)
+                self.next_id = max(self.next_id, job.id+1)
+            except Exception as e:
+                self.log.error(f'Couldn\'t read the journaled job {filename}: {str(e)}')
+
+        if self.jobs:
+            self.log.info(f'{len(self.jobs)} job(s) left from a previous session in {journal_dir}, they will be retried')
+
+    def _journal_write(self, job:Job):
+        if not self.journal_dir: return
+        import tempfile
+        if job.blob is not None and job.attempts == 0:
+            with open(os.path.join(self.journal_dir, f'{job.id}.blob'), 'wb') as f:
+                f.write(job.blob)
+        fd, tmp = tempfile.mkstemp(dir=self.journal_dir, suffix='.tmp')
+        with os.fdopen(fd, 'w') as f:
+            json.dump(job.metadata(), f)
+        os.replace(tmp, os.path.join(self.journal_dir, f'{job.id}.json'))
+
+    def _journal_remove(self, job:Job):
+        if not self.journal_dir: return
+        for filename in [f'{job.id}.json', f'{job.id}.blob']:
+            try:
+                os.remove(os.path.join(self.journal_dir, filename))
+            except FileNotFoundError:
+                pass
+
+    def register(self, kind:str, handler, context:dict=None):
+        self.handlers[kind] = handler
+        self.contexts[kind] = context
+
+    def _matches(self, job:Job) -> bool:
+        # the journal stores json, so the context has to be compared as json
+        return json.loads(json.dumps(self.contexts.get(job.kind))) == job.context
+
+    def start(self):
+        self.thread = threading.Thread(target=self._run, name='background-jobs', daemon=True)
+        self.thread.start()
+        return self
+
+    def submit(self, kind:str, args:dict, description:str, blob:bytes=None) -> Job:
+        if kind not in self.handlers:
+            raise RuntimeError(f'No handler for the background jobs of kind \'{kind}\'')
+        with self.lock:
+            job = Job(self.next_id, kind, args, description, blob, context=self.contexts.get(kind))
+            self.next_id += 1
+            self._journal_write(job)
+            self.jobs.append(job)
+            self.lock.notify_all()
+        return job
+
+    def _next_job(self):
+        # the oldest job which isn't given up, None if the queue is stopping
+        with self.lock:
+            while True:
+                if self.stopping:
+                    return None
+                pending = [j for j in self.jobs if not j.failed]
+                if pending:
+                    wait = pending[0].next_attempt - time.time()
+                    if wait <= 0:
+                        return pending[0]
+                    self.lock.wait(wait)
+                else:
+                    self.lock.wait()
+
+    def _run(self):
+        while True:
+            job = self._next_job()
+            if job is None:
+                return
+
+            handler = self.handlers.get(job.kind)
+            if handler is not None and not self._matches(job):
+                # from a previous session, which posted somewhere else
+                with self.lock:
+                    job.failed = True
+                    job.last_error = f'Submitted for {job.context}, this nanorc posts to {self.contexts.get(job.kind)}'
+                    self.log.error(f'Not running \'{job.description}\': {job.last_error}')
+                    self._journal_write(job)
+                continue
+
+            try:
+                if handler is None:
+                    raise RuntimeError(f'No handler for the background jobs of kind \'{job.kind}\'')
+                handler(job.args, job.blob)
+            except Exception as e:
+                with self.lock:
+                    job.attempts += 1
+                    job.last_error = str(e)
+                    if job.attempts >= self.max_attempts:
+                        job.failed = True
+                        self.log.error(f'Giving up on \'{job.description}\' after {job.attempts} attempts: {str(e)}')
+                    else:
+                        backoff = min(self.max_backoff, self.min_backoff * 2**(job.attempts-1))
+                        job.next_attempt = time.time() + backoff
+                        self.log.warning(f'\'{job.description}\' failed (attempt {job.attempts}), retrying in {backoff:.0f}s: {str(e)}')
+                    self._journal_write(job)
+                continue
+
+            with self.lock:
+                self.jobs.remove(job)
+                self._journal_remove(job)
+                self.lock.notify_all()
+            self.log.info(f'Done: {job.description}')
+
+    def retry_failed(self):
+        with self.lock:
+            for job in self.jobs:
+                if job.failed and self._matches(job):
+                    job.failed = False
+                    job.attempts = 0
+                    job.next_attempt = 0
+            self.lock.notify_all()
+
+    def wait(self, timeout:float=None) -> bool:
+        """Waits until there is no pending job anymore, returns whether that happened before the timeout"""
+        deadline = time.time() + timeout if timeout is not None else None
+        with self.lock:
+            while any(not j.failed for j in self.jobs):
+                remaining = deadline - time.time() if deadline else None
+                if remaining is not None and remaining <= 0:
+                    return False
+                self.lock.wait(remaining)
+        return True
+
+    def status(self) -> list:
+        with self.lock:
+            return [
+                {
+                    **job.metadata(),
+                    'state': 'failed' if job.failed else ('retrying' if job.attempts else 'pending'),
+                    'next_attempt': job.next_attempt,
+                }
+                for job in self.jobs
+            ]
+
+    def stop(self, timeout:float=10):
+        """Gives the pending jobs some time to go through, the others stay in the journal for the next session"""
+        if self.thread:
+            if not self.wait(timeout):
+                self.log.warning(f'{len(self.status())} background job(s) still pending'+(f', they are kept in {self.journal_dir}' if self.journal_dir else ' and lost'))
+            with self.lock:
+                self.stopping = True
+                self.lock.notify_all()
+            self.thread.join(timeout)
+        if self.lock_file:
+            self.lock_file.close()
+            self.lock_file = None
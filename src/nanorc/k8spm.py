@@ -7,11 +7,14 @@ import time
 import json
 import copy as cp
 import os
+import threading
 from urllib.parse import urlparse
-from kubernetes import client, config
+from kubernetes import client, config, watch
 from rich.console import Console
 from rich.progress import Progress, SpinnerColumn, TextColumn, BarColumn, TimeRemainingColumn, TimeElapsedColumn, track
 from rich.table import Table
+from rich.text import Text
+from rich.markup import escape
 
 from datetime import datetime
 
@@ -26,6 +29,7 @@ class AppProcessDescriptor(object):
         self.conf = None
         self.port = None
         self.proc = None
+        self.ready = False
 
 
     def __str__(self):
@@ -41,13 +45,26 @@ class K8sProcess(object):
     def is_alive(self):
         try:
             s = self.pm._core_v1_api.read_namespaced_pod_status(self.name, self.namespace)
-            for cond in s.status.conditions:
-                if cond.type == "Ready" and cond.status == "True":
-                    return True
-            return False
+            return K8sProcess.pod_is_ready(s)
         except:
             return False
 
+    @staticmethod
+    def pod_is_ready(pod):
+        for cond in (pod.status.conditions or []):
+            if cond.type == "Ready" and cond.status == "True":
+                return True
+        return False
+
+    @staticmethod
+    def pod_failure(pod):
+        if pod.status.phase == "Failed":
+            return pod.status.reason or "Failed"
+        for cs in (pod.status.container_statuses or []):
+            if cs.state.terminated:
+                return f"Terminated {cs.state.terminated.exit_code} {cs.state.terminated.reason}"
+        return None
+
     def status(self):
         try:
             s = self.pm._core_v1_api.read_namespaced_pod_status(self.name, self.namespace)
@@ -65,6 +82,171 @@ class K8sProcess(object):
 
 
 
+class RotatingLogFile(object):
+    """Buffered log file, rolled over to .1, .2, ... when it grows too big"""
+    def __init__(self, path:str, max_bytes:int=100*1024*1024, backups:int=5, buffering:int=64*1024):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.backups = backups
+        self.buffering = buffering
+        self.lock = threading.Lock()
+        self.file = open(self.path, 'ab', buffering=self.buffering)
+        self.size = self.file.tell()
+
+    def write(self, data:bytes):
+        with self.lock:
+            if self.max_bytes and self.size + len(data) > self.max_bytes and self.size > 0:
+                self._rotate()
+            self.file.write(data)
+            self.size += len(data)
+
+    def _rotate(self):
+        self.file.close()
+        for i in range(self.backups-1, 0, -1):
+            if os.path.exists(f'{self.path}.{i}'):
+                os.replace(f'{self.path}.{i}', f'{self.path}.{i+1}')
+        if self.backups > 0:
+            os.replace(self.path, f'{self.path}.1')
+        else:
+            os.remove(self.path)
+        self.file = open(self.path, 'wb', buffering=self.buffering)
+        self.size = 0
+
+    def flush(self):
+        with self.lock:
+            self.file.flush()
+
+    def close(self):
+        with self.lock:
+            self.file.close()
+
+
+class PodLogStreamer(object):
+    """Follows the logs of the pods of a partition and writes them to local files.
+
+    Each pod is followed in its own daemon thread, which spends its life blocked
+    on the socket. The stream is reopened when it drops or the container restarts,
+    and the thread exits once the pod is gone or its container has terminated.
+    """
+    def __init__(self, core_v1_api, namespace:str, console:Console):
+        self.log = logging.getLogger(__name__)
+        self._core_v1_api = core_v1_api
+        self.namespace = namespace
+        self.console = console
+        self.stopping = threading.Event()
+        self.streams = {}
+        self.responses = {}
+        self.lock = threading.Lock()
+
+    def follow(self, pod_name:str, log_file:str):
+        with self.lock:
+            if pod_name in self.streams or self.stopping.is_set():
+                return
+            output = RotatingLogFile(log_file)
+            thread = threading.Thread(
+                target = self._stream,
+                args = (pod_name, output),
+                name = f'log-{pod_name}',
+                daemon = True,
+            )
+            self.streams[pod_name] = (thread, output)
+        thread.start()
+
+    def _container_state(self, pod_name:str):
+        # returns (restart_count, terminated), or None if the pod is gone
+        try:
+            pod = self._core_v1_api.read_namespaced_pod_status(pod_name, self.namespace)
+        except client.rest.ApiException as e:
+            if e.status == 404:
+                return None
+            raise
+        statuses = pod.status.container_statuses or []
+        if not statuses:
+            return (0, pod.status.phase in ['Succeeded', 'Failed'])
+        cs = statuses[0]
+        return (cs.restart_count, cs.state.terminated is not None)
+
+    def _stream(self, pod_name:str, output:RotatingLogFile):
+        restart_count = None
+        last_data = None
+        try:
+            while not self.stopping.is_set():
+                since_seconds = None
+                if last_data is not None:
+                    # the stream dropped while the container kept running, only get what we missed
+                    since_seconds = int(time.time() - last_data) + 1
+
+                try:
+                    resp = self._core_v1_api.read_namespaced_pod_log(
+                        pod_name,
+                        self.namespace,
+                        follow = True,
+                        since_seconds = since_seconds,
+                        _preload_content = False,
+                    )
+                    with self.lock:
+                        self.responses[pod_name] = resp
+                    for chunk in resp.stream(64*1024):
+                        output.write(chunk)
+                        last_data = time.time()
+                    resp.release_conn()
+                except Exception as e:
+                    if self.stopping.is_set():
+                        break
+                    self.log.debug(f'Log stream of {pod_name} interrupted: {str(e)}')
+                finally:
+                    with self.lock:
+                        self.responses.pop(pod_name, None)
+
+                output.flush()
+                if self.stopping.is_set():
+                    break
+
+                try:
+                    state = self._container_state(pod_name)
+                except Exception as e:
+                    self.log.debug(f'Couldn\'t get the status of {pod_name}: {str(e)}')
+                    time.sleep(1)
+                    continue
+
+                if state is None:
+                    break
+
+                count, terminated = state
+                if restart_count is not None and count != restart_count:
+                    output.write(f'\n--- nanorc: container of {pod_name} restarted ({count} restart(s)) ---\n'.encode())
+                    last_data = None
+                elif terminated:
+                    break
+                restart_count = count
+                time.sleep(0.5)
+        finally:
+            output.close()
+
+    def stop(self, timeout:float=5):
+        self.stopping.set()
+        with self.lock:
+            for resp in self.responses.values():
+                try:
+                    resp.close()
+                except:
+                    pass
+            streams = list(self.streams.values())
+
+        deadline = time.time() + timeout
+        for thread, _ in streams:
+            thread.join(max(0, deadline - time.time()))
+
+    def wait(self, timeout:float):
+        # let the streams drain on their own (i.e. the pods terminate), then close them
+        with self.lock:
+            streams = list(self.streams.values())
+        deadline = time.time() + timeout
+        for thread, _ in streams:
+            thread.join(max(0, deadline - time.time()))
+        self.stop()
+
+
 class K8SProcessManager(object):
     def __init__(self, console: Console, cluster_config, connections, log_path=None):
         """A Kubernetes Process Manager
@@ -81,36 +263,70 @@ class K8SProcessManager(object):
         self.apps = {}
         self.partition = None
         self.cluster_config = cluster_config
+        self.log_streamer = None
+        self.log_files = {}
 
-        config.load_kube_config()
+        # KUBECONFIG is only read by the kubernetes module at import time otherwise
+        config.load_kube_config(config_file=os.environ.get('KUBECONFIG'))
 
         self._core_v1_api = client.CoreV1Api()
         self._apps_v1_api = client.AppsV1Api()
 
 
-    def execute_script(self, script_data):
-        ## Pin thread file can be anywhere in the filesystem
-        ## so below won't work.
-
-        # from kubernetes.stream import stream
-
-        # env_vars = script_data["env"]
-        # cmd =';'.join([ f"export {n}=\"{v}\"" for n,v in env_vars.items()])
-        # cmd += ";"+"; ".join(script_data['cmd'])
-        # pods = self.list_pods(self.partition)
-        # for pod in pods.items:
-        #     resp = stream(
-        #         self._core_v1_api.connect_get_namespaced_pod_exec, pod.metadata.name, self.partition,
-        #         command=cmd,
-        #         stderr=True, stdin=False,
-        #         stdout=True, tty=False
-        #     )
-        #     # ssh_args = [host, "-tt", "-o StrictHostKeyChecking=no"] + [cmd]
-        #     # proc = sh.ssh(ssh_args)
-        #     self.log.info(resp)
-
-        ## Instead we revert to ssh...
-        env_vars = script_data["env"]
+    def exec_in_pod(self, pod_name:str, command:list, timeout:int=60, stdin:str=None):
+        from kubernetes.stream import stream
+        # stream() swaps the request method of the api client it's given, so each exec gets its own client
+        api = client.CoreV1Api(client.ApiClient())
+        resp = stream(
+            api.connect_get_namespaced_pod_exec, pod_name, self.partition,
+            command=command,
+            stderr=True, stdin=stdin is not None,
+            stdout=True, tty=False,
+            _preload_content=False,
+        )
+        stdout = ''
+        stderr = ''
+        deadline = time.time() + timeout
+        try:
+            if stdin:
+                resp.write_stdin(stdin)
+            while resp.is_open():
+                resp.update(timeout=1)
+                if resp.peek_stdout():
+                    stdout += resp.read_stdout()
+                if resp.peek_stderr():
+                    stderr += resp.read_stderr()
+                if time.time() > deadline:
+                    return None, stdout, stderr+f'\nTimeout ({timeout}s) expired'
+            return resp.returncode, stdout, stderr
+        finally:
+            resp.close()
+
+    def execute_script(self, script_data, timeout:int=60, one_pod_per_node:bool=True):
+        env_vars = dict(script_data["env"])
+
+        # The files the script needs (e.g. the thread pinning file) can be anywhere on this machine,
+        # so the ones it lists in 'files' (by the name of the variable holding their path) are shipped
+        # to the pod through the stdin of the exec, one after the other (the command line couldn't hold
+        # big files), and each of them is cut out of it by its size
+        staging = ''
+        files_data = ''
+        for n in script_data.get('files', []):
+            v = env_vars.get(n)
+            if type(v) is not str or not os.path.isfile(v):
+                self.log.warning(f'{n} ({v}) isn\'t a file on this machine, not copying it in the pods')
+                continue
+            import base64
+            with open(v, 'rb') as f:
+                content = base64.b64encode(f.read()).decode('ascii')
+            in_pod = f'/tmp/nanorc-{n}-{os.path.basename(v)}'
+            staging += f"head -c {len(content)} | base64 -d > {in_pod}; "
+            files_data += content
+            env_vars[n] = in_pod
+        if staging:
+            # the stdin of the exec is never closed, the script shouldn't wait on it
+            staging += 'exec < /dev/null; '
+
         cmd = ''
         pretty_print = ''
         for n,v in env_vars.items():
@@ -123,31 +339,54 @@ class K8SProcessManager(object):
         cmd += "; ".join(script_data['cmd'])
         pretty_print += "; ".join(script_data['cmd'])
 
-        pods = self.list_pods(self.partition)
-        hosts = set([self.get_pod_node(pod.metadata.name, self.partition) for pod in pods.items])
-
-        for host in hosts:
-            self.console.print(f'Executing {script_data["cmd"]} script on \'{host}\':\n[bright_black]{pretty_print}[/]')
-            ssh_args = [host, "-tt", "-o StrictHostKeyChecking=no"] + [cmd]
-            import sh
-            from sh import ErrorReturnCode
-            try:
-                import os
-                host_env = os.environ
-                ssh_env = {'KRB5CCNAME': host_env['KRB5CCNAME'] } if 'KRB5CCNAME' in host_env else {}
-                ssh_cmd  = sh.Command('/usr/bin/ssh')
-                proc = ssh_cmd(ssh_args, _env=ssh_env)
-            except ErrorReturnCode as e:
-                self.log.error(
-                    e.stdout.decode('ascii')
-                )
+        # The pods share the PID namespace of their node (host_pid), so node-wide scripts
+        # like thread pinning only need to run in one of the pods of each node
+        pods = []
+        nodes = set()
+        for name, desc in self.apps.items():
+            if not desc.node:
+                desc.node = self.get_pod_node(name, self.partition)
+            if one_pod_per_node and desc.node in nodes:
                 continue
-            except Exception as e:
-                self.log.critical(
-                    str(e)
-                )
-            self.log.debug(proc)
-
+            nodes.add(desc.node)
+            pods.append(name)
+            self.console.print(f'Executing {escape(str(script_data["cmd"]))} script in \'{name}\' (on \'{desc.node}\'):\n[bright_black]{escape(pretty_print)}[/]')
+
+        from concurrent.futures import ThreadPoolExecutor
+        results = {}
+        with ThreadPoolExecutor(max_workers=min(len(pods), 16) or 1) as executor:
+            futures = {
+                pod: executor.submit(self.exec_in_pod, pod, ['/bin/bash', '-c', staging+cmd], timeout, files_data if staging else None)
+                for pod in pods
+            }
+            for pod, future in futures.items():
+                try:
+                    results[pod] = future.result()
+                except Exception as e:
+                    self.log.critical(f'Couldn\'t execute the script in \'{pod}\': {str(e)}')
+                    results[pod] = (None, '', str(e))
+
+        table = Table(title=f'{script_data["cmd"]} script')
+        table.add_column('pod', style='blue')
+        table.add_column('node')
+        table.add_column('exit code')
+        table.add_column('output')
+        for pod, (returncode, stdout, stderr) in results.items():
+            self.log.debug(f'{pod} stdout:\n{stdout}')
+            self.log.debug(f'{pod} stderr:\n{stderr}')
+            if returncode != 0:
+                self.log.error(f'Script failed in \'{pod}\' (exit code {returncode}):\n{escape(stderr)}')
+            output = (stderr if returncode != 0 else stdout).strip()
+            if len(output)>200:
+                output = '...'+output[-200:]
+            table.add_row(
+                pod,
+                self.apps[pod].node,
+                f'[green]{returncode}[/]' if returncode == 0 else f'[red]{returncode}[/]',
+                Text(output), # not rich markup
+            )
+        self.console.print(table)
+        return {pod: r[0] for pod, r in results.items()}
 
 
     def list_pods(self, namespace):
@@ -433,7 +672,7 @@ class K8SProcessManager(object):
                     client.V1Container(
                         name = "daq-application",
                         image = app_boot_info["image"],
-                        image_pull_policy= "Always",
+                        image_pull_policy= app_boot_info.get("image_pull_policy", "Always"),
                         security_context = client.V1SecurityContext(
                             privileged = app_boot_info['privileged'],
                             capabilities = client.V1Capabilities(
@@ -454,6 +693,14 @@ class K8SProcessManager(object):
                         ],
                         command=app_boot_info['command'],
                         args=app_boot_info['args'],
+                        # the pod is only Ready once the app listens on its command port
+                        readiness_probe = client.V1Probe(
+                            tcp_socket = client.V1TCPSocketAction(
+                                port = app_boot_info['cmd_port']
+                            ),
+                            period_seconds = 1,
+                            failure_threshold = 1,
+                        ),
                         ports=self.get_container_port_list_from_connections(
                             app_name=name,
                             connections=app_boot_info['connections'],
@@ -653,6 +900,137 @@ class K8SProcessManager(object):
         }
 
 
+    def get_pre_pull_node_affinity(self, node_selections:list):
+        # The pull pods need to land on every node that any of the apps using
+        # the image could be scheduled on, so only the strict terms matter.
+        # A single app without strict terms could go anywhere.
+        node_selector_terms = []
+
+        for node_selection in node_selections:
+            strict_terms = [ns for ns in node_selection if ns.get('strict')]
+            if not strict_terms:
+                return None
+
+            node_selector_terms += [
+                client.V1NodeSelectorTerm(
+                    match_expressions = [
+                        {
+                            'key': key,
+                            "operator": 'In',
+                            'values': values,
+                        }
+                        for key, values in ns.items() if key != 'strict'
+                    ]
+                )
+                for ns in strict_terms
+            ]
+
+        return client.V1NodeAffinity(
+            required_during_scheduling_ignored_during_execution = client.V1NodeSelector(
+                node_selector_terms = node_selector_terms
+            )
+        )
+
+    # ----
+    def create_pre_pull_daemonset(self, name:str, image:str, node_selections:list, namespace:str):
+        self.log.info(f"Creating \"{namespace}:{name}\" to pre-pull \"{image}\"")
+
+        daemonset = client.V1DaemonSet(
+            metadata = client.V1ObjectMeta(
+                name = name,
+                labels = {"app": name}
+            ),
+            spec = client.V1DaemonSetSpec(
+                selector = client.V1LabelSelector(
+                    match_labels = {"app": name}
+                ),
+                template = client.V1PodTemplateSpec(
+                    metadata = client.V1ObjectMeta(
+                        labels = {"app": name}
+                    ),
+                    spec = client.V1PodSpec(
+                        affinity = client.V1Affinity(
+                            node_affinity = self.get_pre_pull_node_affinity(node_selections)
+                        ),
+                        termination_grace_period_seconds = 0,
+                        containers = [
+                            # the pod is ready once the image is on the node, it doesn't need to do anything
+                            client.V1Container(
+                                name = "pre-pull",
+                                image = image,
+                                image_pull_policy = "Always",
+                                command = ["sleep", "infinity"],
+                            )
+                        ]
+                    )
+                )
+            )
+        )
+
+        try:
+            self._apps_v1_api.create_namespaced_daemon_set(namespace, daemonset)
+        except Exception as e:
+            self.log.error(e)
+            raise RuntimeError(f"Failed to create pre-pull daemonset \"{namespace}:{name}\"") from e
+
+    # ----
+    def pre_pull_images(self, images:dict, namespace:str, timeout:int):
+        """Pulls the images on the nodes before any DAQ application pod is created
+
+        Args:
+            images (dict): image -> list of the node-selection of each app using it
+            namespace (str): where to create the pull daemonsets
+            timeout (int): how long to wait for the images to be on the nodes
+        """
+        daemonsets = {}
+        for i, (image, node_selections) in enumerate(images.items()):
+            name = f'nanorc-pre-pull-{i}'
+            self.create_pre_pull_daemonset(name, image, node_selections, namespace)
+            daemonsets[name] = image
+
+        with Progress(
+            SpinnerColumn(),
+            TextColumn("[progress.description]{task.description}"),
+            BarColumn(),
+            TextColumn("[progress.percentage]{task.percentage:>3.0f}%"),
+            TimeRemainingColumn(),
+            TimeElapsedColumn(),
+            console=self.console,
+        ) as progress:
+            total = progress.add_task("[yellow]# images pulled", total=len(daemonsets))
+            waiting = progress.add_task("[yellow]timeout", total=timeout)
+            pulled = set()
+
+            for _ in range(timeout):
+                progress.update(waiting, advance=1)
+
+                for name in daemonsets:
+                    if name in pulled: continue
+                    s = self._apps_v1_api.read_namespaced_daemon_set_status(name, namespace).status
+                    if not s.observed_generation:
+                        continue # the controller hasn't seen it yet
+                    if s.desired_number_scheduled == 0:
+                        self.log.warning(f'No node matches the apps using \'{daemonsets[name]}\', not pre-pulling it')
+                        pulled.add(name)
+                    elif s.number_ready == s.desired_number_scheduled:
+                        self.log.info(f'\'{daemonsets[name]}\' is on {s.number_ready} node(s)')
+                        pulled.add(name)
+
+                progress.update(total, completed=len(pulled))
+                if len(pulled) == len(daemonsets):
+                    progress.update(waiting, visible=False)
+                    break
+
+                time.sleep(1)
+
+        for name, image in daemonsets.items():
+            if name not in pulled:
+                self.log.warning(f'Timeout expired while pre-pulling \'{image}\', the pods will pull it themselves')
+            try:
+                self._apps_v1_api.delete_namespaced_daemon_set(name, namespace)
+            except Exception as e:
+                self.log.error(f'Couldn\'t delete the pre-pull daemonset \"{namespace}:{name}\": {str(e)}')
+
     #---
     def boot(self, boot_info, timeout, conf_loc, **kwargs):
 
@@ -734,17 +1112,39 @@ class K8SProcessManager(object):
             'gid': os.getgid(),
         }
 
-        log_dir = self.log_path if self.log_path else f'{os.getcwd()}/logs'
-        if not os.path.exists(log_dir):
-            os.mkdir(log_dir)
+        pull_time = None
+        if self.cluster_config.pre_pull_images:
+            images = {}
+            for app_name in boot_info['order']:
+                app_conf = apps[app_name]
+                image = boot_info['exec'][app_conf['exec']]['image']
+                if not image: continue # complained about below
+                images.setdefault(image, []).append(
+                    [] if self.cluster_config.is_kind else app_conf.get('node-selection', [])
+                )
 
-        mounted_dirs += [self.add_mounted_dir(
-            in_pod_location = '/logs',
-            name = 'logdir',
-            read_only = False,
-            physical_location = log_dir
-        )]
+            pull_start = time.time()
+            self.pre_pull_images(images, self.partition, timeout)
+            pull_time = time.time() - pull_start
+            # the pre-pull counts in the boot timeout
+            timeout = max(1, int(timeout - pull_time))
 
+        if self.cluster_config.stream_logs:
+            # the logs are fetched from the API server, no need for a shared filesystem
+            self.log_streamer = PodLogStreamer(self._core_v1_api, self.partition, self.console)
+        else:
+            log_dir = self.log_path if self.log_path else f'{os.getcwd()}/logs'
+            if not os.path.exists(log_dir):
+                os.mkdir(log_dir)
+
+            mounted_dirs += [self.add_mounted_dir(
+                in_pod_location = '/logs',
+                name = 'logdir',
+                read_only = False,
+                physical_location = log_dir
+            )]
+
+        pod_start = time.time()
         for app_name in boot_info['order']:
             app_conf = apps[app_name]
             cmd_port = app_conf['port']
@@ -788,6 +1188,8 @@ class K8SProcessManager(object):
                 "connections"     : self.connections.get(app_name, []),
                 "privileged"      : app_conf.get('privileged', False),
                 "capabilities"    : app_conf.get('capabilities', []),
+                # no need to ask the registry again if we've just pulled it
+                "image_pull_policy": "IfNotPresent" if self.cluster_config.pre_pull_images else "Always",
             }
 
             trace = app_env.get('TRACE_FILE')
@@ -841,7 +1243,15 @@ class K8SProcessManager(object):
             from nanorc.utils import strip_env_for_rte
             app_boot_info["env"] = strip_env_for_rte(app_env)
             app_boot_info['command'] = ['/bin/bash', '-c']
-            app_boot_info['args'] = [f'{{ source {rte_script} && {app_cmd} {" ".join(app_args)} ; }} | tee /logs/{log_file}']
+            if self.log_streamer:
+                if self.log_path:
+                    self.log_files[app_name] = f'{self.log_path}/{log_file}'
+                else:
+                    self.log_files[app_name] = f'{os.getcwd()}/log_{app_name}_{app_conf["port"]}.txt'
+                self.console.print(f'\'{app_name}\' logs are in \'{socket.gethostname()}:{self.log_files[app_name]}\'')
+                app_boot_info['args'] = [f'source {rte_script} && exec {app_cmd} {" ".join(app_args)}']
+            else:
+                app_boot_info['args'] = [f'{{ source {rte_script} && {app_cmd} {" ".join(app_args)} ; }} | tee /logs/{log_file}']
 
 
             if self.cluster_config.is_kind:
@@ -869,8 +1279,6 @@ class K8SProcessManager(object):
                 run_as = run_as
             )
 
-            app_desc.node = self.get_pod_node(k8s_name, self.partition)
-
             self.apps[app_name] = app_desc
 
         def rdm_string(N:int=5):
@@ -913,35 +1321,63 @@ class K8SProcessManager(object):
             }
             waiting = progress.add_task("[yellow]timeout", total=timeout)
 
-            for _ in range(timeout):
-                progress.update(waiting, advance=1)
-
-                ready = self.check_apps()
-                for a, t in apps_tasks.items():
-                    if a in ready:
-                        progress.update(t, completed=1)
-                        self.apps[a].pod = ready[a]
+            # Readiness comes from the pod events, the Ready condition being driven
+            # by the readiness probe on the command port
+            failed = {}
+            w = watch.Watch()
+            for event in w.stream(self._core_v1_api.list_namespaced_pod, self.partition, timeout_seconds=timeout):
+                progress.update(waiting, completed=min(time.time()-pod_start, timeout))
+                pod = event['object']
+                name = pod.metadata.name
+                if name not in self.apps:
+                    continue
+
+                desc = self.apps[name]
+                desc.pod = name
+                if pod.spec.node_name:
+                    desc.node = pod.spec.node_name
+
+                if self.log_streamer and self.container_started(pod):
+                    self.log_streamer.follow(name, self.log_files[name])
+
+                if event['type'] == 'DELETED':
+                    failed[name] = 'Deleted'
+                elif K8sProcess.pod_is_ready(pod):
+                    desc.ready = True
+                    failed.pop(name, None) # e.g. it was restarted after a crash
+                    progress.update(apps_tasks[name], completed=1)
+                else:
+                    failure = K8sProcess.pod_failure(pod)
+                    if failure:
+                        failed[name] = failure
+                        self.log.error(f'{name} failed to start: {failure}')
+
+                ready = {n for n, d in self.apps.items() if d.ready}
                 progress.update(total, completed=len(ready))
-                r = list(ready.keys())
-                a = list(self.apps.keys())
-                r.sort()
-                a.sort()
-                if r==a:
+                if len(ready | set(failed)) == len(self.apps):
                     progress.update(waiting, visible=False)
-                    break
+                    w.stop()
 
-                time.sleep(1)
+        if self.log_streamer:
+            # pods that were still starting when the watch ended, their stream retries until the container is up
+            for name in self.apps:
+                self.log_streamer.follow(name, self.log_files[name])
+
+        start_time = time.time() - pod_start
+        if pull_time is not None:
+            self.console.print(f'Image pre-pull took {pull_time:.1f}s, pod start took {start_time:.1f}s')
+        else:
+            self.console.print(f'Pod start took {start_time:.1f}s')
 
 
 
     # ---
-    def check_apps(self):
-        ready = {}
-        for p in self._core_v1_api.list_namespaced_pod(self.partition).items:
-            for name in self.apps.keys():
-                if name in p.metadata.name and p.status.phase == "Running":
-                    ready[name]=p.metadata.name
-        return ready
+    @staticmethod
+    def container_started(pod):
+        for cs in (pod.status.container_statuses or []):
+            if cs.state.running or cs.state.terminated:
+                return True
+        return False
 
     # ---
     def terminate(self):
@@ -959,10 +1395,15 @@ class K8SProcessManager(object):
                         found = True
                         break
                 if not found:
-                    return
+                    break
                 time.sleep(1)
+            else:
+                logging.warning('Timeout expired!')
 
-            logging.warning('Timeout expired!')
+        if self.log_streamer:
+            # the streams end with their pods, give them a bit of time to drain
+            self.log_streamer.wait(timeout=10)
+            self.log_streamer = None
 
 
 # ---
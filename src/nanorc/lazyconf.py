@@ -0,0 +1,308 @@
+import json
+import logging
+import os
+import zipfile
+from collections.abc import Mapping
+
+bundle_manifest_name = 'nanorc-bundle.json'
+bundle_format_version = 1
+bundle_suffix = '.nrcb'
+
+
+def to_dict(data, keep_loaded:bool=True):
+    """
+    Recursively materialise the lazy views, e.g. before sending them as JSON.
+    With keep_loaded=False, the files read for it aren't kept in the views.
+    """
+    if isinstance(data, Mapping) and not isinstance(data, dict):
+        if not keep_loaded and isinstance(data, (LazyConfigData, LazyAppData)):
+            return {k: to_dict(data.peek(k), keep_loaded) for k in data}
+        return {k: to_dict(v, keep_loaded) for k, v in data.items()}
+    if isinstance(data, dict):
+        # e.g. a patched lazy configuration, only copied if there is a view in it
+        ret = None
+        for k, v in data.items():
+            materialised = to_dict(v, keep_loaded)
+            if materialised is not v:
+                if ret is None:
+                    ret = dict(data)
+                ret[k] = materialised
+        return data if ret is None else ret
+    return data
+
+
+class LazyAppData(Mapping):
+    """
+    The command data of one application, i.e. the data/<app>_<cmd>.json files.
+    A file is only parsed the first time its command is looked up.
+    """
+    def __init__(self, name:str, cmd_files:dict, source, base:dict=None, connections_transform:dict=None):
+        self.name = name
+        self.cmd_files = cmd_files
+        self.source = source
+        self.base = base if base else {}
+        self.connections_transform = connections_transform
+        self.loaded = {}
+
+    def _load(self, cmd):
+        data = self.source.load_json(self.cmd_files[cmd])
+
+        if cmd == 'init' and self.connections_transform and type(data) is dict:
+            from .cfgmgr import transform_init_connections
+            data = transform_init_connections(data, **self.connections_transform)
+        return data
+
+    def __getitem__(self, cmd):
+        if cmd in self.loaded:
+            return self.loaded[cmd]
+        if cmd in self.cmd_files:
+            data = self._load(cmd)
+            self.loaded[cmd] = data
+            return data
+        return self.base[cmd]
+
+    def peek(self, cmd):
+        # same as [cmd], without keeping what is read
+        if cmd in self.loaded:
+            return self.loaded[cmd]
+        if cmd in self.cmd_files:
+            return self._load(cmd)
+        return self.base[cmd]
+
+    def __iter__(self):
+        yield from self.base
+        for cmd in self.cmd_files:
+            if cmd not in self.base:
+                yield cmd
+
+    def __len__(self):
+        return len(set(self.base) | set(self.cmd_files))
+
+    def __contains__(self, cmd):
+        return cmd in self.cmd_files or cmd in self.base
+
+
+def is_bundle(path:str) -> bool:
+    if not os.path.isfile(path) or not zipfile.is_zipfile(path):
+        return False
+    with zipfile.ZipFile(path) as zf:
+        return bundle_manifest_name in zf.namelist()
+
+
+def write_bundle(json_dir:str, output:str, compresslevel:int=6) -> dict:
+    """
+    Pack a configuration directory into a single file. The bundle is a zip archive, the central
+    directory at its end is the table of contents, so any file in it can be read without reading the others.
+    The bundle is written next to the output and renamed at the end, so a half written bundle is never picked up.
+    """
+    import datetime
+    import tempfile
+
+    json_dir = os.path.realpath(json_dir)
+    if not os.path.isdir(json_dir):
+        raise RuntimeError(f'{json_dir} is not a directory')
+
+    members = []
+    for root, dirs, files in os.walk(json_dir):
+        dirs.sort()
+        for filename in sorted(files):
+            if not filename.endswith('.json'): continue
+            full_path = os.path.join(root, filename)
+            members.append((full_path, os.path.relpath(full_path, json_dir).replace(os.sep, '/')))
+
+    if not members:
+        raise RuntimeError(f'No json file in {json_dir}')
+
+    manifest = {
+        'format': 'nanorc-bundle',
+        'version': bundle_format_version,
+        'name': os.path.basename(json_dir),
+        'created': datetime.datetime.now().isoformat(),
+        'n_files': len(members),
+    }
+
+    output = os.path.realpath(output)
+    fd, tmp = tempfile.mkstemp(dir=os.path.dirname(output), prefix='.'+os.path.basename(output))
+    os.close(fd)
+    try:
+        with zipfile.ZipFile(tmp, 'w', compression=zipfile.ZIP_DEFLATED, compresslevel=compresslevel) as zf:
+            zf.writestr(bundle_manifest_name, json.dumps(manifest, indent=4))
+            for full_path, arcname in members:
+                zf.write(full_path, arcname)
+        os.replace(tmp, output)
+    except BaseException:
+        os.remove(tmp)
+        raise
+    return manifest
+
+
+class DirectorySource:
+    """Files of a configuration directory"""
+    def __init__(self, path:str):
+        self.path = path
+
+    def listdir(self, subdir:str=''):
+        # returns the files and the directories in subdir
+        path = os.path.join(self.path, subdir)
+        if not os.path.isdir(path):
+            return [], []
+        files, dirs = [], []
+        for filename in sorted(os.listdir(path)):
+            if os.path.isfile(os.path.join(path, filename)):
+                files.append(filename)
+            elif os.path.isdir(os.path.join(path, filename)):
+                dirs.append(filename)
+        return files, dirs
+
+    def load_json(self, name:str):
+        with open(os.path.join(self.path, name), 'r') as f:
+            return json.load(f)
+
+
+class BundleSource:
+    """Files of a configuration bundle, read straight from the archive"""
+    def __init__(self, path:str):
+        self.path = path
+        self.zipfile = zipfile.ZipFile(path)
+        names = self.zipfile.namelist()
+        if bundle_manifest_name not in names:
+            raise RuntimeError(f'{path} is not a nanorc configuration bundle')
+        self.manifest = json.loads(self.zipfile.read(bundle_manifest_name))
+        if self.manifest.get('version', 0) > bundle_format_version:
+            raise RuntimeError(f'{path} has bundle format version {self.manifest["version"]}, this nanorc only understands up to {bundle_format_version}')
+
+        # the table of contents: directory -> (files, subdirectories)
+        self.toc = {}
+        for name in names:
+            if name == bundle_manifest_name or name.endswith('/'): continue
+            parts = name.split('/')
+            for i in range(len(parts)):
+                files, dirs = self.toc.setdefault('/'.join(parts[:i]), ([], []))
+                if i == len(parts)-1:
+                    files.append(parts[i])
+                elif parts[i] not in dirs:
+                    dirs.append(parts[i])
+
+    def listdir(self, subdir:str=''):
+        files, dirs = self.toc.get(subdir.strip('/'), ([], []))
+        return sorted(files), sorted(dirs)
+
+    def load_json(self, name:str):
+        return json.loads(self.zipfile.read(name))
+
+
+def open_source(path:str):
+    if os.path.isfile(path):
+        return BundleSource(path)
+    return DirectorySource(path)
+
+
+class LazyConfigData(Mapping):
+    """
+    Read-only view of a configuration directory or bundle, with the same layout as what
+    utils.get_json_recursive returns. The files are indexed when the view is created,
+    the top level files (boot.json...) are parsed when first looked up, and the
+    application data (data/<app>_<cmd>.json) when its command is first looked up.
+
+    The view can be rebuilt from its description() in another process (the ConfServer).
+    """
+    def __init__(self, path:str, connections_transform:dict=None, subdir:str='', source=None):
+        self.log = logging.getLogger('LazyConfigData')
+        self.path = os.path.realpath(path)
+        self.subdir = subdir
+        self.source = source if source else open_source(self.path)
+        self.connections_transform = connections_transform
+        self.files = {}
+        self.subdirs = {}
+        self.apps = {}
+        self.loaded = {}
+        self._index()
+
+    def is_bundle(self) -> bool:
+        return isinstance(self.source, BundleSource)
+
+    def _join(self, *names):
+        return '/'.join(n for n in (self.subdir,)+names if n)
+
+    def _index(self):
+        files, dirs = self.source.listdir(self.subdir)
+        for filename in files:
+            file_base, ext = os.path.splitext(filename)
+            if ext != '.json':
+                self.log.debug(f'Ignoring non-json file: {self._join(filename)}')
+                continue
+            self.files[file_base] = self._join(filename)
+        for dirname in dirs:
+            if dirname == 'data': continue # this one is special and handled below
+            self.subdirs[dirname] = self._join(dirname)
+
+        if 'data' not in dirs:
+            return
+
+        data_files, _ = self.source.listdir(self._join('data'))
+        for filename in data_files:
+            app_cmd = filename.replace('.json', '').split('_')
+            app = app_cmd[0]
+            cmd = "_".join(app_cmd[1:])
+            self.apps.setdefault(app, {})[cmd] = self._join('data', filename)
+
+    def description(self) -> dict:
+        return {
+            'path': self.path,
+            'subdir': self.subdir,
+            'connections_transform': self.connections_transform,
+        }
+
+    def set_connections_transform(self, **connections_transform):
+        # applied to the init data of each application when it is loaded
+        self.connections_transform = connections_transform
+        for key, value in self.loaded.items():
+            if isinstance(value, LazyAppData):
+                value.connections_transform = connections_transform
+
+    def _load(self, key):
+        if key in self.subdirs:
+            return LazyConfigData(self.path, subdir=self.subdirs[key], source=self.source)
+
+        base = None
+        if key in self.files:
+            base = self.source.load_json(self.files[key])
+            if key not in self.apps:
+                return base
+
+        return LazyAppData(
+            name = key,
+            cmd_files = self.apps[key],
+            source = self.source,
+            base = base,
+            connections_transform = self.connections_transform,
+        )
+
+    def __getitem__(self, key):
+        if key in self.loaded:
+            return self.loaded[key]
+        if key not in self:
+            raise KeyError(key)
+        value = self._load(key)
+        self.loaded[key] = value
+        return value
+
+    def peek(self, key):
+        # same as [key], without keeping what is read
+        if key in self.loaded:
+            return self.loaded[key]
+        if key not in self:
+            raise KeyError(key)
+        return self._load(key)
+
+    def __iter__(self):
+        yield from self.files
+        for key in list(self.subdirs)+list(self.apps):
+            if key not in self.files:
+                yield key
+
+    def __len__(self):
+        return len(set(self.files) | set(self.subdirs) | set(self.apps))
+
+    def __contains__(self, key):
+        return key in self.files or key in self.subdirs or key in self.apps
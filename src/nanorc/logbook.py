@@ -9,7 +9,6 @@ import os.path
 import subprocess
 import copy
 import time
-from .credmgr import credentials
 
 class FileLogbook:
     def __init__(self, path:str, console):
@@ -56,6 +55,21 @@ class ElisaLogbook:
         self.message_attributes = configuration['attributes']
         self.log = logging.getLogger(self.__class__.__name__)
         self.log.info(f'ELisA logbook connection: {configuration["website"]} (API: {configuration["connection"]})')
+        self.current_id = None
+        self.current_run_num = None
+        self.current_run_type = None
+
+        # the SSO cookie is kept until it expires, and the client made with it is reused
+        from .utils import get_config_cache_dir
+        import hashlib
+        import threading
+        self.cookie_dir = get_config_cache_dir('elisa')
+        self.cookie_file = os.path.join(self.cookie_dir, f'sso-cookie-{hashlib.sha1(self.website.encode()).hexdigest()[:16]}.txt')
+        self.cookie_expiry = 0
+        self.cookie_ttl = 3600 # for the cookie files which don't say when they expire
+        self.cookie_margin = 300 # a new cookie is made when the current one expires in less than that
+        self.elisa_inst = None
+        self.lock = threading.Lock()
 
     def _start_new_message_thread(self):
         self.log.info("ELisA logbook: Next message will be a new thread")
@@ -63,21 +77,78 @@ class ElisaLogbook:
         self.current_run = None
         self.current_run_type = None
 
-
-    def _send_message(self, subject:str, body:str, command:str):
-        user = self.session_handler.nanorc_user.username
+    @staticmethod
+    def _cookie_file_expiry(cookie_file:str):
+        # netscape format: domain, flag, path, secure, expiry, name, value
+        expiries = []
+        with open(cookie_file) as f:
+            for line in f:
+                line = line.strip()
+                if line.startswith('#HttpOnly_'):
+                    line = line[len('#HttpOnly_'):]
+                elif not line or line.startswith('#'):
+                    continue
+                fields = line.split('\t')
+                if len(fields) < 7: continue
+                try:
+                    expiry = int(fields[4])
+                except ValueError:
+                    continue
+                if expiry > 0: # 0 is a session cookie
+                    expiries.append(expiry)
+        return min(expiries) if expiries else None
+
+    def _generate_cookie(self):
+        self.log.info(f'ELisA logbook: Generating an SSO cookie for {self.website}')
+        os.makedirs(self.cookie_dir, mode=0o700, exist_ok=True)
+        import tempfile
+        fd, tmp = tempfile.mkstemp(dir=self.cookie_dir, suffix='.tmp')
+        os.close(fd)
+        try:
+            self.session_handler.generate_elisa_cern_cookie(self.website, tmp)
+            os.replace(tmp, self.cookie_file)
+        except BaseException:
+            if os.path.exists(tmp):
+                os.remove(tmp)
+            raise
+
+    def _get_client(self):
+        if self.elisa_inst is not None and time.time() < self.cookie_expiry - self.cookie_margin:
+            return self.elisa_inst
+
+        # the cookie left by a previous nanorc is used if it is still valid
+        expiry = 0
+        if os.path.isfile(self.cookie_file):
+            expiry = self._cookie_file_expiry(self.cookie_file)
+            if expiry is None:
+                expiry = os.path.getmtime(self.cookie_file) + self.cookie_ttl
+
+        if time.time() >= expiry - self.cookie_margin:
+            self._generate_cookie()
+            expiry = self._cookie_file_expiry(self.cookie_file)
+            if expiry is None:
+                expiry = time.time() + self.cookie_ttl
 
         elisa_arg = copy.deepcopy(self.elisa_arguments)
+        elisa_arg["ssocookie"] = self.cookie_file
+        self.elisa_inst = Elisa(**elisa_arg)
+        self.cookie_expiry = expiry
+        return self.elisa_inst
+
+    def _invalidate_client(self):
+        # the cookie may be what's wrong, a new one is made for the next message
+        self.elisa_inst = None
+        self.cookie_expiry = 0
+        if os.path.exists(self.cookie_file):
+            os.remove(self.cookie_file)
 
-        elisa_user = credentials.get_login('elisa')
+    def _send_message(self, subject:str, body:str, command:str):
+        with self.lock:
+            user = self.session_handler.nanorc_user.username
+            answer = None
 
-        import tempfile
-        with tempfile.NamedTemporaryFile() as tf:
             try:
-                sso = {"ssocookie": self.session_handler.generate_elisa_cern_cookie(self.website, tf.name)}
-                elisa_arg.update(sso)
-                elisa_inst = Elisa(**elisa_arg)
-                answer = None
+                elisa_inst = self._get_client()
                 if not self.current_id:
                     self.log.info("ELisA logbook: Creating a new message thread")
                     message = MessageInsert()
@@ -105,11 +176,13 @@ class ElisaLogbook:
             except ElisaError as ex:
                 self.log.error(f"ELisA logbook: {str(ex)}")
                 self.log.error(answer)
+                self._invalidate_client()
                 raise ex
 
             except Exception as e:
                 self.log.error(f'Exception thrown while inserting data in elisa:')
                 self.log.error(e)
+                self._invalidate_client()
                 import logging
                 if logging.DEBUG >= logging.root.level:
                     self.console.print_exception()
@@ -0,0 +1,84 @@
+from collections.abc import Mapping
+
+'''
+JSON merge patches (RFC 7396), to update the configurations of the ConfServer without sending them again.
+A patch is a dictionary of what changed: the new values, None for what was removed, and
+a (sub-)patch for the dictionaries which changed. Lists are replaced as a whole.
+'''
+
+class UnrepresentableChange(Exception):
+    """A change that a merge patch can't describe: a value set to None, which reads as a removal"""
+    def __init__(self, key):
+        self.key = key
+        super().__init__(f'\'{key}\' is set to null, which a merge patch can\'t tell from a removal')
+
+
+def _check_no_null(key, value):
+    if value is None:
+        raise UnrepresentableChange(key)
+    if isinstance(value, Mapping):
+        for k, v in value.items():
+            _check_no_null(k, v)
+
+
+def make_merge_patch(old, new) -> dict:
+    """
+    The patch which turns old into new, None if they are the same.
+    Raises UnrepresentableChange if a new or changed value is (or contains, in a dictionary) None,
+    the whole of new has to be sent instead.
+    """
+    if old is new:
+        return None
+
+    if not isinstance(old, Mapping) or not isinstance(new, Mapping):
+        raise RuntimeError('A merge patch can only be made between two dictionaries')
+
+    patch = {}
+    for key in old:
+        if key not in new:
+            patch[key] = None
+
+    for key in new:
+        new_value = new[key]
+        if key not in old:
+            _check_no_null(key, new_value)
+            patch[key] = new_value
+            continue
+
+        old_value = old[key]
+        if old_value is new_value:
+            continue
+        if isinstance(old_value, Mapping) and isinstance(new_value, Mapping):
+            sub_patch = make_merge_patch(old_value, new_value)
+            if sub_patch:
+                patch[key] = sub_patch
+        elif old_value != new_value or type(old_value) != type(new_value):
+            _check_no_null(key, new_value)
+            patch[key] = new_value
+
+    return patch if patch else None
+
+
+def apply_merge_patch(target, patch):
+    """
+    Returns the patched target. The target isn't modified, the parts of it which the patch doesn't touch
+    are shared with the result (and in the case of the lazy configurations, aren't loaded).
+    """
+    if not isinstance(patch, Mapping):
+        return patch
+
+    result = {}
+    if isinstance(target, Mapping):
+        for key in target:
+            if key not in patch:
+                result[key] = target[key]
+
+    for key, value in patch.items():
+        if value is None:
+            continue
+        if isinstance(value, Mapping):
+            old_value = target.get(key) if isinstance(target, Mapping) else None
+            result[key] = apply_merge_patch(old_value if isinstance(old_value, Mapping) else {}, value)
+        else:
+            result[key] = value
+    return result
@@ -18,6 +18,7 @@ import os.path
 from .statefulnode import StatefulNode, ErrorCode, CanExecuteReturnVal
 from rich.progress import Progress, SpinnerColumn, TextColumn, BarColumn, TimeRemainingColumn, TimeElapsedColumn
 from .utils import TaskEnqueuerThread, Task
+from .perfreport import TransitionRecord
 
 
 
@@ -138,7 +139,10 @@ class SubsystemNode(StatefulNode):
             try:
                 del data['script_name']
                 for key, val in data.items():
-                    script[key].update(val)
+                    if isinstance(val, dict):
+                        script.setdefault(key, {}).update(val)
+                    else:
+                        script[key] = val
                 task = Task('execute_script', script)
                 self.pm_task_enqueuer.enqueue_synchronous(task)
                 # self.pm.execute_script(script)
@@ -218,6 +222,7 @@ class SubsystemNode(StatefulNode):
     def on_enter_boot_ing(self, event) -> NoReturn:
         partition = event.kwargs["partition"]
         self.log.info(f'Subsystem {self.name} is booting partition {partition}')
+        record = self._begin_record(event, 'boot')
         response = {
             "node": self.name,
             "command": "boot",
@@ -252,6 +257,7 @@ class SubsystemNode(StatefulNode):
                 command='boot',
                 exception=e,
             )
+            record.finish('failed')
             return
 
         try:
@@ -263,6 +269,7 @@ class SubsystemNode(StatefulNode):
                 command='boot',
                 exception=e,
             )
+            record.finish('failed')
             return
 
         children = []
@@ -291,29 +298,39 @@ class SubsystemNode(StatefulNode):
                 parent=self,
                 fsm_conf=self.fsm_conf)
 
-            tries=0 # give it 10 more seconds to come up
-            while (not child.sup.desc.proc.is_alive() or not child.sup.commander.ping()) and tries<20:
-                time.sleep(0.5)
-                tries+=1
+            etext=''
+            if event.kwargs['pm'].use_k8spm():
+                # The pod watch of the k8s pm already knows whether the app listens
+                # on its command port (readiness probe), no need to go through the proxy
+                booted = d.ready
+                if not booted:
+                    etext='The pod never became ready!'
+            else:
+                tries=0 # give it 10 more seconds to come up
+                while (not child.sup.desc.proc.is_alive() or not child.sup.commander.ping()) and tries<20:
+                    time.sleep(0.5)
+                    tries+=1
 
+                booted = child.sup.desc.proc.is_alive() and child.sup.commander.ping()
+                if not child.sup.desc.proc.is_alive():
+                    etext='Process isn\'t alive! '
+                if not child.sup.commander.ping():
+                    etext='Cannot ping the app!'
 
-            if child.sup.desc.proc.is_alive() and child.sup.commander.ping():
+            if booted:
+                record.replied(child.name)
                 # nothing really happens in these 2:
                 child.boot()
                 child.end_boot()
                 # ... but now the application is booted
             else:
+                record.failed(child.name, etext)
                 failed.append({
                     "node": child.name,
                     "status_code": 1,## I don't know
                     "command": "boot",
                     "error": "Not bootable",
                 })
-                etext=''
-                if not child.sup.desc.proc.is_alive():
-                    etext='Process isn\'t alive! '
-                if not child.sup.commander.ping():
-                    etext='Cannot ping the app!'
                 child.to_error(
                     text=etext,
                     command='boot'
@@ -337,9 +354,17 @@ class SubsystemNode(StatefulNode):
                 text=etext,
                 command='boot'
             )
+        record.finish('failed' if failed else 'ok')
         self.end_boot(response=response)
 
 
+    def _begin_record(self, event, command:str):
+        # the timings go to the recorder of the run control if there is one, and are thrown away otherwise
+        recorder = event.kwargs.get('recorder')
+        if recorder:
+            return recorder.begin(self.name, command)
+        return TransitionRecord(self.name, command)
+
     def _on_exit_callback(self, event) -> NoReturn:
         scripts = self.cfgmgr.boot.get('scripts', {})
 
@@ -425,6 +450,7 @@ class SubsystemNode(StatefulNode):
 
         log = f"Sending {command} to the subsystem {self.name}"
         self.log.debug(log)
+        record = self._begin_record(event, command)
 
         appset = list(self.children)
         failed = []
@@ -454,6 +480,7 @@ class SubsystemNode(StatefulNode):
                         'comment': text+"\nYou may be able to use '--force' if you want to 'stop' or 'scrap' the run."
                     }
                     self.trigger("to_"+origin, response=response)
+                    record.finish('aborted')
                     return
 
         for chuck in to_chuck:
@@ -462,6 +489,7 @@ class SubsystemNode(StatefulNode):
                     del appset[i]
 
         ignore = []
+        sent_at = {}
         with Progress(
             SpinnerColumn(),
             TextColumn("[progress.description]{task.description}"),
@@ -482,6 +510,7 @@ class SubsystemNode(StatefulNode):
                 entry_state = child_node.state.upper()
 
                 try:
+                    send_start = time.time()
                     child_node.trigger(command)
                     ## APP now in *_ing
                     child_node.sup.send_command(
@@ -490,15 +519,19 @@ class SubsystemNode(StatefulNode):
                         entry_state = entry_state,
                         exit_state = exit_state
                     )
+                    sent_at[child_node.name] = time.time()
+                    record.sent(child_node.name, send_start, sent_at[child_node.name])
                     completed += 1
                     progress.update(total, completed=completed)
 
                 except Exception as e:
+                    record.failed(child_node.name, 'send failed')
                     if force:
                         self.log.error(f'Failed to send \'{command}\' to \'{child_node.name}\', --force was specified so continuing anyway')
                         ignore+=[child_node.name]
                     else:
                         self.log.error(f'Failed to send \'{command}\' to \'{child_node.name}\'')
+                        record.finish('failed')
                         raise e
 
 
@@ -506,6 +539,18 @@ class SubsystemNode(StatefulNode):
             for i, app in enumerate(appset):
                 if chuck == app.name:
                     del appset[i]
+
+        # the apps which are much slower than usual are failed before the timeout
+        deadlines = {}
+        predictor = event.kwargs.get('deadlines')
+        if predictor:
+            try:
+                deadlines = predictor.deadlines(self.name, command, timeout)
+                for app, (deadline, usual, n) in deadlines.items():
+                    self.log.debug(f'{app} deadline for {command}: {deadline:.1f}s (p{predictor.quantile:g} of its last {n} replies: {usual:.2f}s)')
+            except Exception as e:
+                self.log.warning(f'Couldn\'t get the deadlines of the apps from the history, using the timeout: {str(e)}')
+
         with Progress(
             SpinnerColumn(),
             TextColumn("[progress.description]{task.description}"),
@@ -538,6 +583,7 @@ class SubsystemNode(StatefulNode):
                     if not is_alive:
                         failed.append(child_node.name)
                         mode_fail.append('app died')
+                        record.replied(child_node.name, 'app died')
                         child_node.to_error(
                             command = command,
                         )
@@ -549,6 +595,7 @@ class SubsystemNode(StatefulNode):
                         if failed_ping_count[child_node.name] > failed_ping_thres:
                             failed.append(child_node.name)
                             mode_fail.append('app not pinging')
+                            record.replied(child_node.name, 'app not pinging')
                             child_node.to_error(
                                 command = command,
                             )
@@ -557,9 +604,25 @@ class SubsystemNode(StatefulNode):
                     try:
                         r = child_node.sup.check_response()
                     except NoResponse:
+                        deadline = deadlines.get(child_node.name)
+                        if deadline and child_node.name in sent_at and time.time()-sent_at[child_node.name] > deadline[0]:
+                            from .perfhistory import deadline_failure
+                            text = f'\'{child_node.name}\' didn\'t reply to {command} in {deadline[0]:.1f}s, when it usually does in {deadline[1]:.2f}s (p{predictor.quantile:g} of its last {deadline[2]} replies)'
+                            self.log.error(text)
+                            failed.append(child_node.name)
+                            mode_fail.append(deadline_failure)
+                            # with the time it was failed after, which the next deadlines learn from
+                            record.replied(child_node.name, deadline_failure)
+                            child_node.to_error(
+                                command = command,
+                                text = text,
+                            )
+                            done += [child_node]
                         continue
 
                     done += [child_node]
+                    # when the response was received, not when this loop got to it
+                    record.replied(child_node.name, None if r['success'] else 'command error', at=child_node.sup.commander.response_time)
                     if r['success']:
                         child_node.trigger("end_"+command) # this is all dummy
                     else:
@@ -608,5 +671,6 @@ class SubsystemNode(StatefulNode):
                 "command": command,
             }
 
+        record.finish('failed' if failed else 'ok')
         self.resolve_error()
         self.trigger("end_"+command, response=response)
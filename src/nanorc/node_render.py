@@ -48,6 +48,14 @@ def print_status(topnode, console, apparatus_id='', partition='') -> int:
     table.add_column("last cmd")
     table.add_column("last succ. cmd", style="green")
 
+    # the pings can each take up to the connection timeout, they are done all at once
+    from concurrent.futures import ThreadPoolExecutor
+    apps = [node for node in PreOrderIter(topnode) if isinstance(node, ApplicationNode)]
+    pings = {}
+    if apps:
+        with ThreadPoolExecutor(max_workers=min(len(apps), 32)) as executor:
+            pings = dict(zip(apps, executor.map(lambda app: app.sup.commander.ping(), apps)))
+
     for pre, _, node in RenderTree(topnode):
         if isinstance(node, ApplicationNode):
             sup = node.sup
@@ -67,7 +75,7 @@ def print_status(topnode, console, apparatus_id='', partition='') -> int:
 
                 alive = f'dead[{exit_code}]'
 
-            ping = sup.commander.ping()
+            ping = pings[node]
             last_cmd_failed = (sup.last_sent_command != sup.last_ok_command)
 
             state_str = ''
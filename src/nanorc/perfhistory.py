@@ -0,0 +1,253 @@
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+
+schema = '''
+CREATE TABLE IF NOT EXISTS transitions (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    time REAL NOT NULL,
+    apparatus TEXT NOT NULL,
+    config_hash TEXT NOT NULL,
+    software_version TEXT NOT NULL,
+    run INTEGER,
+    node TEXT NOT NULL,
+    command TEXT NOT NULL,
+    duration REAL,
+    status TEXT
+);
+CREATE TABLE IF NOT EXISTS app_timings (
+    transition_id INTEGER NOT NULL REFERENCES transitions(id) ON DELETE CASCADE,
+    app TEXT NOT NULL,
+    send_time REAL,
+    reply_time REAL,
+    status TEXT,
+    failure TEXT
+);
+CREATE INDEX IF NOT EXISTS transitions_lookup ON transitions (apparatus, node, command, time);
+CREATE INDEX IF NOT EXISTS app_timings_transition ON app_timings (transition_id);
+'''
+
+# the failure of the apps which missed the deadline that the DeadlinePredictor gave them
+deadline_failure = 'much slower than usual'
+
+
+def default_history_path():
+    from .utils import get_config_cache_dir
+    return os.path.join(get_config_cache_dir('perf'), 'history.sqlite')
+
+
+def get_software_version():
+    return os.getenv('DUNE_DAQ_BASE_RELEASE', 'unknown')
+
+
+def configuration_hashes(topnode) -> dict:
+    """
+    A hash of the configuration of each subsystem (by node name), and of all of them (by the name of the top node).
+    It is cheap: the configuration directories are described by the size and modification time of their files.
+    """
+    import hashlib
+    from anytree import PreOrderIter
+    from .node import SubsystemNode
+    from .utils import get_config_manifest
+
+    hashes = {}
+    for node in PreOrderIter(topnode):
+        if not isinstance(node, SubsystemNode) or not node.cfgmgr: continue
+        cfgmgr = node.cfgmgr
+        if cfgmgr.source_bundle:
+            st = os.stat(cfgmgr.source_bundle)
+            description = [cfgmgr.source_bundle, st.st_mtime_ns, st.st_size]
+        elif cfgmgr.source_dir:
+            description = [cfgmgr.source_dir, get_config_manifest(cfgmgr.source_dir)]
+        else:
+            # the name and version of the configuration service document, which is immutable
+            description = [cfgmgr.config_query_string]
+        hashes[node.name] = hashlib.sha256(json.dumps(description).encode()).hexdigest()[:16]
+
+    combined = hashlib.sha256(json.dumps(sorted(hashes.items())).encode()).hexdigest()[:16]
+    hashes[topnode.name] = combined
+    return hashes
+
+
+def percentile(values:list, q:float):
+    """q in [0, 100], linear interpolation between the closest ranks"""
+    if not values:
+        return None
+    values = sorted(values)
+    position = (len(values)-1) * q/100
+    lower = int(position)
+    upper = min(lower+1, len(values)-1)
+    return values[lower] + (values[upper]-values[lower]) * (position-lower)
+
+
+class PerfHistory:
+    """
+    Local database of the timings of the transitions, one row per transition on each node
+    and one row per app in it, to look at their evolution (nano-perf-history) and to learn from them.
+    """
+    def __init__(self, path:str=None):
+        self.log = logging.getLogger(self.__class__.__name__)
+        self.path = path if path else default_history_path()
+        os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+        # written from the thread which finishes the transition, which isn't always the one which opened it
+        self.lock = threading.Lock()
+        self.db = sqlite3.connect(self.path, check_same_thread=False, timeout=10)
+        self.db.execute('PRAGMA journal_mode=WAL')
+        self.db.execute('PRAGMA foreign_keys=ON')
+        self.db.executescript(schema)
+
+    def close(self):
+        with self.lock:
+            self.db.close()
+
+    def add(self, record:dict, apparatus:str, config_hash:str, software_version:str, run:int=None) -> int:
+        """record is a TransitionRecord.to_dict()"""
+        with self.lock, self.db:
+            cursor = self.db.execute(
+                'INSERT INTO transitions (time, apparatus, config_hash, software_version, run, node, command, duration, status) VALUES (?,?,?,?,?,?,?,?,?)',
+                (record['start'], apparatus, config_hash, software_version, run, record['node'], record['command'], record['duration'], record['status'])
+            )
+            transition_id = cursor.lastrowid
+            self.db.executemany(
+                'INSERT INTO app_timings (transition_id, app, send_time, reply_time, status, failure) VALUES (?,?,?,?,?,?)',
+                [
+                    (transition_id, app, e['send_time'], e['reply_time'], e['status'], e['failure'])
+                    for app, e in record['apps'].items()
+                ]
+            )
+        return transition_id
+
+    def app_timings(self, apparatus:str=None, command:str=None, node:str=None, app:str=None, since:float=None, config_hash:str=None, software_version:str=None, only_ok:bool=True) -> list:
+        """The timings of the apps, oldest first, as dicts"""
+        conditions, params = [], []
+        for column, value in [('t.apparatus', apparatus), ('t.command', command), ('t.node', node), ('a.app', app),
+                              ('t.config_hash', config_hash), ('t.software_version', software_version)]:
+            if value is not None:
+                conditions.append(f'{column} = ?')
+                params.append(value)
+        if since is not None:
+            conditions.append('t.time >= ?')
+            params.append(since)
+        if only_ok:
+            conditions.append("a.status = 'ok'")
+
+        query = '''
+            SELECT t.time, t.apparatus, t.config_hash, t.software_version, t.run, t.node, t.command, a.app, a.send_time, a.reply_time, a.status, a.failure
+            FROM app_timings a JOIN transitions t ON a.transition_id = t.id
+        '''
+        if conditions:
+            query += ' WHERE ' + ' AND '.join(conditions)
+        query += ' ORDER BY t.time'
+
+        columns = ['time', 'apparatus', 'config_hash', 'software_version', 'run', 'node', 'command', 'app', 'send_time', 'reply_time', 'status', 'failure']
+        with self.lock:
+            return [dict(zip(columns, row)) for row in self.db.execute(query, params)]
+
+    def reply_times(self, apparatus:str, node:str, command:str, last:int=200, config_hash:str=None, software_version:str=None) -> dict:
+        """
+        app -> the reply times of its successful replies in the last `last` transitions, oldest first,
+        along with the time after which it was failed when it missed its deadline (it replied later than that).
+        Only these transitions are read (from the end of the index), however long the history is.
+        """
+        conditions, params = ['apparatus = ?', 'node = ?', 'command = ?'], [apparatus, node, command]
+        for column, value in [('config_hash', config_hash), ('software_version', software_version)]:
+            if value is not None:
+                conditions.append(f'{column} = ?')
+                params.append(value)
+        query = f'''
+            SELECT a.app, a.reply_time
+            FROM app_timings a JOIN (
+                SELECT id, time FROM transitions WHERE {' AND '.join(conditions)} ORDER BY time DESC LIMIT ?
+            ) t ON a.transition_id = t.id
+            WHERE (a.status = 'ok' OR a.failure = ?) AND a.reply_time IS NOT NULL
+            ORDER BY t.time
+        '''
+        ret = {}
+        with self.lock:
+            for app, reply_time in self.db.execute(query, params+[last, deadline_failure]):
+                ret.setdefault(app, []).append(reply_time)
+        return ret
+
+    def prune(self, older_than_days:float) -> int:
+        with self.lock, self.db:
+            cursor = self.db.execute('DELETE FROM transitions WHERE time < ?', (time.time()-older_than_days*86400,))
+            return cursor.rowcount
+
+
+def find_regressions(timings:list, commands=('conf', 'start'), recent:int=5, threshold:float=1.5, min_delta:float=0.5, min_history:int=10) -> list:
+    """
+    The apps whose median reply time over their last `recent` transitions is more than threshold x
+    (and min_delta seconds above) their median before that. Needs min_history earlier transitions to compare with.
+    """
+    series = {}
+    for timing in timings:
+        if timing['command'] not in commands or timing['reply_time'] is None: continue
+        key = (timing['apparatus'], timing['node'], timing['app'], timing['command'])
+        series.setdefault(key, []).append(timing)
+
+    regressions = []
+    for (apparatus, node, app, command), values in series.items():
+        if len(values) < recent+min_history: continue
+        baseline = [v['reply_time'] for v in values[:-recent]]
+        latest = values[-recent:]
+        baseline_median = percentile(baseline, 50)
+        recent_median = percentile([v['reply_time'] for v in latest], 50)
+        if recent_median > threshold*baseline_median and recent_median-baseline_median > min_delta:
+            regressions.append({
+                'apparatus': apparatus,
+                'node': node,
+                'app': app,
+                'command': command,
+                'baseline_median': baseline_median,
+                'baseline_p90': percentile(baseline, 90),
+                'recent_median': recent_median,
+                'ratio': recent_median/baseline_median if baseline_median else None,
+                'n_baseline': len(baseline),
+                # what changed, if anything
+                'config_changed': len({v['config_hash'] for v in latest} - {v['config_hash'] for v in values[:-recent]}) > 0,
+                'software_version': latest[-1]['software_version'],
+                'since': latest[0]['time'],
+            })
+    return sorted(regressions, key=lambda r: -(r['ratio'] or 0))
+
+
+class DeadlinePredictor:
+    """
+    Per app deadlines for a transition, learned from the history: the given quantile of the app's
+    reply times, times factor, and at least floor seconds. The timeout of the transition stays the upper bound,
+    and the apps with fewer than min_samples recorded replies just get the timeout.
+    Only the replies with the same configuration and software version are learned from, since they may change
+    the timings. The apps which were failed for missing their deadline count with the time they were failed after,
+    capped at the timeout, so that the deadlines can grow back when an app gets slower.
+    """
+    def __init__(self, history:PerfHistory, apparatus:str, config_hashes:dict=None, software_version:str=None, factor:float=3., floor:float=10., quantile:float=99, min_samples:int=20, last:int=200):
+        self.log = logging.getLogger(self.__class__.__name__)
+        self.history = history
+        self.apparatus = apparatus
+        self.config_hashes = config_hashes if config_hashes else {}
+        self.software_version = software_version
+        self.factor = factor
+        self.floor = floor
+        self.quantile = quantile
+        self.min_samples = min_samples
+        self.last = last
+
+    def deadlines(self, node:str, command:str, timeout:float) -> dict:
+        """app -> (deadline, quantile of its reply times, number of replies it is learned from)"""
+        ret = {}
+        times_per_app = self.history.reply_times(
+            self.apparatus, node, command,
+            last = self.last,
+            config_hash = self.config_hashes.get(node),
+            software_version = self.software_version,
+        )
+        for app, times in times_per_app.items():
+            if len(times) < self.min_samples: continue
+            usual = percentile([min(t, timeout) for t in times], self.quantile)
+            deadline = max(self.floor, usual*self.factor)
+            if deadline < timeout:
+                ret[app] = (deadline, usual, len(times))
+        return ret
@@ -0,0 +1,208 @@
+import json
+import logging
+import statistics
+import threading
+import time
+
+report_format_version = 1
+report_file_name = 'perf_report.json'
+
+
+class TransitionRecord:
+    """
+    Timings of one command on one node: when it was sent to each app, how long sending took,
+    and how long after that the app replied (or why it didn't).
+    """
+    def __init__(self, node:str, command:str, on_finish=None):
+        self.node = node
+        self.command = command
+        self.on_finish = on_finish
+        self.start = time.time()
+        self.duration = None
+        self.status = None
+        self.apps = {}
+
+    def _entry(self, app:str) -> dict:
+        return self.apps.setdefault(app, {'sent_at': None, 'send_time': None, 'reply_time': None, 'status': 'pending', 'failure': None})
+
+    def sent(self, app:str, send_start:float, send_end:float):
+        entry = self._entry(app)
+        entry['sent_at'] = send_start-self.start
+        entry['send_time'] = send_end-send_start
+
+    def replied(self, app:str, failure:str=None, at:float=None):
+        entry = self._entry(app)
+        # from the end of the send, or from the start of the transition when nothing was sent (boot)
+        sent = self.start + (entry['sent_at'] or 0) + (entry['send_time'] or 0)
+        entry['reply_time'] = (at if at else time.time())-sent
+        entry['status'] = 'failed' if failure else 'ok'
+        entry['failure'] = failure
+
+    def failed(self, app:str, failure:str):
+        # no reply to time, e.g. the command couldn't be sent
+        entry = self._entry(app)
+        entry['status'] = 'failed'
+        entry['failure'] = failure
+
+    def finish(self, status:str):
+        self.duration = time.time()-self.start
+        self.status = status
+        for entry in self.apps.values():
+            if entry['status'] == 'pending':
+                entry['status'] = 'failed'
+                entry['failure'] = 'no reply'
+        if self.on_finish:
+            self.on_finish(self)
+
+    def to_dict(self) -> dict:
+        return {
+            'node': self.node,
+            'command': self.command,
+            'start': self.start,
+            'duration': self.duration,
+            'status': self.status,
+            'apps': self.apps,
+        }
+
+
+class PerfRecorder:
+    """
+    Collects the TransitionRecords of the nodes (it is passed to them with the transition's kwargs),
+    until report() is called at the end of a run. The listeners get each record when it is finished.
+    """
+    def __init__(self):
+        self.log = logging.getLogger(self.__class__.__name__)
+        self.lock = threading.Lock()
+        self.records = []
+        self.listeners = []
+
+    def add_listener(self, listener):
+        self.listeners.append(listener)
+
+    def _finished(self, record:TransitionRecord):
+        for listener in self.listeners:
+            try:
+                listener(record)
+            except Exception as e:
+                self.log.error(f'Couldn\'t record the timings of {record.command} on {record.node}: {str(e)}')
+
+    def begin(self, node:str, command:str) -> TransitionRecord:
+        record = TransitionRecord(node, command, on_finish=self._finished)
+        with self.lock:
+            self.records.append(record)
+        return record
+
+    def report(self, apparatus_id:str, run:int, reset:bool=True) -> dict:
+        with self.lock:
+            records = [r.to_dict() for r in self.records if r.duration is not None]
+            if reset:
+                self.records = [r for r in self.records if r.duration is None]
+        return make_report(apparatus_id, run, records)
+
+
+def find_stragglers(apps:dict, factor:float=2., margin:float=1.) -> list:
+    """The apps which replied much later than the others: more than factor x the median and margin seconds above it"""
+    reply_times = {app: e['reply_time'] for app, e in apps.items() if e['reply_time'] is not None}
+    if len(reply_times) < 3:
+        return []
+    median = statistics.median(reply_times.values())
+    return sorted(
+        [app for app, t in reply_times.items() if t > factor*median and t > median+margin],
+        key = lambda app: -reply_times[app]
+    )
+
+
+def make_report(apparatus_id:str, run:int, records:list) -> dict:
+    transitions = []
+    for record in records:
+        reply_times = [e['reply_time'] for e in record['apps'].values() if e['reply_time'] is not None]
+        send_times = [e['send_time'] for e in record['apps'].values() if e['send_time'] is not None]
+        transitions.append({
+            **record,
+            'n_apps': len(record['apps']),
+            'total_send_time': sum(send_times),
+            'median_reply_time': statistics.median(reply_times) if reply_times else None,
+            'max_reply_time': max(reply_times) if reply_times else None,
+            'stragglers': find_stragglers(record['apps']),
+            'failed': sorted(app for app, e in record['apps'].items() if e['status'] == 'failed'),
+        })
+
+    return {
+        'format': 'nanorc-perf-report',
+        'version': report_format_version,
+        'apparatus_id': apparatus_id,
+        'run': run,
+        'created': time.time(),
+        'transitions': transitions,
+    }
+
+
+def render_report(report:dict, console, n_slowest:int=3):
+    from rich.table import Table
+    from datetime import datetime
+
+    t = Table(title=f'Transitions of run #{report["run"]} on {report["apparatus_id"]}')
+    t.add_column('Time')
+    t.add_column('Command')
+    t.add_column('Node')
+    t.add_column('Took', justify='right')
+    t.add_column('Apps', justify='right')
+    t.add_column('Sending', justify='right')
+    t.add_column('Median reply', justify='right')
+    t.add_column('Slowest replies')
+    t.add_column('Stragglers', style='yellow')
+    t.add_column('Failed', style='red')
+
+    def fmt(seconds):
+        return f'{seconds:.2f}s' if seconds is not None else ''
+
+    for tr in report['transitions']:
+        slowest = sorted(
+            [(app, e['reply_time']) for app, e in tr['apps'].items() if e['reply_time'] is not None],
+            key = lambda x: -x[1]
+        )[:n_slowest]
+        t.add_row(
+            datetime.fromtimestamp(tr['start']).strftime('%H:%M:%S'),
+            tr['command'],
+            tr['node'],
+            fmt(tr['duration']),
+            str(tr['n_apps']) if tr['n_apps'] else '',
+            fmt(tr['total_send_time']) if tr['n_apps'] else '',
+            fmt(tr['median_reply_time']),
+            ', '.join(f'{app} ({fmt(s)})' for app, s in slowest),
+            ', '.join(tr['stragglers']),
+            ', '.join(f'{app} ({tr["apps"][app]["failure"]})' for app in tr['failed']),
+        )
+    console.print(t)
+
+
+def load_report(path:str) -> dict:
+    with open(path) as f:
+        return json.load(f)
+
+
+def report_to_text(report:dict) -> str:
+    import io
+    from rich.console import Console
+    output = io.StringIO()
+    render_report(report, Console(file=output, width=250, color_system=None))
+    return output.getvalue()
+
+
+def write_report(report:dict, outdir:str) -> str:
+    """Writes the report (JSON, and the rendered table next to it) in outdir, returns the path of the JSON"""
+    import os
+    os.makedirs(outdir, exist_ok=True)
+    path = os.path.join(outdir, report_file_name)
+    with open(path, 'w') as f:
+        json.dump(report, f, indent=4, sort_keys=True)
+    with open(path.replace('.json', '.txt'), 'w') as f:
+        f.write(report_to_text(report))
+    return path
+
+
+def perf_report_dir(apparatus_id:str, run:int) -> str:
+    # where the reports of the runs saved in the run registry go
+    import os
+    from .utils import get_config_cache_dir
+    return os.path.join(get_config_cache_dir('perf-reports'), str(apparatus_id), f'RunConf_{run}')
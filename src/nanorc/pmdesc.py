@@ -2,9 +2,12 @@ import click
 from .k8spm import K8SProcessManager
 from .sshpm import SSHProcessManager
 from urllib import parse
+from collections.abc import Mapping
 
 
 class pm_desc:
+    k8s_options = ['pre-pull-images', 'stream-logs']
+
     def __init__(self, pm_arg):
         self.arg = pm_arg
         try:
@@ -33,6 +36,30 @@ class pm_desc:
         if self.is_kind and self.address != "localhost":
             raise click.BadParameter(f'Kind address can only be localhost for now!')
 
+        # k8s-only switches, passed as a query: k8s://np04-srv-016:31000?pre-pull-images
+        options = parse.parse_qs(pm_uri.query, keep_blank_values=True)
+        if options and not (self.is_kind or self.is_k8s_cluster):
+            raise click.BadParameter(f'Options {list(options.keys())} are only available with the k8s process manager')
+
+        for option in options:
+            if option not in self.k8s_options:
+                raise click.BadParameter(f'Unknown --pm option \'{option}\', available are {self.k8s_options}')
+
+        self.pre_pull_images = self._bool_option(options, 'pre-pull-images')
+        self.stream_logs = self._bool_option(options, 'stream-logs')
+
+    @staticmethod
+    def _bool_option(options, name):
+        values = options.get(name)
+        if values is None:
+            return False
+        value = values[-1].lower()
+        if value in ['', 'true', 'yes', '1']:
+            return True
+        if value in ['false', 'no', '0']:
+            return False
+        raise click.BadParameter(f'--pm option \'{name}\' should be true or false (got \'{values[-1]}\')')
+
     def use_k8spm(self):
         return self.is_kind or self.is_k8s_cluster
 
@@ -52,7 +79,7 @@ class PMFactory:
             # Yes, we need the list of connections here
             connections = {}
             for app, data in self.cfgmgr.conf_data.items():
-                if not isinstance(data, dict): continue
+                if not isinstance(data, Mapping): continue
                 if not 'init' in data: continue
                 connections[app] = []
                 # please hide all this configuration details from me!
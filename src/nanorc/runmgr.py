@@ -1,6 +1,7 @@
 import requests
 import json
 import logging
+import threading
 
 class SimpleRunNumberManager:
     def __init__(self):
@@ -15,7 +16,7 @@ class SimpleRunNumberManager:
 class DBRunNumberManager:
     """A class that interacts with the run number db"""
 
-    def __init__(self, socket:str):
+    def __init__(self, socket:str, prefetch:bool=False):
         super(DBRunNumberManager, self).__init__()
         self.log = logging.getLogger(self.__class__.__name__)
         self.run = None
@@ -25,15 +26,71 @@ class DBRunNumberManager:
         self.API_USER=auth.username
         self.API_PSWD=auth.password
         self.timeout = 2
+        # one connection, kept alive between the requests
+        self.session = requests.Session()
+        self.session.auth = (self.API_USER, self.API_PSWD)
+        self.session_lock = threading.Lock()
+        # prefetch: the next run number is reserved in the background when a run starts
+        self.prefetch = prefetch
+        self.next_run = None # future of the reserved run number
+        self.executor = None
+        if self.prefetch:
+            from concurrent.futures import ThreadPoolExecutor
+            self.executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='run-number-prefetch')
 
     def get_run_number(self):
+        next_run, self.next_run = self.next_run, None
+        if next_run:
+            try:
+                self.run = next_run.result(timeout=self.timeout)
+                self.log.info(f'Using the reserved run number {self.run}')
+                return self.run
+            except Exception as e:
+                self.log.warning(f'Couldn\'t reserve a run number in advance, getting a new one: {str(e)}')
+                # if it was only slow, the number it reserves is never used
+                next_run.add_done_callback(self._void_reserved)
         return self._getnew_run_number()
 
-    def _getnew_run_number(self):
+    def _void_reserved(self, next_run):
+        if next_run.cancelled() or next_run.exception() is not None:
+            return # nothing was reserved
+        run = next_run.result()
         try:
-            req = requests.get(self.API_SOCKET+'/runnumber/getnew',
-                               auth=(self.API_USER, self.API_PSWD),
-                               timeout=self.timeout)
+            self._update_stop(run)
+            self.log.info(f'The run number {run} was reserved too late to be used, it was closed (void run) in the run number DB')
+        except Exception as e:
+            self.log.error(f'Couldn\'t void the reserved run number {run}: {str(e)}')
+
+    def prefetch_next(self):
+        """Reserves the next run number in the background, so that the next get_run_number is instantaneous"""
+        if not self.prefetch or self.next_run:
+            return
+        self.next_run = self.executor.submit(self._reserve_run_number)
+
+    def _reserve_run_number(self):
+        run = self._getnew_run_number(set_current=False)
+        self.log.info(f'Reserved run number {run} for the next run')
+        return run
+
+    def terminate(self):
+        """The reserved run number which wasn't used is closed in the run number DB, so it appears as void"""
+        next_run, self.next_run = self.next_run, None
+        if next_run:
+            try:
+                run = next_run.result(timeout=self.timeout)
+                self._update_stop(run)
+                self.log.info(f'The reserved run number {run} wasn\'t used, it was closed (void run) in the run number DB')
+            except Exception as e:
+                self.log.error(f'Couldn\'t void the reserved run number: {str(e)}')
+        if self.executor:
+            self.executor.shutdown(wait=False)
+        self.session.close()
+
+    def _getnew_run_number(self, set_current=True):
+        try:
+            with self.session_lock:
+                req = self.session.get(self.API_SOCKET+'/runnumber/getnew',
+                                       timeout=self.timeout)
             req.raise_for_status()
         except requests.HTTPError as exc:
             error = f"{__name__}: HTTP Error (maybe failed auth, maybe ill-formed post message, ...)"
@@ -48,15 +105,16 @@ class DBRunNumberManager:
             self.log.error(error)
             raise RuntimeError(error) from exc
 
-        print(req.json())
-        self.run = req.json()[0][0][0]
-        return self.run
+        run = req.json()[0][0][0]
+        if set_current:
+            self.run = run
+        return run
 
     def _update_stop(self, run_number):
         try:
-            req = requests.get(self.API_SOCKET+'/runnumber/updatestop/'+str(run_number),
-                               auth=(self.API_USER, self.API_PSWD),
-                               timeout=self.timeout)
+            with self.session_lock:
+                req = self.session.get(self.API_SOCKET+'/runnumber/updatestop/'+str(run_number),
+                                       timeout=self.timeout)
             req.raise_for_status()
         except requests.HTTPError as exc:
             error = f"{__name__}: HTTP Error (maybe failed auth, maybe ill-formed post message, ...)"
@@ -0,0 +1,74 @@
+import os
+import click
+from rich.console import Console
+from rich.table import Table
+
+console = Console()
+
+@click.group()
+def bundle():
+    '''
+    Create and inspect nanorc configuration bundles: a configuration directory in a single file,
+    which nanorc can load directly instead of the directory.
+    '''
+    pass
+
+
+@bundle.command()
+@click.argument('json_dir', type=click.Path(exists=True, file_okay=False), required=True)
+@click.argument('output', type=click.Path(dir_okay=False), required=False, default=None)
+@click.option('--compression-level', type=click.IntRange(0, 9), default=6, help='zlib compression level of the files in the bundle')
+def create(json_dir, output, compression_level):
+    '''
+    Pack JSON_DIR into the bundle OUTPUT (by default, JSON_DIR.nrcb)
+    '''
+    from nanorc.lazyconf import write_bundle, bundle_suffix
+    if not output:
+        output = os.path.normpath(json_dir)+bundle_suffix
+
+    manifest = write_bundle(json_dir, output, compresslevel=compression_level)
+    console.print(f'Packed {manifest["n_files"]} files of [blue]{json_dir}[/blue] in [blue]{output}[/blue] ({os.path.getsize(output)/1024:.1f} kB)')
+
+
+@bundle.command()
+@click.argument('bundle_file', type=click.Path(exists=True, dir_okay=False), required=True)
+def ls(bundle_file):
+    '''
+    List the content of BUNDLE_FILE
+    '''
+    from nanorc.lazyconf import BundleSource
+    source = BundleSource(bundle_file)
+
+    t = Table(title=f'{bundle_file} ({source.manifest.get("name")}, created {source.manifest.get("created")})')
+    t.add_column('File')
+    t.add_column('Size', justify='right')
+    t.add_column('Compressed', justify='right')
+    for info in source.zipfile.infolist():
+        t.add_row(info.filename, f'{info.file_size}', f'{info.compress_size}')
+    console.print(t)
+
+
+@bundle.command()
+@click.argument('bundle_file', type=click.Path(exists=True, dir_okay=False), required=True)
+@click.argument('output_dir', type=click.Path(file_okay=False), required=True)
+def extract(bundle_file, output_dir):
+    '''
+    Unpack BUNDLE_FILE in OUTPUT_DIR, as a configuration directory
+    '''
+    from nanorc.lazyconf import BundleSource, bundle_manifest_name
+    source = BundleSource(bundle_file)
+    members = [n for n in source.zipfile.namelist() if n != bundle_manifest_name]
+    source.zipfile.extractall(output_dir, members=members)
+    console.print(f'Extracted {len(members)} files of [blue]{bundle_file}[/blue] in [blue]{output_dir}[/blue]')
+
+
+def main():
+    try:
+        bundle()
+    except Exception as e:
+        console.log("[bold red]Exception caught[/bold red]")
+        console.log(e)
+        console.print_exception()
+
+if __name__ == '__main__':
+    main()
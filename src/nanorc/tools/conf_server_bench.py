@@ -0,0 +1,189 @@
+import time
+import click
+from rich.console import Console
+from rich.table import Table
+
+console = Console()
+
+'''
+Load test of nanorc's internal configuration server: N clients fetch their init and conf data at the same time,
+like the apps do during init and conf. The server runs in its own process, so that the clients don't compete with it for the GIL.
+'''
+
+def make_synthetic_configuration(n_apps, payload_kb):
+    payload = {f'key{i}': 'x'*100 for i in range(max(1, payload_kb*1024//110))}
+    return {
+        f'app{i:04d}': {
+            'init': {'modules': [{'inst': f'app{i:04d}-module', 'data': payload}]},
+            'conf': {'modules': [{'match': '', 'data': payload}]},
+        } for i in range(n_apps)
+    }
+
+
+def _serve(port, mode, pool_workers, conf_path, n_apps, payload_kb, gzip_level, ready, stop):
+    from nanorc.confserver import ConfServer
+    cs = ConfServer(port, mode=mode, pool_workers=pool_workers, gzip_level=gzip_level)
+    if conf_path:
+        cs.add_configuration_directory('bench', conf_path)
+    else:
+        cs.add_configuration_data('bench', make_synthetic_configuration(n_apps, payload_kb))
+    ready.set()
+    stop.wait()
+    cs.terminate()
+
+
+class BenchmarkServer:
+    def __init__(self, port, mode, pool_workers=64, conf_path=None, n_apps=100, payload_kb=20, gzip_level=6):
+        import multiprocessing
+        self.port = port
+        self.ready = multiprocessing.Event()
+        self.stop_event = multiprocessing.Event()
+        self.process = multiprocessing.Process(
+            target = _serve,
+            args = (port, mode, pool_workers, conf_path, n_apps, payload_kb, gzip_level, self.ready, self.stop_event),
+            name = 'nano-conf-bench-server',
+        )
+
+    def start(self, timeout=60):
+        self.process.start()
+        if not self.ready.wait(timeout):
+            self.stop()
+            raise RuntimeError(f'The configuration server didn\'t start in {timeout}s')
+        return self
+
+    def stop(self):
+        self.stop_event.set()
+        self.process.join(10)
+        if self.process.is_alive():
+            self.process.terminate()
+
+
+def fetch(port, query, accept_gzip, timeout):
+    import http.client
+    conn = http.client.HTTPConnection('127.0.0.1', port, timeout=timeout)
+    try:
+        conn.request('GET', f'/configuration?{query}', headers={'Accept-Encoding': 'gzip'} if accept_gzip else {})
+        r = conn.getresponse()
+        r.read()
+        return r.status
+    finally:
+        conn.close()
+
+
+def run_load(port, queries, n_clients, accept_gzip=True, timeout=60):
+    '''
+    Each client fetches its queries (one after the other) once all the clients are ready.
+    Returns the latencies of the successful fetches, the number of failed ones and the wall time.
+    '''
+    import threading
+    barrier = threading.Barrier(n_clients+1)
+    latencies = []
+    errors = []
+    lock = threading.Lock()
+
+    def client(i):
+        my_latencies = []
+        my_errors = 0
+        barrier.wait()
+        for query in queries[i % len(queries)]:
+            start = time.perf_counter()
+            try:
+                status = fetch(port, query, accept_gzip, timeout)
+                if status != 200:
+                    raise RuntimeError(f'HTTP {status}')
+                my_latencies.append(time.perf_counter()-start)
+            except Exception:
+                my_errors += 1
+        with lock:
+            latencies.extend(my_latencies)
+            errors.append(my_errors)
+
+    threads = [threading.Thread(target=client, args=(i,), daemon=True) for i in range(n_clients)]
+    for t in threads: t.start()
+    barrier.wait()
+    start = time.perf_counter()
+    for t in threads: t.join()
+    return latencies, sum(errors), time.perf_counter()-start
+
+
+def summarise(latencies, n_errors, wall_time):
+    import statistics
+    if len(latencies) > 1:
+        q = statistics.quantiles(latencies, n=100)
+        p50, p99 = q[49], q[98]
+    else:
+        p50 = p99 = latencies[0] if latencies else float('nan')
+    return {
+        'requests': len(latencies)+n_errors,
+        'errors': n_errors,
+        'p50': p50,
+        'p99': p99,
+        'max': max(latencies) if latencies else float('nan'),
+        'throughput': len(latencies)/wall_time if wall_time else 0.,
+    }
+
+
+def app_queries(app_names):
+    return [[f'name=bench&app_name={app}&cmd_name={cmd}' for cmd in ['init', 'conf']] for app in app_names]
+
+
+@click.command()
+@click.option('--mode', type=click.Choice(['threaded', 'pool', 'all']), default='all', help='Configuration server mode(s) to benchmark')
+@click.option('--n-clients', type=int, default=1000, help='Number of concurrent clients (apps)')
+@click.option('--rounds', type=int, default=3, help='How many times all the clients fetch their data')
+@click.option('--payload-kb', type=int, default=20, help='Size of the init and conf data of each synthetic app')
+@click.option('--pool-workers', type=int, default=64, help='Number of threads in the pool mode')
+@click.option('--gzip/--no-gzip', default=True, help='Whether the clients accept gzipped responses')
+@click.option('--port', type=int, default=18547, help='Port of the configuration server')
+@click.option('--conf', type=click.Path(exists=True), default=None, help='Serve this configuration directory or bundle instead of a synthetic one')
+def bench(mode, n_clients, rounds, payload_kb, pool_workers, gzip, port, conf):
+    modes = ['threaded', 'pool'] if mode == 'all' else [mode]
+
+    if conf:
+        from nanorc.lazyconf import LazyConfigData
+        data = LazyConfigData(conf)
+        app_names = [k for k, v in data.items() if hasattr(v, 'cmd_files')]
+    else:
+        app_names = [f'app{i:04d}' for i in range(n_clients)]
+    queries = app_queries(app_names)
+
+    t = Table(title=f'{n_clients} clients fetching init and conf, {rounds} round(s)')
+    t.add_column('Mode')
+    t.add_column('Requests', justify='right')
+    t.add_column('Errors', justify='right')
+    t.add_column('p50 (ms)', justify='right')
+    t.add_column('p99 (ms)', justify='right')
+    t.add_column('max (ms)', justify='right')
+    t.add_column('Throughput (req/s)', justify='right')
+
+    for m in modes:
+        server = BenchmarkServer(port, m, pool_workers=pool_workers, conf_path=conf, n_apps=n_clients, payload_kb=payload_kb).start()
+        try:
+            all_latencies, all_errors, all_time = [], 0, 0.
+            for r in range(rounds):
+                latencies, n_errors, wall_time = run_load(port, queries, n_clients, accept_gzip=gzip)
+                all_latencies += latencies
+                all_errors += n_errors
+                all_time += wall_time
+        finally:
+            server.stop()
+
+        s = summarise(all_latencies, all_errors, all_time)
+        t.add_row(
+            m, f'{s["requests"]}', f'{s["errors"]}',
+            f'{s["p50"]*1000:.1f}', f'{s["p99"]*1000:.1f}', f'{s["max"]*1000:.1f}',
+            f'{s["throughput"]:.0f}',
+        )
+    console.print(t)
+
+
+def main():
+    try:
+        bench()
+    except Exception as e:
+        console.log("[bold red]Exception caught[/bold red]")
+        console.log(e)
+        console.print_exception()
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,544 @@
+import click
+import copy as cp
+import heapq
+import itertools
+import json
+import random
+import re
+import threading
+import time
+from collections import Counter
+from datetime import datetime, timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse, parse_qs
+from rich.console import Console
+
+console = Console()
+
+
+def now_str():
+    return datetime.now(timezone.utc).strftime('%Y-%m-%dT%H:%M:%SZ')
+
+
+class FakeCluster(object):
+    """In-memory state of a fake Kubernetes cluster.
+
+    Only the objects nanorc creates are modelled (namespaces, pods, services,
+    endpoints, PVCs and daemonsets). Pods go Pending -> Running/Ready after
+    pod_start_latency (+/- jitter) seconds, or fail with probability
+    pod_failure_rate. Deleted namespaces take namespace_delete_latency seconds
+    to go away with everything in them.
+    """
+    def __init__(self, n_nodes:int=10, pod_start_latency:float=0.5, pod_start_jitter:float=0.2,
+                 pod_failure_rate:float=0., namespace_delete_latency:float=0.5, api_latency:float=0.):
+        self.nodes = [f'fake-node-{i}' for i in range(n_nodes)]
+        self.pod_start_latency = pod_start_latency
+        self.pod_start_jitter = pod_start_jitter
+        self.pod_failure_rate = pod_failure_rate
+        self.namespace_delete_latency = namespace_delete_latency
+        self.api_latency = api_latency
+
+        self.cond = threading.Condition()
+        self.resource_version = 0
+        self.namespaces = {}
+        self.objects = {} # (kind, namespace) -> {name: object}
+        self.events = [] # (resource_version, kind, namespace, type, object)
+        self.calls = Counter()
+
+        self.schedule = []
+        self.sequence = itertools.count()
+        self.running = True
+        self.scheduler = threading.Thread(target=self._run_schedule, name='fake-k8s-scheduler', daemon=True)
+        self.scheduler.start()
+
+    def stop(self):
+        with self.cond:
+            self.running = False
+            self.cond.notify_all()
+        self.scheduler.join()
+
+    # ---
+    def _next_rv(self):
+        self.resource_version += 1
+        return str(self.resource_version)
+
+    def _record(self, kind, namespace, etype, obj):
+        obj['metadata']['resourceVersion'] = self._next_rv()
+        self.events.append((self.resource_version, kind, namespace, etype, cp.deepcopy(obj)))
+        self.cond.notify_all()
+
+    def _at(self, delay, action, *args):
+        heapq.heappush(self.schedule, (time.time()+delay, next(self.sequence), action, args))
+        self.cond.notify_all()
+
+    def _run_schedule(self):
+        with self.cond:
+            while self.running:
+                if not self.schedule:
+                    self.cond.wait()
+                    continue
+                when, _, action, args = self.schedule[0]
+                delay = when - time.time()
+                if delay > 0:
+                    self.cond.wait(delay)
+                    continue
+                heapq.heappop(self.schedule)
+                action(*args)
+
+    # --- namespaces
+    def create_namespace(self, body):
+        with self.cond:
+            name = body['metadata']['name']
+            if name in self.namespaces:
+                return 409, status_body(409, 'AlreadyExists', f'namespaces "{name}" already exists')
+            ns = {
+                'apiVersion': 'v1',
+                'kind': 'Namespace',
+                'metadata': {'name': name, 'labels': {}, 'creationTimestamp': now_str()},
+                'status': {'phase': 'Active'},
+            }
+            self.namespaces[name] = ns
+            self._record('namespaces', None, 'ADDED', ns)
+            return 201, ns
+
+    def patch_namespace(self, name, body):
+        with self.cond:
+            ns = self.namespaces.get(name)
+            if not ns:
+                return 404, status_body(404, 'NotFound', f'namespaces "{name}" not found')
+            ns['metadata'].setdefault('labels', {}).update(body.get('metadata', {}).get('labels', {}))
+            self._record('namespaces', None, 'MODIFIED', ns)
+            return 200, ns
+
+    def delete_namespace(self, name):
+        with self.cond:
+            ns = self.namespaces.get(name)
+            if not ns:
+                return 404, status_body(404, 'NotFound', f'namespaces "{name}" not found')
+            ns['status']['phase'] = 'Terminating'
+            self._record('namespaces', None, 'MODIFIED', ns)
+            self._at(self.namespace_delete_latency, self._finalise_namespace, name)
+            return 200, ns
+
+    def _finalise_namespace(self, name):
+        for (kind, namespace), objs in self.objects.items():
+            if namespace != name: continue
+            for obj in list(objs.values()):
+                self._record(kind, namespace, 'DELETED', obj)
+            objs.clear()
+        ns = self.namespaces.pop(name, None)
+        if ns:
+            self._record('namespaces', None, 'DELETED', ns)
+
+    def list_namespaces(self):
+        with self.cond:
+            return 200, list_body('NamespaceList', list(self.namespaces.values()), self.resource_version)
+
+    # --- generic namespaced objects
+    def create_object(self, kind, namespace, body):
+        with self.cond:
+            if namespace not in self.namespaces:
+                return 404, status_body(404, 'NotFound', f'namespaces "{namespace}" not found')
+            if self.namespaces[namespace]['status']['phase'] == 'Terminating':
+                return 403, status_body(403, 'Forbidden', f'namespace {namespace} is being terminated')
+            objs = self.objects.setdefault((kind, namespace), {})
+            name = body['metadata']['name']
+            if name in objs:
+                return 409, status_body(409, 'AlreadyExists', f'{kind} "{name}" already exists')
+            obj = cp.deepcopy(body)
+            obj['metadata']['namespace'] = namespace
+            obj['metadata']['creationTimestamp'] = now_str()
+            obj['metadata']['uid'] = f'{kind}-{namespace}-{name}'
+            if kind == 'pods':
+                self._init_pod(obj)
+            elif kind == 'daemonsets':
+                self._init_daemonset(obj)
+            objs[name] = obj
+            self._record(kind, namespace, 'ADDED', obj)
+            return 201, obj
+
+    def get_object(self, kind, namespace, name):
+        with self.cond:
+            obj = self.objects.get((kind, namespace), {}).get(name)
+            if obj is None:
+                return 404, status_body(404, 'NotFound', f'{kind} "{name}" not found')
+            return 200, obj
+
+    def delete_object(self, kind, namespace, name):
+        with self.cond:
+            obj = self.objects.get((kind, namespace), {}).pop(name, None)
+            if obj is None:
+                return 404, status_body(404, 'NotFound', f'{kind} "{name}" not found')
+            self._record(kind, namespace, 'DELETED', obj)
+            return 200, status_body(200, None, 'deleted', status='Success')
+
+    def list_objects(self, kind, namespace=None):
+        with self.cond:
+            items = []
+            for (k, ns), objs in self.objects.items():
+                if k != kind: continue
+                if namespace is not None and ns != namespace: continue
+                items += list(objs.values())
+            return 200, list_body(f'{kind.capitalize()[:-1]}List', items, self.resource_version)
+
+    # --- pod lifecycle
+    def _init_pod(self, pod):
+        pod['spec']['nodeName'] = random.choice(self.nodes)
+        pod['status'] = {
+            'phase': 'Pending',
+            'conditions': [{'type': 'PodScheduled', 'status': 'True'}],
+            'containerStatuses': [self._container_status(pod, {'waiting': {'reason': 'ContainerCreating'}})],
+        }
+        delay = max(0., self.pod_start_latency + random.uniform(-self.pod_start_jitter, self.pod_start_jitter))
+        self._at(delay, self._start_pod, pod['metadata']['namespace'], pod['metadata']['name'])
+
+    def _container_status(self, pod, state, ready=False, restart_count=0):
+        container = pod['spec']['containers'][0]
+        return {
+            'name': container['name'],
+            'image': container.get('image', ''),
+            'imageID': '',
+            'ready': ready,
+            'restartCount': restart_count,
+            'state': state,
+        }
+
+    def _start_pod(self, namespace, name):
+        pod = self.objects.get(('pods', namespace), {}).get(name)
+        if pod is None:
+            return
+        if random.random() < self.pod_failure_rate:
+            pod['status']['phase'] = 'Failed'
+            pod['status']['containerStatuses'] = [self._container_status(pod, {
+                'terminated': {'exitCode': 1, 'reason': 'Error', 'startedAt': now_str(), 'finishedAt': now_str()}
+            })]
+        else:
+            pod['status']['phase'] = 'Running'
+            pod['status']['podIP'] = f'10.0.{random.randint(0,255)}.{random.randint(1,254)}'
+            pod['status']['conditions'] = [
+                {'type': 'PodScheduled', 'status': 'True'},
+                {'type': 'ContainersReady', 'status': 'True'},
+                {'type': 'Ready', 'status': 'True'},
+            ]
+            pod['status']['containerStatuses'] = [self._container_status(pod, {
+                'running': {'startedAt': now_str()}
+            }, ready=True)]
+        self._record('pods', namespace, 'MODIFIED', pod)
+
+    def _init_daemonset(self, ds):
+        ds['metadata']['generation'] = 1
+        ds['status'] = {
+            'currentNumberScheduled': 0,
+            'desiredNumberScheduled': len(self.nodes),
+            'numberMisscheduled': 0,
+            'numberReady': 0,
+            'observedGeneration': 1,
+        }
+        self._at(self.pod_start_latency, self._ready_daemonset, ds['metadata']['namespace'], ds['metadata']['name'])
+
+    def _ready_daemonset(self, namespace, name):
+        ds = self.objects.get(('daemonsets', namespace), {}).get(name)
+        if ds is None:
+            return
+        ds['status']['currentNumberScheduled'] = len(self.nodes)
+        ds['status']['numberReady'] = len(self.nodes)
+        self._record('daemonsets', namespace, 'MODIFIED', ds)
+
+    # --- watches
+    def watch(self, kind, namespace, resource_version, timeout):
+        """Yields (type, object), starting with the current objects if no resource version is given"""
+        deadline = time.time() + timeout
+        def selected(k, ns):
+            return k == kind and (namespace is None or ns == namespace)
+
+        with self.cond:
+            initial = []
+            if resource_version is None:
+                for (k, ns), objs in self.objects.items():
+                    if not selected(k, ns): continue
+                    initial += [cp.deepcopy(obj) for obj in objs.values()]
+                last = self.resource_version
+            else:
+                last = int(resource_version)
+
+        for obj in initial:
+            yield 'ADDED', obj
+
+        while True:
+            with self.cond:
+                # every recorded event bumps the resource version by one, so they're indexed by it
+                while self.running and len(self.events) <= last:
+                    remaining = deadline - time.time()
+                    if remaining <= 0:
+                        return
+                    self.cond.wait(remaining)
+                if not self.running:
+                    return
+                new = self.events[last:]
+                last = len(self.events)
+
+            for _, k, ns, etype, obj in new:
+                if selected(k, ns):
+                    yield etype, obj
+
+    def log_lines(self, namespace, name):
+        pod = self.objects.get(('pods', namespace), {}).get(name)
+        if pod is None:
+            return None
+        return [f'{now_str()} fake log line {i} of {name}\n' for i in range(3)]
+
+
+def status_body(code, reason, message, status='Failure'):
+    return {
+        'kind': 'Status',
+        'apiVersion': 'v1',
+        'metadata': {},
+        'status': status,
+        'message': message,
+        'reason': reason,
+        'code': code,
+    }
+
+
+def list_body(kind, items, resource_version):
+    return {
+        'kind': kind,
+        'apiVersion': 'v1',
+        'metadata': {'resourceVersion': str(resource_version)},
+        'items': items,
+    }
+
+
+class FakeK8sHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    routes = [
+        # (method, regex, handler name)
+        ('GET',    r'/api/v1/namespaces',                                                    'list_namespaces'),
+        ('POST',   r'/api/v1/namespaces',                                                    'create_namespace'),
+        ('PATCH',  r'/api/v1/namespaces/(?P<name>[^/]+)',                                    'patch_namespace'),
+        ('DELETE', r'/api/v1/namespaces/(?P<name>[^/]+)',                                    'delete_namespace'),
+        ('GET',    r'/api/v1/namespaces/(?P<ns>[^/]+)/pods/(?P<name>[^/]+)/log',             'pod_log'),
+        ('GET',    r'/api/v1/namespaces/(?P<ns>[^/]+)/(?P<kind>pods)/(?P<name>[^/]+)/status', 'get_object'),
+        ('GET',    r'/apis/apps/v1/namespaces/(?P<ns>[^/]+)/(?P<kind>daemonsets)/(?P<name>[^/]+)/status', 'get_object'),
+        ('GET',    r'/api/v1/(?P<kind>endpoints)',                                           'list_objects'),
+        ('GET',    r'/api/v1/namespaces/(?P<ns>[^/]+)/(?P<kind>[^/]+)',                      'list_objects'),
+        ('POST',   r'/api/v1/namespaces/(?P<ns>[^/]+)/(?P<kind>[^/]+)',                      'create_object'),
+        ('POST',   r'/apis/apps/v1/namespaces/(?P<ns>[^/]+)/(?P<kind>daemonsets)',           'create_object'),
+        ('GET',    r'/api/v1/namespaces/(?P<ns>[^/]+)/(?P<kind>[^/]+)/(?P<name>[^/]+)',      'get_object'),
+        ('DELETE', r'/api/v1/namespaces/(?P<ns>[^/]+)/(?P<kind>[^/]+)/(?P<name>[^/]+)',      'delete_object'),
+        ('DELETE', r'/apis/apps/v1/namespaces/(?P<ns>[^/]+)/(?P<kind>daemonsets)/(?P<name>[^/]+)', 'delete_object'),
+        ('GET',    r'/fake/calls',                                                           'get_calls'),
+        ('DELETE', r'/fake/calls',                                                           'reset_calls'),
+    ]
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_GET(self):    self.dispatch('GET')
+    def do_POST(self):   self.dispatch('POST')
+    def do_PATCH(self):  self.dispatch('PATCH')
+    def do_DELETE(self): self.dispatch('DELETE')
+
+    def dispatch(self, method):
+        cluster = self.server.cluster
+        url = urlparse(self.path)
+        self.query = {k: v[-1] for k, v in parse_qs(url.query).items()}
+        length = int(self.headers.get('Content-Length', 0))
+        self.body = json.loads(self.rfile.read(length)) if length else None
+
+        for route_method, route, handler in self.routes:
+            if route_method != method: continue
+            match = re.fullmatch(route, url.path)
+            if not match: continue
+            if not url.path.startswith('/fake/'):
+                # e.g. 'GET /api/v1/namespaces/{ns}/pods/{name}/status'
+                groups = match.groupdict()
+                label = re.sub(r'\(\?P<(\w+)>[^)]*\)', lambda m: groups[m[1]] if m[1] == 'kind' else '{'+m[1]+'}', route)
+                watching = self.flag('watch')
+                cluster.calls[f'{method} {label}{" (watch)" if watching else ""}'] += 1
+                if cluster.api_latency:
+                    time.sleep(cluster.api_latency)
+            getattr(self, handler)(**match.groupdict())
+            return
+
+        self.reply(404, status_body(404, 'NotFound', f'{method} {url.path} is not implemented by the fake API server'))
+
+    def flag(self, name):
+        # the python client sends the booleans as 'True'
+        return self.query.get(name, '').lower() in ['true', 't', '1']
+
+    def reply(self, code, body):
+        with self.server.cluster.cond: # the objects are live, don't let the scheduler touch them meanwhile
+            data = json.dumps(body).encode()
+        self.send_response(code)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def start_stream(self, content_type):
+        # chunked, like the real API server: the clients get each chunk as it comes,
+        # rather than reading until the connection is closed
+        self.send_response(200)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Transfer-Encoding', 'chunked')
+        self.send_header('Connection', 'close')
+        self.end_headers()
+        self.close_connection = True
+
+    def write_chunk(self, data:bytes):
+        self.wfile.write(f'{len(data):x}\r\n'.encode()+data+b'\r\n')
+        self.wfile.flush()
+
+    def end_stream(self):
+        self.wfile.write(b'0\r\n\r\n')
+        self.wfile.flush()
+
+    # --- handlers
+    def list_namespaces(self):
+        if self.flag('watch'):
+            return self.watch('namespaces', None)
+        self.reply(*self.server.cluster.list_namespaces())
+
+    def create_namespace(self):
+        self.reply(*self.server.cluster.create_namespace(self.body))
+
+    def patch_namespace(self, name):
+        self.reply(*self.server.cluster.patch_namespace(name, self.body))
+
+    def delete_namespace(self, name):
+        self.reply(*self.server.cluster.delete_namespace(name))
+
+    def list_objects(self, kind, ns=None):
+        if self.flag('watch'):
+            return self.watch(kind, ns)
+        self.reply(*self.server.cluster.list_objects(kind, ns))
+
+    def create_object(self, kind, ns):
+        self.reply(*self.server.cluster.create_object(kind, ns, self.body))
+
+    def get_object(self, kind, ns, name):
+        self.reply(*self.server.cluster.get_object(kind, ns, name))
+
+    def delete_object(self, kind, ns, name):
+        self.reply(*self.server.cluster.delete_object(kind, ns, name))
+
+    def watch(self, kind, ns):
+        timeout = float(self.query.get('timeoutSeconds', 300))
+        self.start_stream('application/json')
+        try:
+            for etype, obj in self.server.cluster.watch(kind, ns, self.query.get('resourceVersion'), timeout):
+                self.write_chunk((json.dumps({'type': etype, 'object': obj})+'\n').encode())
+            self.end_stream()
+        except (BrokenPipeError, ConnectionResetError):
+            pass
+
+    def pod_log(self, ns, name):
+        cluster = self.server.cluster
+        lines = cluster.log_lines(ns, name)
+        if lines is None:
+            return self.reply(404, status_body(404, 'NotFound', f'pods "{name}" not found'))
+        self.start_stream('text/plain')
+        try:
+            for line in lines:
+                self.write_chunk(line.encode())
+            if self.flag('follow'):
+                # keep the stream open until the pod goes away
+                while cluster.running and cluster.log_lines(ns, name) is not None:
+                    time.sleep(0.5)
+            self.end_stream()
+        except (BrokenPipeError, ConnectionResetError):
+            pass
+
+    def get_calls(self):
+        self.reply(200, dict(self.server.cluster.calls))
+
+    def reset_calls(self):
+        self.server.cluster.calls.clear()
+        self.reply(200, {})
+
+
+class FakeK8sServer(object):
+    """Runs a FakeCluster behind an HTTP server in a background thread"""
+    def __init__(self, host:str='127.0.0.1', port:int=0, **cluster_args):
+        self.cluster = FakeCluster(**cluster_args)
+        self.httpd = ThreadingHTTPServer((host, port), FakeK8sHandler)
+        self.httpd.daemon_threads = True
+        self.httpd.cluster = self.cluster
+        self.host, self.port = self.httpd.server_address[:2]
+        self.thread = threading.Thread(target=self.httpd.serve_forever, name='fake-k8s-server', daemon=True)
+
+    @property
+    def url(self):
+        return f'http://{self.host}:{self.port}'
+
+    def start(self):
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.cluster.stop()
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+    def write_kubeconfig(self, path:str):
+        kubeconfig = {
+            'apiVersion': 'v1',
+            'kind': 'Config',
+            'clusters': [{'name': 'fake', 'cluster': {'server': self.url}}],
+            'users': [{'name': 'fake', 'user': {'token': 'fake'}}],
+            'contexts': [{'name': 'fake', 'context': {'cluster': 'fake', 'user': 'fake'}}],
+            'current-context': 'fake',
+        }
+        # JSON is valid YAML
+        with open(path, 'w') as f:
+            json.dump(kubeconfig, f, indent=2)
+        return path
+
+
+@click.command()
+@click.option('--host', type=str, default='127.0.0.1', help='Interface to listen on')
+@click.option('--port', type=int, default=6443, help='Port to listen on')
+@click.option('--nodes', type=int, default=10, help='Number of fake nodes to schedule the pods on')
+@click.option('--pod-start-latency', type=float, default=0.5, help='Seconds for a pod to become ready')
+@click.option('--pod-start-jitter', type=float, default=0.2, help='Uniform jitter on the pod start latency, in seconds')
+@click.option('--pod-failure-rate', type=float, default=0., help='Probability of a pod failing to start')
+@click.option('--namespace-delete-latency', type=float, default=0.5, help='Seconds for a deleted namespace to go away')
+@click.option('--api-latency', type=float, default=0., help='Seconds added to every API call')
+@click.option('--kubeconfig', type=click.Path(), default=None, help='Write a kubeconfig pointing at the fake server there')
+def fake_k8s(host, port, nodes, pod_start_latency, pod_start_jitter, pod_failure_rate, namespace_delete_latency, api_latency, kubeconfig):
+    server = FakeK8sServer(
+        host = host,
+        port = port,
+        n_nodes = nodes,
+        pod_start_latency = pod_start_latency,
+        pod_start_jitter = pod_start_jitter,
+        pod_failure_rate = pod_failure_rate,
+        namespace_delete_latency = namespace_delete_latency,
+        api_latency = api_latency,
+    )
+    if kubeconfig:
+        server.write_kubeconfig(kubeconfig)
+        console.print(f'Use it with: export KUBECONFIG={kubeconfig}')
+    console.print(f'Fake k8s API server listening on {server.url}')
+    try:
+        server.httpd.serve_forever()
+    except KeyboardInterrupt:
+        console.print('Stopping the fake k8s API server')
+    finally:
+        server.cluster.stop()
+        server.httpd.server_close()
+        console.print(f'API calls:\n{json.dumps(dict(server.cluster.calls), indent=2)}')
+
+
+def main():
+    try:
+        fake_k8s()
+    except Exception as e:
+        console.log("[bold red]Exception caught[/bold red]")
+        console.log(e)
+        console.print_exception()
+
+if __name__ == '__main__':
+    main()
@@ -44,6 +44,44 @@ def query(socket:str, query:str, user:str, password:str, log) -> dict:
         raise RuntimeError(error) from exc
     return r
 
+
+def print_conf_files(console, directory:str, strip_root:bool=False):
+    from nanorc.perfreport import report_file_name, load_report, render_report
+    for rootn, dirn, filen in os.walk(directory):
+        dirn.sort()
+        for f in sorted(filen):
+            name = os.path.join(rootn,f)
+            print(name)
+            file_name = os.path.relpath(name, directory)
+            if strip_root: # the RunConf directory of the tarballs
+                file_name = "/".join(file_name.split("/")[1:])
+
+            if f == report_file_name:
+                render_report(load_report(name), console)
+                continue
+            if not f.endswith('.json'):
+                continue
+
+            fi = open(name, "r")
+            grid = Table(title=f"File: {file_name}", show_header=False)
+            grid.add_row(JSON(fi.read()))
+            console.print(grid)
+
+
+def print_local_perf_report(console, run_number):
+    # the timings of the runs saved in the run registry stay on the machine which ran them
+    import glob
+    from nanorc.perfreport import report_file_name, load_report, render_report
+    from nanorc.utils import get_config_cache_dir
+    if run_number is None:
+        raise RuntimeError('The run number has to be known to look for its timings')
+    paths = glob.glob(os.path.join(get_config_cache_dir('perf-reports'), '*', f'RunConf_{int(run_number)}', report_file_name))
+    if not paths:
+        console.print(f'No timing of the transitions of run {run_number} on this machine')
+    for path in paths:
+        render_report(load_report(path), console)
+
+
 @click.command()
 @click.argument('run_number', default=None, required=False)
 @click.option('--get-config', type=bool, default=True, help="whether to download the configuration and render it")
@@ -51,11 +89,17 @@ def query(socket:str, query:str, user:str, password:str, log) -> dict:
 @click.option('--html/--no-html', default=True, help='whether we should start a little HTML server, short-lived to see the result')
 @click.option('--host', type=str, default="localhost", help='Where the temp server should serve HTML')
 @click.option('--port', type=int, default=5001, help='Which port the temp server should serve HTML')
+@click.option('--run-conf-dir', type=click.Path(exists=True, file_okay=False), default=None, help='A RunConf_<run> directory saved by nanorc (instead of getting the run from the run registry)')
 @click.pass_obj
-def print_run_config(obj, run_number, get_config, dotnanorc, html, host, port):
-    dotnanorc = os.path.expanduser(dotnanorc)
+def print_run_config(obj, run_number, get_config, dotnanorc, html, host, port, run_conf_dir):
     log = logging.getLogger("getconf")
 
+    if run_conf_dir:
+        print_conf_files(obj.console, run_conf_dir)
+        return
+
+    dotnanorc = os.path.expanduser(dotnanorc)
+
     obj.console.print(f"[blue]Loading {dotnanorc}[/blue]")
     f = open(dotnanorc)
     dotnanorc = json.load(f)
@@ -90,7 +134,9 @@ def print_run_config(obj, run_number, get_config, dotnanorc, html, host, port):
         grid.add_row(str(key), str(val))
     obj.console.print(grid)
 
-    if not get_config: return
+    if not get_config:
+        print_local_perf_report(obj.console, run_number)
+        return
     obj.console.print()
     obj.console.print()
     obj.console.print()
@@ -113,20 +159,9 @@ def print_run_config(obj, run_number, get_config, dotnanorc, html, host, port):
         tar = tarfile.open(fname, "r:gz")
         tar.extractall(temp_name)
         tar.close()
-        for rootn, dirn, filen in os.walk(temp_name):
-            for f in filen:
-                name = os.path.join(rootn,f)
-                print(name)
-                try: # such a sloppy way of doing things. Get a grip man!
-                    file_name = name.split(temp_name)[1]
-                    file_name = "/".join(file_name.split("/")[2:])
-                except:
-                    file_name = name
-                fi = open(name, "r")
-
-                grid = Table(title=f"File: {file_name}", show_header=False)
-                grid.add_row(JSON(fi.read()))
-                obj.console.print(grid)
+        print_conf_files(obj.console, temp_name, strip_root=True)
+
+    print_local_perf_report(obj.console, run_number)
 
     if not html:
         return
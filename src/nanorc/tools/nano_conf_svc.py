@@ -41,6 +41,7 @@ def svc(json_dir, name, port):
         cs.terminate()
 
     signal.signal(signal.SIGINT, signal_handler)
+    cs.manager.join()
 
 def main():
     try:
@@ -0,0 +1,152 @@
+import time
+import click
+from datetime import datetime
+from rich.console import Console
+from rich.table import Table
+
+console = Console()
+
+@click.group()
+@click.option('--db', type=click.Path(dir_okay=False), default=None, help='The history database (by default, the one nanorc writes in ~/.cache/nanorc/perf)')
+@click.pass_context
+def perf_history(ctx, db):
+    '''
+    Look at the timings of the transitions recorded by nanorc: their percentiles over time, and the apps which got slower.
+    '''
+    from nanorc.perfhistory import PerfHistory
+    ctx.obj = PerfHistory(db)
+
+
+def fmt(seconds):
+    return f'{seconds:.2f}s' if seconds is not None else ''
+
+
+def bucket_of(timing, by):
+    match by:
+        case 'day':
+            return datetime.fromtimestamp(timing['time']).strftime('%Y-%m-%d')
+        case 'week':
+            return datetime.fromtimestamp(timing['time']).strftime('%Y-W%W')
+        case 'version':
+            return timing['software_version']
+        case 'config':
+            return timing['config_hash']
+
+
+@perf_history.command()
+@click.option('--apparatus', type=str, default=None)
+@click.option('--command', type=str, default=None, help='Only this transition (conf, start...)')
+@click.option('--node', type=str, default=None, help='Only this subsystem')
+@click.option('--app', type=str, default=None, help='Only this application')
+@click.option('--days', type=float, default=30, help='How far back to look')
+@click.option('--by', type=click.Choice(['day', 'week', 'version', 'config']), default='day', help='How to group the transitions')
+@click.option('--per-app/--all-apps', default=False, help='One line per app, rather than all the apps of a subsystem together')
+@click.pass_obj
+def show(history, apparatus, command, node, app, days, by, per_app):
+    '''
+    Percentiles of the reply times of the apps, over time
+    '''
+    from nanorc.perfhistory import percentile
+    timings = history.app_timings(apparatus=apparatus, command=command, node=node, app=app, since=time.time()-days*86400)
+    if not timings:
+        console.print(f'No timing recorded in {history.path} for this selection')
+        return
+
+    groups = {}
+    for timing in timings:
+        if timing['reply_time'] is None: continue
+        key = (timing['apparatus'], timing['command'], timing['node'], timing['app'] if per_app else '', bucket_of(timing, by))
+        groups.setdefault(key, []).append(timing['reply_time'])
+
+    t = Table(title=f'Reply times of the apps over the last {days:g} days ({history.path})')
+    t.add_column('Apparatus')
+    t.add_column('Command')
+    t.add_column('Node')
+    if per_app:
+        t.add_column('App')
+    t.add_column(by.capitalize())
+    t.add_column('Replies', justify='right')
+    for q in ['p50', 'p90', 'p99', 'max']:
+        t.add_column(q, justify='right')
+
+    for (apparatus_, command_, node_, app_, bucket), values in sorted(groups.items()):
+        row = [apparatus_, command_, node_] + ([app_] if per_app else []) + [bucket, str(len(values))]
+        row += [fmt(percentile(values, q)) for q in [50, 90, 99, 100]]
+        t.add_row(*row)
+    console.print(t)
+
+
+@perf_history.command()
+@click.option('--apparatus', type=str, default=None)
+@click.option('--command', 'commands', type=str, multiple=True, default=['conf', 'start'], help='The transitions to look at (can be repeated)')
+@click.option('--recent', type=int, default=5, help='How many of the last transitions are compared to the ones before')
+@click.option('--threshold', type=float, default=1.5, help='The ratio of the recent median to the earlier one above which an app is flagged')
+@click.option('--min-delta', type=float, default=0.5, help='And the minimum difference, in seconds')
+@click.option('--min-history', type=int, default=10, help='How many earlier transitions are needed to compare with')
+@click.option('--days', type=float, default=90, help='How far back to look')
+@click.pass_obj
+@click.pass_context
+def regressions(ctx, history, apparatus, commands, recent, threshold, min_delta, min_history, days):
+    '''
+    Flag the apps whose reply time recently got worse than in their history (exits with 1 if there is any)
+    '''
+    from nanorc.perfhistory import find_regressions
+    timings = history.app_timings(apparatus=apparatus, since=time.time()-days*86400)
+    found = find_regressions(
+        timings,
+        commands = commands,
+        recent = recent,
+        threshold = threshold,
+        min_delta = min_delta,
+        min_history = min_history,
+    )
+    if not found:
+        console.print(f'No regression found ({len(timings)} app timings looked at)')
+        return
+
+    t = Table(title=f'Apps slower in their last {recent} transitions than before')
+    t.add_column('Apparatus')
+    t.add_column('Command')
+    t.add_column('Node')
+    t.add_column('App')
+    t.add_column('Before (p50/p90)', justify='right')
+    t.add_column('Recent p50', justify='right', style='red')
+    t.add_column('Ratio', justify='right')
+    t.add_column('Since')
+    t.add_column('Config changed')
+    t.add_column('Software version')
+    for r in found:
+        t.add_row(
+            r['apparatus'], r['command'], r['node'], r['app'],
+            f'{fmt(r["baseline_median"])}/{fmt(r["baseline_p90"])} ({r["n_baseline"]})',
+            fmt(r['recent_median']),
+            f'x{r["ratio"]:.1f}' if r['ratio'] else '',
+            datetime.fromtimestamp(r['since']).strftime('%Y-%m-%d %H:%M'),
+            'yes' if r['config_changed'] else 'no',
+            r['software_version'],
+        )
+    console.print(t)
+    ctx.exit(1)
+
+
+@perf_history.command()
+@click.argument('days', type=float)
+@click.pass_obj
+def prune(history, days):
+    '''
+    Remove the transitions older than DAYS
+    '''
+    n_removed = history.prune(days)
+    console.print(f'Removed {n_removed} transition(s) from {history.path}')
+
+
+def main():
+    try:
+        perf_history()
+    except Exception as e:
+        console.log("[bold red]Exception caught[/bold red]")
+        console.log(e)
+        console.print_exception()
+
+if __name__ == '__main__':
+    main()
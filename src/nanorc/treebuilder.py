@@ -43,31 +43,72 @@ class TreeBuilder:
                 self.extract_json_to_nodes(d, child, fsm_conf = fsm_conf)
 
             elif isinstance(d, ParseResult):
-                try:
-                    cfgmgr = ConfigManager(
-                        log = self.log,
-                        process_manager_description = self.process_manager_description,
-                        config_url = d,
-                        session = self.session,
-                        port_offset = self.port_offset+self.subsystem_port_offset,
-                        upload_to = self.conf_server
-                    )
-                except Exception as e:
-                    raise ConfigManagerCreationFailed(n) from e
-
                 node = SubsystemNode(
                     name = n,
                     log = self.log,
-                    cfgmgr = cfgmgr,
+                    cfgmgr = None, # filled by build_config_managers
                     console = self.console,
                     fsm_conf = fsm_conf,
                     parent = mother
                 )
+                # the offsets are given in the order of the tree, whatever the order the configurations load in
+                self.pending_cfgmgrs.append((node, d, self.port_offset+self.subsystem_port_offset))
                 self.subsystem_port_offset += self.subsystem_port_increment
             else:
                 self.log.error(f"ERROR processing the tree {n}: {d} I don't know what that's supposed to mean?")
                 exit(1)
 
+    def build_config_managers(self):
+        import time
+        from concurrent.futures import ThreadPoolExecutor
+
+        def build(config_url, port_offset):
+            start = time.time()
+            cfgmgr = ConfigManager(
+                log = self.log,
+                process_manager_description = self.process_manager_description,
+                config_url = config_url,
+                session = self.session,
+                port_offset = port_offset,
+                upload_to = self.conf_server,
+                use_config_cache = self.config_cache,
+                offline_config = self.offline_config,
+            )
+            return cfgmgr, time.time()-start
+
+        if not self.pending_cfgmgrs:
+            return
+
+        start = time.time()
+        failed = []
+        first_exception = None
+        with ThreadPoolExecutor(max_workers=min(len(self.pending_cfgmgrs), self.max_cfgmgr_workers)) as executor:
+            futures = [
+                (node, executor.submit(build, config_url, port_offset))
+                for node, config_url, port_offset in self.pending_cfgmgrs
+            ]
+            for node, future in futures:
+                try:
+                    node.cfgmgr, load_time = future.result()
+                    self.log.info(f'Loaded the configuration of \'{node.name}\' in {load_time:.2f}s')
+                except Exception as e:
+                    self.log.error(f'Couldn\'t load the configuration of \'{node.name}\': {str(e)}')
+                    failed.append(node.name)
+                    first_exception = first_exception or e
+
+        self.pending_cfgmgrs = []
+        if failed:
+            raise ConfigManagerCreationFailed(', '.join(failed)) from first_exception
+        self.log.info(f'Loaded {len(futures)} configuration(s) in {time.time()-start:.2f}s')
+
+        # only the configurations which aren't indexed (db://) are in memory at this point
+        stats = self.conf_server.get_store_stats()
+        if stats['pieces']:
+            self.log.info(
+                f'Configuration store: {stats["pieces"]} app/command entries, {stats["unique"]} unique '
+                f'({stats["stored_bytes"]/1e6:.2f} MB), {stats["shared_bytes"]/1e6:.2f} MB saved by sharing the identical ones'
+            )
+
     def get_custom_commands(self):
         ret = {}
         for node in PreOrderIter(self.topnode):
@@ -85,16 +126,20 @@ class TreeBuilder:
     def terminate(self):
         self.conf_server.terminate()
 
-    def __init__(self, log, top_cfg, process_manager_description, fsm_conf, console, port_offset, session):
+    def __init__(self, log, top_cfg, process_manager_description, fsm_conf, console, port_offset, session, config_cache=True, offline_config=False, conf_server_mode='threaded'):
         self.session = session
+        self.config_cache = config_cache
+        self.offline_config = offline_config
         self.log = log
         self.process_manager_description = process_manager_description
         self.fsm_conf = fsm_conf
         self.port_offset = port_offset
         self.subsystem_port_offset = 0
         self.subsystem_port_increment = 50
+        self.pending_cfgmgrs = []
+        self.max_cfgmgr_workers = 16
         from .confserver import ConfServer
-        self.conf_server = ConfServer(8547+port_offset)
+        self.conf_server = ConfServer(8547+port_offset, mode=conf_server_mode, config_cache=config_cache)
         self.initial_top_cfg = top_cfg
         self.apparatus_id, self.top_cfg = TreeBuilder.get_apparatus_and_config(top_cfg)
 
@@ -125,6 +170,7 @@ class TreeBuilder:
             self.topnode,
             fsm_conf=self.fsm_conf
         )
+        self.build_config_managers()
 
 
     @staticmethod
@@ -141,6 +187,15 @@ class TreeBuilder:
                 }
                 return apparatus_id, data
 
+            case 'bundle':
+                from .lazyconf import bundle_suffix
+                apparatus_id = Path(input.path).name.removesuffix(bundle_suffix)
+                data = {
+                    "apparatus_id": apparatus_id,
+                    apparatus_id: input
+                }
+                return apparatus_id, data
+
             case 'topjson':
                 from .argval import validate_conf
                 f = open(input.path)
@@ -176,7 +231,7 @@ class TreeBuilder:
                 return pretty_name, data
 
             case _:
-                log.error(f"'{input}' invalid! You must provide either a top level json file, a directory name, or confservice:configuration")
+                log.error(f"'{input}' invalid! You must provide either a top level json file, a directory name, a configuration bundle, or confservice:configuration")
                 exit(1)
 
 
@@ -4,6 +4,7 @@ import time
 from typing import NoReturn
 from multiprocessing import Process
 from flask import request
+from werkzeug.serving import BaseWSGIServer
 import logging
 
 
@@ -11,14 +12,50 @@ def signal_handler(signal_num, frame):
     print(f"Ignoring SIGQUIT (Ctrl-\\) - press enter to get shell back")
 
 
+class PoolWSGIServer(BaseWSGIServer):
+    """
+    werkzeug server which hands the connections to a fixed pool of threads, with a long listen queue.
+    With many clients connecting at once, werkzeug's threaded server starts a thread per connection
+    and refuses the connections which don't fit in its (128 long) listen queue.
+    """
+    multithread = True
+    request_queue_size = 4096
+
+    def __init__(self, host, port, app, workers=64, **kwargs):
+        from concurrent.futures import ThreadPoolExecutor
+        super().__init__(host, port, app, **kwargs)
+        self.pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='wsgi-pool')
+
+    def process_request(self, request, client_address):
+        self.pool.submit(self._process_request, request, client_address)
+
+    def _process_request(self, request, client_address):
+        try:
+            self.finish_request(request, client_address)
+        except Exception:
+            self.handle_error(request, client_address)
+        finally:
+            self.shutdown_request(request)
+
+    def server_close(self):
+        super().server_close()
+        self.pool.shutdown(wait=False, cancel_futures=True)
+
+
 class FlaskManager(threading.Thread):
-    def __init__(self, name, app, port):
+    def __init__(self, name, app, port, in_process=False, pool_workers=None):
         threading.Thread.__init__(self)
         self.log = logging.getLogger(f"{name}-flaskmanager")
         self.name = name
         self.app = app
         self.flask = None
         self.port = port
+        # in_process: serve from threads of this process, so that the app shares its memory with nanorc
+        self.in_process = in_process
+        # in_process only: serve from a fixed pool of threads rather than a thread per connection
+        self.pool_workers = pool_workers
+        self.server = None
+        self.daemon = in_process # don't hold nanorc when it exits
 
         self.ready = False
         self.ready_lock = threading.Lock()
@@ -82,7 +119,35 @@ class FlaskManager(threading.Thread):
 
         return flask_srv
 
+    def _serve_in_process(self):
+        import os
+        from werkzeug.serving import make_server
+        # one line per request would end up in nanorc's console
+        logging.getLogger('werkzeug').setLevel(logging.WARNING)
+        try:
+            if self.pool_workers:
+                self.server = PoolWSGIServer("0.0.0.0", self.port, self.app, workers=self.pool_workers)
+            else:
+                self.server = make_server("0.0.0.0", self.port, self.app, threaded=True)
+        except Exception as e:
+            self.log.error(f'Cannot create the {self.name} on port {self.port}: {str(e)}')
+            return
+        self.log.info(f'{self.name} Flask lives in thread {self.native_id} of PID {os.getpid()}')
+        with self.ready_lock:
+            self.ready = True
+
+        self.server.serve_forever()
+        with self.ready_lock:
+            self.ready = False
+        self.log.info(f'{self.name}-flaskmanager terminated')
+
     def stop(self) -> NoReturn:
+        if self.in_process:
+            if self.server:
+                self.server.shutdown()
+                self.server.server_close()
+            self.join()
+            return
         self.flask.terminate()
         self.flask.join()
         self.join()
@@ -103,7 +168,10 @@ class FlaskManager(threading.Thread):
         self.log.info(f'{self.name}-flaskmanager terminated')
 
     def run(self) -> NoReturn:
-        self._create_and_join_flask()
+        if self.in_process:
+            self._serve_in_process()
+        else:
+            self._create_and_join_flask()
 
 
 def which(program):
@@ -312,6 +380,37 @@ def get_json_recursive(path):
     return data
 
 
+def get_config_cache_dir(kind:str):
+    import os
+    cache_home = os.getenv('XDG_CACHE_HOME', os.path.expanduser('~/.cache'))
+    return os.path.join(cache_home, 'nanorc', kind)
+
+def get_config_manifest(path):
+    # every file under path, with its size and modification time
+    import os
+    manifest = []
+    for root, dirs, files in os.walk(path):
+        dirs.sort()
+        for filename in sorted(files):
+            full_path = os.path.join(root, filename)
+            st = os.stat(full_path)
+            manifest.append((os.path.relpath(full_path, path), st.st_mtime_ns, st.st_size))
+    return manifest
+
+def dump_to_cache(cache_file, obj):
+    import os, pickle, tempfile
+    os.makedirs(os.path.dirname(cache_file), exist_ok=True)
+    # write it elsewhere and move it, so that concurrent nanorcs never read half a cache file
+    fd, tmp_file = tempfile.mkstemp(dir=os.path.dirname(cache_file), suffix='.tmp')
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            pickle.dump(obj, f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp_file, cache_file)
+    except:
+        os.remove(tmp_file)
+        raise
+
+
 def parse_string(string_to_format:str, dico:dict={}) -> str:
     from string import Formatter
     fieldnames = [fname for _, fname, _, _ in Formatter().parse(string_to_format) if fname]
@@ -0,0 +1,41 @@
+from nanorc.confserver import BlobStore, EncodedConfiguration
+
+'''
+The identical pieces of the pre-encoded configurations are only kept once, and only those are counted as saved.
+'''
+
+def make_configuration(n_apps):
+    return {
+        'boot': {'apps': {f'app{i}': {} for i in range(n_apps)}},
+        **{f'app{i}': {'init': {'modules': ['same']*100}, 'conf': {'id': i}} for i in range(n_apps)},
+    }
+
+
+def test_identical_pieces_are_shared():
+    blobs = BlobStore()
+    original = make_configuration(3)
+    first = EncodedConfiguration(original, blobs=blobs)
+    first.preencode()
+    second = EncodedConfiguration(make_configuration(2), blobs=blobs)
+    second.preencode()
+
+    # the caller's configuration isn't modified
+    assert original == make_configuration(3)
+    assert first.data == original
+    assert first.data['app1']['init'] is first.data['app0']['init']
+    assert second.data['app0']['init'] is first.data['app0']['init']
+
+    stats = blobs.stats()
+    init_size = len(first.encoded[('app0', 'init')].body)
+    assert stats['shared_bytes'] >= 4*init_size
+
+
+def test_only_kept_pieces_count_as_shared():
+    blobs = BlobStore()
+    conf = EncodedConfiguration(make_configuration(3), blobs=blobs)
+    # not pre-encoded: the pieces are encoded when they are asked for, and the configuration keeps its own data
+    for i in range(3):
+        conf.get(f'app{i}', 'init', 'conf')
+    stats = blobs.stats()
+    assert stats['duplicates'] == 2
+    assert stats['shared_bytes'] == 0
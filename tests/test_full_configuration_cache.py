@@ -0,0 +1,61 @@
+import json
+import os
+import pytest
+
+from nanorc.lazyconf import LazyConfigData
+from nanorc.confserver import encode_full_configuration, encode
+
+'''
+The whole of a configuration directory is cached encoded, for the run configuration which fetches it at each start.
+'''
+
+@pytest.fixture
+def config_dir(tmp_path, monkeypatch):
+    monkeypatch.setenv('XDG_CACHE_HOME', str(tmp_path/'cache'))
+    path = tmp_path/'config'
+    (path/'data').mkdir(parents=True)
+    for name, content in {
+        'boot.json': {'apps': {'app0': {}}},
+        'data/app0_init.json': {'connections': [{'id': {'uid': 'c0'}, 'uri': 'tcp://localhost:1000'}]},
+        'data/app0_conf.json': {'x': 1},
+    }.items():
+        with open(path/name, 'w') as f:
+            json.dump(content, f)
+    return path
+
+
+def cache_files(tmp_path):
+    return os.listdir(tmp_path/'cache'/'nanorc'/'configs')
+
+
+def test_cached_until_a_file_changes(config_dir, tmp_path, monkeypatch):
+    first = encode_full_configuration(LazyConfigData(str(config_dir)))
+    assert first.body == encode(LazyConfigData(str(config_dir)))
+    assert len(cache_files(tmp_path)) == 1
+
+    # nothing is read from the directory if it didn't change
+    import nanorc.confserver
+    monkeypatch.setattr(nanorc.confserver, 'encode', lambda *args, **kwargs: 1/0)
+    second = encode_full_configuration(LazyConfigData(str(config_dir)))
+    assert (second.body, second.etag) == (first.body, first.etag)
+    monkeypatch.undo()
+
+    with open(config_dir/'data'/'app0_conf.json', 'w') as f:
+        json.dump({'x': 22}, f)
+    changed = encode_full_configuration(LazyConfigData(str(config_dir)))
+    assert json.loads(changed.body)['app0']['conf'] == {'x': 22}
+    assert changed.etag != first.etag
+
+
+def test_connections_transform_is_part_of_the_key(config_dir):
+    plain = encode_full_configuration(LazyConfigData(str(config_dir)))
+    transform = {'port_offset': 1, 'hosts': {}, 'external_connections': []}
+    transformed = encode_full_configuration(LazyConfigData(str(config_dir), connections_transform=transform))
+    assert transformed.etag != plain.etag
+    assert json.loads(transformed.body)['app0']['init']['connections'][0]['uri'] == 'tcp://localhost:1001'
+
+
+def test_no_cache(config_dir, tmp_path):
+    entry = encode_full_configuration(LazyConfigData(str(config_dir)), use_cache=False)
+    assert entry.body == encode(LazyConfigData(str(config_dir)))
+    assert not os.path.exists(tmp_path/'cache')
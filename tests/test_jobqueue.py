@@ -0,0 +1,140 @@
+import os
+
+from nanorc.jobqueue import BackgroundJobQueue
+
+'''
+The background jobs (logbook entries, run registry uploads...) have to go through in the order they were
+submitted, even when one of them has to be retried, and the ones which didn't go through are picked up
+again by the next nanorc from the journal.
+'''
+
+def journal_files(journal_dir):
+    return sorted(f for f in os.listdir(journal_dir) if f.endswith('.json') or f.endswith('.blob'))
+
+
+def test_jobs_run_in_order():
+    done = []
+    jobs = BackgroundJobQueue()
+    jobs.register('append', lambda args, blob: done.append(args['n']))
+    jobs.start()
+    for n in range(20):
+        jobs.submit('append', {'n': n}, f'job {n}')
+    assert jobs.wait(10)
+    jobs.stop()
+    assert done == list(range(20))
+
+
+def test_failing_job_blocks_the_next_ones():
+    done = []
+    failures = {'first': 2}
+
+    def handler(args, blob):
+        if failures.get(args['name'], 0) > 0:
+            failures[args['name']] -= 1
+            done.append(f'{args["name"]} failed')
+            raise RuntimeError('not yet')
+        done.append(args['name'])
+
+    jobs = BackgroundJobQueue(min_backoff=0.01, max_backoff=0.05)
+    jobs.register('job', handler)
+    jobs.start()
+    jobs.submit('job', {'name': 'first'}, 'first')
+    jobs.submit('job', {'name': 'second'}, 'second')
+    assert jobs.wait(10)
+    jobs.stop()
+    # the second job waits for the first one to go through
+    assert done == ['first failed', 'first failed', 'first', 'second']
+
+
+def test_given_up_job_doesnt_block(tmp_path):
+    done = []
+
+    def handler(args, blob):
+        if args['name'] == 'broken':
+            raise RuntimeError('always')
+        done.append(args['name'])
+
+    jobs = BackgroundJobQueue(journal_dir=str(tmp_path), max_attempts=3, min_backoff=0.01, max_backoff=0.01)
+    jobs.register('job', handler)
+    jobs.start()
+    jobs.submit('job', {'name': 'broken'}, 'broken')
+    jobs.submit('job', {'name': 'fine'}, 'fine')
+    assert jobs.wait(10)
+
+    status = jobs.status()
+    assert done == ['fine']
+    assert len(status) == 1
+    assert status[0]['state'] == 'failed'
+    assert status[0]['attempts'] == 3
+    assert status[0]['last_error'] == 'always'
+    jobs.stop()
+    # it stays in the journal for the next session
+    assert journal_files(tmp_path) == ['0.json']
+
+
+def test_journal_replay_after_restart(tmp_path):
+    journal_dir = str(tmp_path)
+
+    # never started, like a nanorc which was killed before the jobs went through
+    jobs = BackgroundJobQueue(journal_dir=journal_dir)
+    jobs.register('job', lambda args, blob: None)
+    for n in range(12): # 10.json sorts before 2.json by name
+        jobs.submit('job', {'n': n}, f'job {n}', blob=f'blob {n}'.encode() if n%2 else None)
+    jobs.stop()
+    assert len(journal_files(journal_dir)) == 12+6
+
+    done = []
+    replayed = BackgroundJobQueue(journal_dir=journal_dir)
+    replayed.register('job', lambda args, blob: done.append((args['n'], blob)))
+    assert [job.id for job in replayed.jobs] == list(range(12))
+    replayed.start()
+    # the new jobs go after the journaled ones
+    new_job = replayed.submit('job', {'n': 12}, 'job 12')
+    assert new_job.id == 12
+    assert replayed.wait(10)
+    replayed.stop()
+
+    assert done == [(n, f'blob {n}'.encode() if n%2 else None) for n in range(12)] + [(12, None)]
+    assert journal_files(journal_dir) == []
+
+
+def test_journal_used_by_another_queue(tmp_path):
+    first = BackgroundJobQueue(journal_dir=str(tmp_path))
+    second = BackgroundJobQueue(journal_dir=str(tmp_path))
+    assert first.journal_dir == str(tmp_path)
+    assert second.journal_dir is None
+    first.stop()
+    second.stop()
+
+
+def test_journal_from_elsewhere_isnt_replayed(tmp_path):
+    journal_dir = str(tmp_path)
+    jobs = BackgroundJobQueue(journal_dir=journal_dir)
+    jobs.register('job', lambda args, blob: None, {'apparatus': 'np04_coldbox', 'logbook': 'elisa'})
+    jobs.submit('job', {'n': 0}, 'for the coldbox')
+    jobs.stop()
+
+    done = []
+    replayed = BackgroundJobQueue(journal_dir=journal_dir)
+    replayed.register('job', lambda args, blob: done.append(args['n']), {'apparatus': 'np02_vd', 'logbook': 'elisa'})
+    replayed.start()
+    replayed.submit('job', {'n': 1}, 'for the vd')
+    assert replayed.wait(10)
+
+    assert done == [1]
+    status = replayed.status()
+    assert [(s['description'], s['state'], s['attempts']) for s in status] == [('for the coldbox', 'failed', 0)]
+    assert 'np04_coldbox' in status[0]['last_error']
+    # it can't be retried here, it stays in the journal for a nanorc of the right apparatus
+    replayed.retry_failed()
+    assert replayed.wait(10)
+    replayed.stop()
+    assert done == [1]
+    assert journal_files(journal_dir) == ['0.json']
+
+    right = BackgroundJobQueue(journal_dir=journal_dir)
+    right.register('job', lambda args, blob: done.append(args['n']), {'apparatus': 'np04_coldbox', 'logbook': 'elisa'})
+    right.start()
+    assert right.wait(10)
+    right.stop()
+    assert done == [1, 0]
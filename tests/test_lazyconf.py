@@ -0,0 +1,69 @@
+import json
+import pytest
+
+from nanorc.utils import get_json_recursive
+from nanorc.lazyconf import LazyConfigData, to_dict, write_bundle, is_bundle, bundle_suffix
+
+'''
+The lazy views of the configuration directories and bundles have to give the same configuration
+as reading the whole directory, while only reading the files which are asked for.
+'''
+
+@pytest.fixture
+def config_dir(tmp_path):
+    path = tmp_path/'config'
+    (path/'data').mkdir(parents=True)
+    (path/'subdir').mkdir()
+    files = {
+        'boot.json': {'apps': {'app0': {'port': 3333}, 'app1': {'port': 3334}}},
+        'app0.json': {'custom': {'x': 1}},
+        'data/app0_init.json': {'modules': [1, 2]},
+        'data/app0_conf.json': {'a': None},
+        'data/app1_init.json': {'modules': []},
+        'data/app1_start_run.json': {'run': 0},
+        'subdir/other.json': {'y': 2},
+    }
+    for name, content in files.items():
+        with open(path/name, 'w') as f:
+            json.dump(content, f)
+    (path/'README.txt').write_text('not json')
+    return path
+
+
+def test_same_as_reading_everything(config_dir):
+    assert to_dict(LazyConfigData(str(config_dir))) == get_json_recursive(config_dir)
+
+
+def test_files_are_read_when_asked_for(config_dir):
+    conf = LazyConfigData(str(config_dir))
+    assert set(conf) == {'boot', 'app0', 'app1', 'subdir'}
+    assert conf.loaded == {}
+
+    assert conf['app0']['init'] == {'modules': [1, 2]}
+    assert conf['app0']['custom'] == {'x': 1} # from app0.json
+    assert list(conf.loaded) == ['app0']
+    assert list(conf['app0'].loaded) == ['init']
+    assert 'start_run' in conf['app1'] and 'conf' not in conf['app1']
+
+
+def test_peek_doesnt_keep_what_it_reads(config_dir):
+    conf = LazyConfigData(str(config_dir))
+    assert to_dict(conf, keep_loaded=False) == get_json_recursive(config_dir)
+    assert conf.loaded == {}
+
+
+def test_bundle_roundtrip(config_dir, tmp_path):
+    bundle = str(tmp_path/f'config{bundle_suffix}')
+    manifest = write_bundle(str(config_dir), bundle)
+    assert manifest['n_files'] == 7 # not the README
+    assert is_bundle(bundle)
+    assert not is_bundle(str(config_dir/'boot.json'))
+
+    conf = LazyConfigData(bundle)
+    assert conf.is_bundle()
+    assert to_dict(conf) == to_dict(LazyConfigData(str(config_dir)))
+
+
+def test_bundle_of_nothing(tmp_path):
+    with pytest.raises(RuntimeError):
+        write_bundle(str(tmp_path), str(tmp_path/f'empty{bundle_suffix}'))
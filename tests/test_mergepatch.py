@@ -0,0 +1,53 @@
+import pytest
+
+from nanorc.mergepatch import make_merge_patch, apply_merge_patch, UnrepresentableChange
+
+'''
+The ConfServer sends and applies these patches instead of whole configurations,
+so applying the patch made between two configurations has to give back the second one exactly.
+'''
+
+def roundtrip(old, new):
+    patch = make_merge_patch(old, new)
+    return apply_merge_patch(old, patch) if patch else old
+
+
+def test_changed_and_removed_keys():
+    old = {'a': {'x': 1, 'y': 2}, 'b': 3, 'c': 'same'}
+    new = {'a': {'x': 1, 'y': 4}, 'c': 'same', 'd': {'z': True}}
+    assert make_merge_patch(old, new) == {'a': {'y': 4}, 'b': None, 'd': {'z': True}}
+    assert roundtrip(old, new) == new
+
+
+def test_no_change():
+    old = {'a': {'x': [1, 2]}}
+    assert make_merge_patch(old, {'a': {'x': [1, 2]}}) is None
+
+
+def test_lists_are_replaced():
+    old = {'a': {'l': [1, {'k': 2}, 3]}}
+    new = {'a': {'l': [1, {'k': 5}]}}
+    assert make_merge_patch(old, new) == {'a': {'l': [1, {'k': 5}]}}
+    assert roundtrip(old, new) == new
+
+
+def test_nulls_in_lists_are_kept():
+    old = {'a': {'l': [1]}}
+    new = {'a': {'l': [None, {'k': None}]}}
+    assert roundtrip(old, new) == new
+
+
+def test_unchanged_nulls_are_kept():
+    old = {'a': {'x': 1, 'y': None}}
+    new = {'a': {'x': 2, 'y': None}}
+    assert roundtrip(old, new) == new
+
+
+@pytest.mark.parametrize('old, new', [
+    ({'a': {'x': 1, 'y': None}}, {'a': {'x': 2, 'y': None, 'z': None}}), # added as null
+    ({'a': {'x': 1}}, {'a': {'x': None}}), # changed to null
+    ({'a': 1}, {'a': {'b': {'c': None}}}), # null in a new dictionary
+])
+def test_nulls_are_unrepresentable(old, new):
+    with pytest.raises(UnrepresentableChange):
+        make_merge_patch(old, new)
@@ -0,0 +1,125 @@
+import time
+import pytest
+
+from nanorc.perfhistory import PerfHistory, DeadlinePredictor, find_regressions, percentile, deadline_failure
+
+'''
+The local history of the transition timings: what nano-perf-history shows, and what the adaptive timeouts learn from.
+'''
+
+@pytest.fixture
+def history(tmp_path):
+    history = PerfHistory(str(tmp_path/'history.sqlite'))
+    yield history
+    history.close()
+
+
+def add_transition(history, start, reply_times:dict, command='conf', node='subsystem', config_hash='h0', software_version='v1', too_slow=()):
+    apps = {
+        app: {
+            'send_time': 0.01,
+            'reply_time': reply_time,
+            'status': 'ok' if reply_time is not None and app not in too_slow else 'failed',
+            'failure': deadline_failure if app in too_slow else (None if reply_time is not None else 'no reply'),
+        }
+        for app, reply_time in reply_times.items()
+    }
+    record = {'node': node, 'command': command, 'start': start, 'duration': 1., 'status': 'ok', 'apps': apps}
+    return history.add(record, 'apparatus', config_hash, software_version)
+
+
+def test_percentile():
+    assert percentile([], 50) is None
+    assert percentile([3.], 99) == 3.
+    assert percentile([4., 1., 3., 2.], 50) == 2.5
+    assert percentile([1., 2., 3., 4., 5.], 100) == 5.
+    assert percentile(list(range(101)), 90) == 90
+
+
+def test_app_timings(history):
+    now = time.time()
+    add_transition(history, now-10, {'a': 1., 'b': None})
+    add_transition(history, now-5, {'a': 2.}, command='start')
+
+    timings = history.app_timings()
+    assert [(t['command'], t['app'], t['reply_time']) for t in timings] == [('conf', 'a', 1.), ('start', 'a', 2.)]
+    assert len(history.app_timings(only_ok=False)) == 3
+    assert len(history.app_timings(command='start')) == 1
+    assert len(history.app_timings(since=now-7)) == 1
+
+
+def test_reply_times_only_the_last_transitions(history):
+    for i in range(50):
+        add_transition(history, i, {'a': float(i), 'b': None if i%2 else float(i)})
+    add_transition(history, 100, {'a': 100.}, config_hash='h1')
+
+    times = history.reply_times('apparatus', 'subsystem', 'conf', last=10, config_hash='h0')
+    assert times['a'] == [float(i) for i in range(40, 50)]
+    # the failed replies don't count
+    assert times['b'] == [float(i) for i in range(40, 50, 2)]
+    assert history.reply_times('apparatus', 'subsystem', 'conf', last=1) == {'a': [100.]}
+    assert history.reply_times('apparatus', 'subsystem', 'start') == {}
+
+
+def test_prune(history):
+    now = time.time()
+    add_transition(history, now-10*86400, {'a': 1.})
+    add_transition(history, now, {'a': 1.})
+    assert history.prune(5) == 1
+    assert len(history.app_timings()) == 1
+
+
+def test_regressions(history):
+    for i in range(20):
+        add_transition(history, i, {'steady': 1., 'slower': 1.})
+    for i in range(20, 25):
+        add_transition(history, i, {'steady': 1.1, 'slower': 3.}, config_hash='h1')
+
+    regressions = find_regressions(history.app_timings())
+    assert [r['app'] for r in regressions] == ['slower']
+    assert regressions[0]['ratio'] == 3.
+    assert regressions[0]['config_changed']
+    # not enough history
+    assert find_regressions(history.app_timings(since=11)) == []
+
+
+def test_deadlines(history):
+    for i in range(30):
+        add_transition(history, i, {'fast': 0.1, 'usual': 5.+i%2, 'new': 1. if i >= 25 else None})
+    predictor = DeadlinePredictor(history, 'apparatus', config_hashes={'subsystem': 'h0'}, software_version='v1', factor=3, floor=10, min_samples=20)
+
+    deadlines = predictor.deadlines('subsystem', 'conf', timeout=60)
+    # at least the floor
+    assert deadlines['fast'][0] == 10
+    # factor x the quantile
+    assert deadlines['usual'][0] == pytest.approx(3*percentile([5., 6.]*15, 99))
+    assert deadlines['usual'][2] == 30
+    # not enough replies to learn from
+    assert 'new' not in deadlines
+    # the timeout stays the upper bound
+    assert 'usual' not in predictor.deadlines('subsystem', 'conf', timeout=15)
+
+    # nothing learned for another configuration or software version
+    assert DeadlinePredictor(history, 'apparatus', config_hashes={'subsystem': 'h1'}, software_version='v1').deadlines('subsystem', 'conf', 60) == {}
+    assert DeadlinePredictor(history, 'apparatus', config_hashes={'subsystem': 'h0'}, software_version='v2').deadlines('subsystem', 'conf', 60) == {}
+
+
+def test_deadlines_learn_from_the_apps_too_slow(history):
+    for i in range(30):
+        add_transition(history, i, {'app': 1.})
+    predictor = DeadlinePredictor(history, 'apparatus', config_hashes={'subsystem': 'h0'}, software_version='v1', factor=3, floor=1, min_samples=20, last=30)
+    assert predictor.deadlines('subsystem', 'conf', timeout=60)['app'][0] == 3.
+
+    # it got slower, and was failed after its deadline each time
+    for i in range(30, 40):
+        add_transition(history, i, {'app': 3.1}, too_slow=('app',))
+    assert history.reply_times('apparatus', 'subsystem', 'conf', last=30)['app'][-1] == 3.1
+    deadline, usual, n = predictor.deadlines('subsystem', 'conf', timeout=60)['app']
+    assert usual == 3.1
+    assert n == 30
+
+    # capped at the timeout
+    for i in range(40, 70):
+        add_transition(history, i, {'app': 100.}, too_slow=('app',))
+    assert predictor.deadlines('subsystem', 'conf', timeout=60) == {}
+    assert percentile([min(t, 60) for t in history.reply_times('apparatus', 'subsystem', 'conf', last=30)['app']], 99) == 60
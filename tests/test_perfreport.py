@@ -0,0 +1,84 @@
+import time
+
+from nanorc.perfreport import TransitionRecord, PerfRecorder, find_stragglers, make_report, write_report, load_report, report_file_name
+
+'''
+The timings of the transitions, as recorded by the nodes and saved at the end of each run.
+'''
+
+def entry(reply_time, status='ok', failure=None):
+    return {'sent_at': 0., 'send_time': 0.01, 'reply_time': reply_time, 'status': status, 'failure': failure}
+
+
+def test_record():
+    record = TransitionRecord('subsystem', 'conf')
+    now = time.time()
+    record.sent('app0', now, now+0.1)
+    record.sent('app1', now, now+0.1)
+    record.sent('app3', now, now+0.1)
+    record.replied('app0')
+    record.replied('app1', at=now+1.6) # when the response was received
+    record.failed('app2', 'couldn\'t send')
+    record.finish('failed')
+
+    apps = record.to_dict()['apps']
+    assert apps['app0']['status'] == 'ok'
+    assert abs(apps['app0']['send_time']-0.1) < 1e-6
+    assert apps['app0']['reply_time'] is not None
+    assert abs(apps['app1']['reply_time']-1.5) < 1e-6
+    assert apps['app2']['failure'] == 'couldn\'t send'
+    # never replied
+    assert apps['app3']['status'] == 'failed'
+    assert apps['app3']['failure'] == 'no reply'
+    assert record.duration is not None
+
+
+def test_stragglers():
+    apps = {f'app{i}': entry(1.) for i in range(5)}
+    apps['slow'] = entry(5.)
+    apps['slower'] = entry(10.)
+    apps['a bit slow'] = entry(1.8) # within factor x the median
+    apps['failed'] = entry(None, 'failed', 'no reply')
+    assert find_stragglers(apps) == ['slower', 'slow']
+    # not enough replies to tell
+    assert find_stragglers({'a': entry(1.), 'b': entry(10.)}) == []
+    # above factor x the median, but not by margin seconds
+    assert find_stragglers({'a': entry(0.1), 'b': entry(0.1), 'c': entry(0.5)}) == []
+
+
+def test_recorder_report_and_listeners():
+    finished = []
+    recorder = PerfRecorder()
+    recorder.add_listener(finished.append)
+    recorder.add_listener(lambda record: 1/0) # shouldn't stop the others
+
+    done = recorder.begin('top', 'stop')
+    done.finish('ok')
+    ongoing = recorder.begin('top', 'start')
+    assert finished == [done]
+
+    report = recorder.report('apparatus', 12)
+    assert [t['command'] for t in report['transitions']] == ['stop']
+    # the unfinished transitions go in the next report
+    ongoing.finish('ok')
+    assert [t['command'] for t in recorder.report('apparatus', 13)['transitions']] == ['start']
+    assert recorder.report('apparatus', 14)['transitions'] == []
+
+
+def test_report_roundtrip(tmp_path):
+    apps = {f'app{i}': entry(float(i+1)) for i in range(4)}
+    apps['dead'] = entry(None, 'failed', 'no reply')
+    record = {'node': 'top', 'command': 'conf', 'start': time.time(), 'duration': 5., 'status': 'failed', 'apps': apps}
+    report = make_report('apparatus', 3, [record])
+
+    transition = report['transitions'][0]
+    assert transition['n_apps'] == 5
+    assert transition['median_reply_time'] == 2.5
+    assert transition['max_reply_time'] == 4.
+    assert transition['failed'] == ['dead']
+
+    path = write_report(report, str(tmp_path/'RunConf_3'))
+    assert path.endswith(report_file_name)
+    assert load_report(path) == report
+    with open(path.replace('.json', '.txt')) as f:
+        assert 'Transitions of run #3 on apparatus' in f.read()
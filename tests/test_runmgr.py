@@ -0,0 +1,62 @@
+import threading
+import time
+import pytest
+
+from nanorc.credmgr import credentials
+from nanorc.runmgr import DBRunNumberManager
+
+'''
+The run numbers reserved in advance which aren't used are closed in the run number DB, so they appear as void runs.
+'''
+
+@pytest.fixture
+def run_number_manager():
+    credentials.add_login('run_number', {'type': 'simple', 'user': 'nanorc', 'password': 'secret'})
+    rnm = DBRunNumberManager('http://run-number-db', prefetch=True)
+    rnm.timeout = 0.1
+    rnm.voided = []
+    rnm._update_stop = rnm.voided.append # no run number DB here
+    yield rnm
+    rnm.terminate()
+
+
+def test_reserved_run_number(run_number_manager):
+    run_number_manager._getnew_run_number = lambda set_current=True: 12
+    run_number_manager.prefetch_next()
+    assert run_number_manager.get_run_number() == 12
+    run_number_manager.terminate()
+    assert run_number_manager.voided == []
+
+
+def test_prefetch_timing_out(run_number_manager):
+    slow = threading.Event()
+    def getnew(set_current=True):
+        if set_current:
+            return 13
+        slow.wait(10)
+        return 12
+    run_number_manager._getnew_run_number = getnew
+
+    run_number_manager.prefetch_next()
+    assert run_number_manager.get_run_number() == 13
+    assert run_number_manager.voided == []
+
+    # the prefetch ends up reserving a number, which is never used
+    slow.set()
+    deadline = time.time()+10
+    while not run_number_manager.voided and time.time() < deadline:
+        time.sleep(0.01)
+    assert run_number_manager.voided == [12]
+
+
+def test_prefetch_failing(run_number_manager):
+    def getnew(set_current=True):
+        if set_current:
+            return 13
+        raise RuntimeError('no run number DB')
+    run_number_manager._getnew_run_number = getnew
+
+    run_number_manager.prefetch_next()
+    assert run_number_manager.get_run_number() == 13
+    run_number_manager.terminate()
+    assert run_number_manager.voided == []